@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""Merge SCAMP head file solutions into the headers of MEF files in place.
+"""
+
+import argparse
+import despyfitsutils.fitsutils as fitsutils
+
+
+def read_list(listname):
+    """Read (head file, MEF) pairs from list file, one pair per line.
+    """
+    pairs = []
+    with open(listname, 'r') as listfh:
+        for line in listfh:
+            words = line.split()
+            if words:
+                pairs.append((words[0], words[1]))
+    return pairs
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Merge SCAMP head file solutions into MEF headers')
+    parser.add_argument('--head', action='store', help='SCAMP head file')
+    parser.add_argument('--mef', action='store', help='MEF file to update')
+    parser.add_argument('--list', action='store',
+                        help='list file with a head file and a MEF file on each line')
+    parser.add_argument('--nproc', action='store', type=int, default=1,
+                        help='number of worker processes used with --list')
+
+    args = vars(parser.parse_args())   # convert dict
+
+    pairs = []
+    if args['head'] is not None and args['mef'] is not None:
+        pairs.append((args['head'], args['mef']))
+    if args['list'] is not None:
+        pairs.extend(read_list(args['list']))
+    if not pairs:
+        parser.error('must provide --head and --mef, or --list')
+
+    results = fitsutils.apply_scamp_heads(pairs, nproc=args['nproc'])
+    for (head, mef), inplace in zip(pairs, results):
+        print("Applied %s to %s (%s)" % (head, mef, "in place" if inplace else "rewritten"))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,16 @@ def read_list(listname):
     return [f.strip() for f in incats]
 
 
+def parse_size(text):
+    """Turn a byte count such as 500000000, 500M or 2G into an int.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
 def main():
     """Entry point.
     """
@@ -25,6 +35,30 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--list', action='store')
     group.add_argument('--incats', action='store')
+    parser.add_argument('--mode', action='store', default='stream', choices=['stream', 'astropy', 'merge'],
+                        help='stream copies HDU bytes without decoding them, astropy rebuilds the file, '
+                        'merge joins the LDAC_OBJECTS tables into a single table')
+    parser.add_argument('--columns', action='store', default=None,
+                        help='comma-separated list of the columns to keep (merge mode)')
+    parser.add_argument('--chunk_rows', action='store', type=int, default=fitsutils.MERGE_CHUNK_ROWS,
+                        help='number of rows copied at a time (merge mode)')
+    parser.add_argument('--checksum', action='store_true', default=False,
+                        help='write CHECKSUM and DATASUM keywords, computed while writing')
+    parser.add_argument('--compress', action='store', default=None,
+                        choices=['RICE_1', 'GZIP_1', 'GZIP_2', 'HCOMPRESS_1', 'PLIO_1'],
+                        help='tile-compress image HDUs (stream mode; tables are not compressed)')
+    parser.add_argument('--nproc', action='store', type=int, default=1,
+                        help='number of processes compressing images and checking inputs')
+    parser.add_argument('--preflight', action='store_true', default=False,
+                        help='check the headers of all catalogs before writing')
+    parser.add_argument('--index', action='store_true', default=False,
+                        help='save the HDU offsets of the output in a .hduindex sidecar file')
+    parser.add_argument('--max_bytes', action='store', type=parse_size, default=None,
+                        help='split the output into shards of at most this size (e.g. 2G; stream mode)')
+    parser.add_argument('--max_hdus', action='store', type=int, default=None,
+                        help='split the output into shards of at most this many HDUs (stream mode)')
+    parser.add_argument('--manifest', action='store', default=None,
+                        help='manifest of the shards (default <outcat>_manifest.json)')
 
     args = vars(parser.parse_args())   # convert dict
 
@@ -33,7 +67,15 @@ def main():
         incats = ','.join(read_list(args['list']))
 
     print("Combining catalogs into %s" % (args['outcat']))
-    fitsutils.combine_cats(incats, args['outcat'])
+    manifest = fitsutils.combine_cats(incats, args['outcat'], mode=args['mode'], columns=args['columns'],
+                                      chunk_rows=args['chunk_rows'], checksum=args['checksum'],
+                                      compress=args['compress'], nproc=args['nproc'],
+                                      preflight=args['preflight'], index=args['index'],
+                                      max_bytes=args['max_bytes'], max_hdus=args['max_hdus'],
+                                      manifest=args['manifest'])
+    if manifest is not None:
+        for shard in manifest['shards']:
+            print("Wrote %s (%d catalogs, %d bytes)" % (shard['filename'], len(shard['incats']), shard['bytes']))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""Set, update or delete header keywords of fits files in place.
+"""
+
+import argparse
+import math
+import despyfitsutils.fitsutils as fitsutils
+import despyfitsutils.harvest as harvest
+
+
+def parse_value(text):
+    """Turn a value given on the command line into an int, float, bool or string.
+
+    T and F are booleans, as in fits headers; quotes around a string are
+    removed.  NaN and infinite numbers cannot be written to a fits header
+    and raise ValueError.
+    """
+    text = text.strip()
+    for conv in (int, float):
+        try:
+            value = conv(text)
+        except ValueError:
+            continue
+        if not math.isfinite(value):
+            raise ValueError("Cannot write %s to a fits header, quote it to store a string" % text)
+        return value
+    if text in ('T', 'F'):
+        return text == 'T'
+    if len(text) > 1 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    return text
+
+
+def find_comment(value):
+    """Return the index of the ' / ' starting the comment in value, -1 if none.
+
+    A ' / ' inside a quoted string is part of the value.
+    """
+    quote = None
+    for i, char in enumerate(value):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif value.startswith(' / ', i):
+            return i
+    return -1
+
+
+def parse_assignment(text):
+    """Split a 'KEY=VALUE' or 'KEY=VALUE / COMMENT' argument.
+
+    Returns (keyword, value, comment), comment None if not given.
+    """
+    if '=' not in text:
+        raise ValueError("Expected KEY=VALUE, got %s" % text)
+    keyword, value = text.split('=', 1)
+    comment = None
+    pos = find_comment(value)
+    if pos >= 0:
+        value, comment = value[:pos], value[pos + 3:].strip()
+    return keyword.strip(), parse_value(value), comment
+
+
+def build_edits(whichhdu, actions):
+    """Turn the (action, argument) pairs of the command line into HeaderEdits.
+
+    The edits are applied in the order they were given.
+    """
+    edits = []
+    for action, text in actions:
+        if action == 'delete':
+            edits.append(fitsutils.HeaderEdit(whichhdu, action, text.strip()))
+        else:
+            keyword, value, comment = parse_assignment(text)
+            edits.append(fitsutils.HeaderEdit(whichhdu, action, keyword, value, comment))
+    return edits
+
+
+def read_list(listname):
+    """Read (file, edits) from list file.
+
+    Each line holds a file name, an HDU (number or EXTNAME), an action
+    (set, update or delete) and a keyword, followed for set and update by
+    VALUE or VALUE / COMMENT.
+    """
+    jobs = []
+    with open(listname, 'r') as listfh:
+        for line in listfh:
+            words = line.split(None, 4)
+            if not words or words[0].startswith('#'):
+                continue
+            if len(words) < 4:
+                raise ValueError("Bad line in %s: %s" % (listname, line.strip()))
+            filename, whichhdu, action, keyword = words[:4]
+            value = comment = None
+            if len(words) > 4:
+                keyword, value, comment = parse_assignment("%s=%s" % (keyword, words[4]))
+            jobs.append((filename, [fitsutils.HeaderEdit(whichhdu, action.lower(), keyword, value, comment)]))
+    return jobs
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Set, update or delete header keywords of fits files in place')
+    parser.add_argument('files', nargs='*', help='fits files or glob patterns (quote them)')
+    parser.add_argument('--hdu', action='store', default='0',
+                        help='HDU number or EXTNAME edited by --set, --update and --delete')
+    # all three store (action, argument) in one list to keep their order
+    parser.add_argument('--set', action='append', dest='edits', default=[],
+                        type=lambda text: ('set', text), metavar='KEY=VALUE[ / COMMENT]',
+                        help='set a keyword, adding it if missing (may be repeated)')
+    parser.add_argument('--update', action='append', dest='edits', default=[],
+                        type=lambda text: ('update', text), metavar='KEY=VALUE[ / COMMENT]',
+                        help='change a keyword already in the header (may be repeated)')
+    parser.add_argument('--delete', action='append', dest='edits', default=[],
+                        type=lambda text: ('delete', text), metavar='KEY',
+                        help='delete a keyword (may be repeated)')
+    parser.add_argument('--list', action='store',
+                        help='list file with a file, HDU, action, keyword and value on each line')
+    parser.add_argument('--ignore_missing', action='store_true', default=False,
+                        help='skip updates and deletes of keywords not in the header')
+    parser.add_argument('--shift', action='store_true', default=False,
+                        help='when a header needs more blocks, move the rest of the file in place '
+                             'rather than rewriting it to a new file')
+    parser.add_argument('--nproc', action='store', type=int, default=1,
+                        help='number of worker processes')
+
+    args = vars(parser.parse_args())   # convert dict
+
+    try:
+        edits = build_edits(args['hdu'], args['edits'])
+    except ValueError as err:
+        parser.error(str(err))
+
+    files = harvest.expand_files(args['files'])
+    if files and not edits:
+        parser.error('no --set, --update or --delete given')
+    jobs = [(filename, edits) for filename in files]
+    if args['list'] is not None:
+        jobs.extend(read_list(args['list']))
+    if not jobs:
+        parser.error('no input files')
+
+    results = fitsutils.edit_headers(jobs, nproc=args['nproc'],
+                                     errors='ignore' if args['ignore_missing'] else 'raise',
+                                     fallback='shift' if args['shift'] else 'rewrite')
+    for filename, inplace in results.items():
+        print("Edited %s (%s)" % (filename, "in place" if inplace else
+                                  "shifted" if args['shift'] else "rewritten"))
+
+
+if __name__ == '__main__':
+    main()
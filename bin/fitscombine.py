@@ -15,6 +15,29 @@ if __name__ == "__main__":
                         help="List of EXTNAME to use for each file.")
     parser.add_argument("--clobber", action='store_true', default=False,
                         help="Clobber output MEF fits file")
+    parser.add_argument("--max_memory", type=int, default=None,
+                        help="Maximum bytes of input image data held in memory at once.")
+    parser.add_argument("--passthrough", action='store_true', default=False,
+                        help="Copy (fpacked) input HDUs as they are, without decompressing them.")
+    parser.add_argument("--nostream", dest='stream', action='store_false', default=True,
+                        help="Read all inputs before writing the MEF.")
+    parser.add_argument("--checksum", action='store_true', default=False,
+                        help="Write CHECKSUM and DATASUM keywords, computed while writing.")
+    parser.add_argument("--compress", default=None, choices=['RICE_1', 'GZIP_1', 'GZIP_2', 'HCOMPRESS_1', 'PLIO_1'],
+                        help="Write tile-compressed image extensions with this algorithm.")
+    parser.add_argument("--quantize_level", type=float, default=None,
+                        help="Quantization level of compressed floating point images (default 4).")
+    parser.add_argument("--quantize_method", default=None,
+                        choices=['NO_DITHER', 'SUBTRACTIVE_DITHER_1', 'SUBTRACTIVE_DITHER_2'],
+                        help="Dithering of quantized images (default SUBTRACTIVE_DITHER_1).")
+    parser.add_argument("--tile_shape", type=int, nargs='+', default=None,
+                        help="Compression tile shape, in numpy (y, x) order (default row by row).")
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="Number of processes compressing images and checking inputs.")
+    parser.add_argument("--preflight", action='store_true', default=False,
+                        help="Check the headers of all inputs before writing.")
+    parser.add_argument("--index", action='store_true', default=False,
+                        help="Save the HDU offsets of the output in a .hduindex sidecar file.")
     args = parser.parse_args()
     kwargs = vars(args)
     despyfitsutils.makeMEF(**kwargs)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Harvest header keywords from many fits files into a table.
+"""
+
+import argparse
+import despyfitsutils.harvest as harvest
+
+
+def read_list(listname):
+    """Read input file names from list file.
+    """
+    files = []
+    with open(listname, 'r') as listfh:
+        files = listfh.readlines()
+
+    # Strip \n from list if present
+    return [f.strip() for f in files if f.strip()]
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Harvest header keywords from fits files into a table')
+    parser.add_argument('files', nargs='*', help='fits files or glob patterns (quote them)')
+    parser.add_argument('--list', action='store', help='list file with one fits file per line')
+    parser.add_argument('--keys', action='store', default='',
+                        help='comma-separated list of header keywords')
+    parser.add_argument('--special', action='store', default='',
+                        help='comma-separated list of special metadata keys (band, nite, radeg, ...)')
+    parser.add_argument('--hdu', action='store', default=None, help='HDU index or EXTNAME')
+    parser.add_argument('--nproc', action='store', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunksize', action='store', type=int, default=None,
+                        help='number of files handed to a worker at a time')
+    parser.add_argument('--outfile', action='store', required=True,
+                        help='output table (.fits or .csv)')
+    parser.add_argument('--format', action='store', choices=['fits', 'csv'], default=None,
+                        help='output format, guessed from --outfile by default')
+    parser.add_argument('--clobber', action='store_true', default=False,
+                        help='overwrite the output table')
+
+    args = vars(parser.parse_args())   # convert dict
+
+    files = args['files']
+    if args['list'] is not None:
+        files = files + read_list(args['list'])
+    keys = [k for k in args['keys'].split(',') if k]
+    special = [k for k in args['special'].split(',') if k]
+    if not keys and not special:
+        parser.error('must provide --keys and/or --special')
+
+    table = harvest.harvest_headers(files, keys, whichhdu=args['hdu'], special=special,
+                                    nproc=args['nproc'], chunksize=args['chunksize'])
+    harvest.write_table(table, args['outfile'], fmt=args['format'], clobber=args['clobber'])
+    nerr = (table['ERROR'] != '').sum()
+    print("Harvested %d files into %s (%d with errors)" % (len(table), args['outfile'], nerr))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+"""Write the HDU offset index sidecar of fits files.
+"""
+
+import argparse
+import despyfitsutils.harvest as harvest
+import despyfitsutils.hduindex as hduindex
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Write the .hduindex sidecar of fits files, for direct '
+                                                 'access to any of their HDUs')
+    parser.add_argument('files', nargs='+', help='fits files or glob patterns (quote them)')
+    parser.add_argument('--verbose', action='store_true', default=False,
+                        help='print the offsets of every HDU')
+
+    args = vars(parser.parse_args())   # convert dict
+
+    for filename in harvest.expand_files(args['files']):
+        index = hduindex.write_index(filename)
+        print("Indexed %d HDUs of %s" % (len(index), filename))
+        if args['verbose']:
+            for entry in index.entries:
+                print("    HDU %d %-16s header at %d, %d data bytes at %d" % (
+                    entry.index, entry.name, entry.header_offset, entry.data_size, entry.data_offset))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Maintain and query an SQLite index of fits header keywords.
+"""
+
+import argparse
+import despyfitsutils.hdrindex as hdrindex
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Maintain and query an SQLite index of fits header keywords')
+    parser.add_argument('--db', action='store', required=True, help='SQLite index file')
+    parser.add_argument('--update', action='store', nargs='+', default=None,
+                        help='directories and/or files to (re-)index')
+    parser.add_argument('--pattern', action='store', default='*.fits*',
+                        help='file name pattern to index in directories')
+    parser.add_argument('--keys', action='store', default='',
+                        help='comma-separated list of header keywords to index')
+    parser.add_argument('--special', action='store', default=None,
+                        help='comma-separated list of special metadata keys to index')
+    parser.add_argument('--hdu', action='store', default=None, help='HDU index or EXTNAME')
+    parser.add_argument('--nproc', action='store', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--noprune', action='store_false', dest='prune', default=True,
+                        help='keep index entries of files which no longer exist')
+    parser.add_argument('--where', action='store', default=None,
+                        help='SQL condition selecting the files to print, e.g. "band = \'r\'"')
+    parser.add_argument('--columns', action='store', default='path',
+                        help='comma-separated list of columns to print')
+
+    args = vars(parser.parse_args())   # convert dict
+
+    keys = [k for k in args['keys'].split(',') if k]
+    special = None
+    if args['special'] is not None:
+        special = [k for k in args['special'].split(',') if k]
+
+    with hdrindex.HeaderIndex(args['db'], keys, special, args['hdu']) as index:
+        if args['update']:
+            counts = index.update(args['update'], pattern=args['pattern'], nproc=args['nproc'],
+                                  prune=args['prune'])
+            print("Indexed %(added)d new, %(updated)d changed, %(unchanged)d unchanged files, "
+                  "removed %(removed)d" % counts)
+        if args['where'] is not None:
+            columns = [c for c in args['columns'].split(',') if c]
+            for row in index.query(args['where'], columns=columns):
+                print(' '.join([str(row[c]) for c in columns]))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,42 +4,164 @@
 """
 
 import argparse
-import os
+import collections
+import concurrent.futures
+import fnmatch
 import sys
 import fitsio
 
 
+def parse_extensions(extension):
+    """Turn the --extension argument into a list of selectors.
+
+    'all' selects every HDU, otherwise a comma-separated list of HDU
+    numbers, EXTNAMEs and EXTNAME patterns (fnmatch, case insensitive)
+    is expected.  Returns None for 'all'.
+    """
+    if str(extension).lower() == 'all':
+        return None
+    selectors = []
+    for ext in str(extension).split(','):
+        ext = ext.strip()
+        # Convert extension to integers in not strings
+        try:
+            selectors.append(int(ext))
+        except ValueError:
+            selectors.append(ext.upper())
+    return selectors
+
+
+def select_hdus(fits, selectors):
+    """Return the (number, extname) of the HDUs of an open file matching selectors.
+    """
+    hdus = [(k, hdu.get_extname()) for k, hdu in enumerate(fits)]
+    if selectors is None:
+        return hdus
+
+    selected = []
+    for sel in selectors:
+        if isinstance(sel, int):
+            if not -len(hdus) <= sel < len(hdus):
+                raise IndexError("No HDU %d (file has %d HDUs)" % (sel, len(hdus)))
+            matches = [hdus[sel]]
+        else:
+            matches = [(k, name) for k, name in hdus if fnmatch.fnmatchcase(name.upper(), sel)]
+            if not matches:
+                raise KeyError("No HDU with EXTNAME matching %s" % sel)
+        selected.extend([m for m in matches if m not in selected])
+    return selected
+
+
+def filter_header(hdr, keywords):
+    """Return a header with only the cards whose name matches one of keywords.
+    """
+    if not keywords:
+        return hdr
+    records = [r for r in hdr.records()
+               if any([fnmatch.fnmatchcase(r['name'].upper(), k) for k in keywords])]
+    return fitsio.FITSHDR(records)
+
+
+def read_headers(fitsfile, selectors, keywords=None, banner=False):
+    """Return the formatted headers of the selected HDUs of one file.
+
+    Each header is preceded by a banner naming the file and HDU if banner
+    is set or more than one HDU of the file is selected.  Errors are
+    returned as text instead of raised so that one bad file does not stop
+    the others; the second element of the returned tuple tells whether
+    there was one.
+    """
+    text = []
+    try:
+        with fitsio.FITS(fitsfile) as fits:
+            hdus = select_hdus(fits, selectors)
+            banner = banner or len(hdus) > 1
+            for k, extname in hdus:
+                hdr = filter_header(fits[k].read_header(), keywords)
+                if banner:
+                    text.append("==> %s[%d] %s <==\n" % (fitsfile, k, extname))
+                text.append("%s\n" % hdr)
+    except Exception as err:
+        return ''.join(text), "ERROR: %s: %s: %s\n" % (fitsfile, type(err).__name__, err)
+    return ''.join(text), None
+
+
+def iter_headers(fitsfiles, selectors, keywords=None, banner=False, nproc=1):
+    """Yield read_headers() results for each file, in the order of fitsfiles.
+
+    With nproc > 1 the files are read by worker processes, at most a few
+    files ahead of the one being printed, so output starts right away
+    and memory stays bounded however many files there are.
+    """
+    if nproc <= 1:
+        for fitsfile in fitsfiles:
+            yield read_headers(fitsfile, selectors, keywords, banner)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        pending = collections.deque()
+        for fitsfile in fitsfiles:
+            pending.append(pool.submit(read_headers, fitsfile, selectors, keywords, banner))
+            if len(pending) >= 4 * nproc:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def print_header(fitsfile, ext=0, ofileh=sys.stdout):
     """Print header from fits file to either stdout or to a file.
     """
     hdr = fitsio.read_header(fitsfile, ext=ext)
     ofileh.write("%s" % hdr)
     ofileh.write("\n")
-    outfh.close()
     return
 
 
-if __name__ == "__main__":
+def main():
+    """Entry point.
+    """
     parser = argparse.ArgumentParser(description='Prints fits headers')
     parser.add_argument('-o', '--outfile', action='store', type=str,
                         help="Print header to given file", default=False)
-    parser.add_argument('-x', '--extension', action='store', default=0)
-    parser.add_argument('fitsfile', action='store')
+    parser.add_argument('-x', '--extension', action='store', default='0',
+                        help="HDU numbers, EXTNAMEs or EXTNAME patterns (comma-separated), or 'all'")
+    parser.add_argument('-k', '--keywords', action='store', default=None,
+                        help="comma-separated list of keywords or keyword patterns to print")
+    parser.add_argument('-n', '--nproc', action='store', type=int, default=1,
+                        help="number of worker processes reading files")
+    parser.add_argument('fitsfile', action='store', nargs='+')
     args = parser.parse_args()
 
     if args.outfile:
         try:
             outfh = open(args.outfile, "w")
-        except:
+        except OSError:
             sys.exit("ERROR: Cannot open %s" % args.outfile)
     else:
         outfh = sys.stdout
 
-    # Convert extension to integers in not strings
+    selectors = parse_extensions(args.extension)
+    keywords = None
+    if args.keywords:
+        keywords = [k.strip().upper() for k in args.keywords.split(',')]
+    # a single file gets banners only if more than one of its HDUs is selected
+    banner = len(args.fitsfile) > 1
+
+    nerr = 0
     try:
-        args.extension = int(args.extension)
-    except:
-        pass
+        for text, error in iter_headers(args.fitsfile, selectors, keywords, banner, args.nproc):
+            outfh.write(text)
+            outfh.flush()
+            if error:
+                nerr += 1
+                sys.stderr.write(error)
+    finally:
+        if outfh is not sys.stdout:
+            outfh.close()
 
-    # Make the call
-    print_header(args.fitsfile, ext=args.extension, ofileh=outfh)
+    if nerr:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Verify the CHECKSUM and DATASUM keywords of fits files.
+"""
+
+import argparse
+import sys
+import despyfitsutils.checksums as checksums
+import despyfitsutils.harvest as harvest
+
+
+def read_list(listname):
+    """Read input file names from list file.
+    """
+    files = []
+    with open(listname, 'r') as listfh:
+        files = listfh.readlines()
+
+    # Strip \n from list if present
+    return [f.strip() for f in files if f.strip()]
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Verify the CHECKSUM and DATASUM keywords of fits files')
+    parser.add_argument('files', nargs='*', help='fits files or glob patterns (quote them)')
+    parser.add_argument('--list', action='store', help='list file with one fits file per line')
+    parser.add_argument('--nproc', action='store', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunksize', action='store', type=int, default=None,
+                        help='number of files handed to a worker at a time')
+    parser.add_argument('--verbose', action='store_true', default=False,
+                        help='print the result of every HDU')
+
+    args = vars(parser.parse_args())   # convert dict
+
+    files = harvest.expand_files(args['files'])
+    if args['list'] is not None:
+        files = files + read_list(args['list'])
+    if not files:
+        parser.error('no input files')
+
+    status = {True: 'ok', False: 'BAD', None: 'missing'}
+    nbad = 0
+    for filename, (results, error) in zip(files, checksums.verify_checksums(files, args['nproc'],
+                                                                           args['chunksize'])):
+        if error:
+            nbad += 1
+            print("%s: %s" % (filename, error))
+        elif args['verbose']:
+            print("%s: ok" % filename)
+        if args['verbose']:
+            for res in results:
+                print("    HDU %d %-16s DATASUM %-7s CHECKSUM %s" % (res.index, res.name, status[res.datasum],
+                                                                     status[res.checksum]))
+    print("Verified %d files (%d with errors)" % (len(files), nbad))
+    sys.exit(1 if nbad else 0)
+
+
+if __name__ == '__main__':
+    main()
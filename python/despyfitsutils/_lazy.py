@@ -0,0 +1,54 @@
+"""Deferred imports of the heavy dependencies (astropy, numpy, despymisc).
+
+Importing astropy.io.fits alone takes a few tenths of a second, which
+every short-lived bin script paid even for --help.  A LazyModule stands
+in for a module and imports it on first attribute access, so the cost is
+only paid by code which actually uses the module.
+"""
+
+import importlib
+import threading
+
+
+class LazyModule(object):
+    """Proxy for a module which is imported when one of its attributes is used.
+
+    Attributes are cached on the proxy after the first lookup, so later
+    accesses cost the same as on the module itself.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with LazyModule._lock:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_lazy_name'])
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        # only shadows the module attribute (e.g. mock.patch) for users of the proxy
+        self.__dict__[attr] = value
+
+    def __delattr__(self, attr):
+        self.__dict__.pop(attr, None)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return "<lazy module '%s' (%s)>" % (self.__dict__['_lazy_name'], state)
+
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""asyncio counterparts of the header and special metadata readers.
+
+The blocking readers of fitsutils and fits_special_metadata run on one
+shared, bounded thread pool, so an event loop can await them without
+stalling, and any number of files can be handled by a fixed number of
+threads.  The batch functions and aiter_completed() also keep at most
+concurrency files in flight at a time; cancelling them drops the reads
+which have not started yet.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+
+import despyfitsutils.fitsutils as fitsutils
+import despyfitsutils.fits_special_metadata as fits_special_metadata
+
+# Threads of the shared executor (the ThreadPoolExecutor default)
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Files a batch call has in flight at a time
+DEFAULT_CONCURRENCY = 64
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor():
+    """Return the shared executor, creating it on first use.
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS,
+                                                              thread_name_prefix='despyfitsutils-aio')
+        return _EXECUTOR
+
+
+def set_executor(executor):
+    """Make executor (any concurrent.futures.Executor) the shared executor.
+
+    Returns the previous one, which is not shut down.
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        old, _EXECUTOR = _EXECUTOR, executor
+    return old
+
+
+def shutdown_executor(wait=True):
+    """Shut the shared executor down; a new one is created when next needed.
+    """
+    executor = set_executor(None)
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def arun(func, *args, executor=None, **kwargs):
+    """Return an awaitable running func(*args, **kwargs) on an executor.
+
+    executor defaults to the shared one.  Cancelling the awaitable drops
+    the call if it has not started yet.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor or get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def aget_hdr(filename, whichhdu=None, executor=None):
+    """Return the header of an HDU of a file, as fitsutils.get_hdr.
+    """
+    return await arun(fitsutils.get_hdr, filename, whichhdu, executor=executor)
+
+
+async def aget_hdr_values(filename, keys, whichhdu=None, errors='raise', executor=None):
+    """Return dict upper case key --> value, as fitsutils.get_hdr_values.
+    """
+    return await arun(fitsutils.get_hdr_values, filename, keys, whichhdu, errors, executor=executor)
+
+
+async def aget_hdr_value(filename, key, whichhdu=None, executor=None):
+    """Return the value of one keyword, as fitsutils.get_hdr_value.
+    """
+    return await arun(fitsutils.get_hdr_value, filename, key, whichhdu, executor=executor)
+
+
+async def aget_special_metadata(filename, keys, whichhdu=None, errors='raise', executor=None):
+    """Return dict special key --> value, as fits_special_metadata.get_special_metadata.
+    """
+    return await arun(fits_special_metadata.get_special_metadata, filename, keys, whichhdu=whichhdu,
+                      errors=errors, executor=executor)
+
+
+def _call(func, filename, args, kwargs):
+    """Return (result, error) for func(filename, *args, **kwargs).
+    """
+    try:
+        return func(filename, *args, **kwargs), ''
+    except Exception as err:
+        return None, "%s: %s" % (type(err).__name__, err)
+
+
+async def _completed(func, items, args, kwargs, concurrency, executor):
+    """Yield (tag, filename, result, error) for (tag, filename) items, as calls finish.
+    """
+    items = iter(items)
+    pending = {}
+
+    def submit():
+        for tag, filename in items:
+            future = arun(_call, func, filename, args, kwargs, executor=executor)
+            pending[future] = (tag, filename)
+            return
+
+    try:
+        for _ in range(max(1, concurrency)):
+            submit()
+        while pending:
+            done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                tag, filename = pending.pop(future)
+                submit()
+                result, error = future.result()
+                yield tag, filename, result, error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def aiter_completed(func, files, *args, concurrency=DEFAULT_CONCURRENCY, executor=None, **kwargs):
+    """Yield (filename, result, error) as func(filename, *args, **kwargs) finishes for each file.
+
+    Results come in the order the calls finish.  error is an empty string,
+    or the exception the call raised as 'Type: message' (result is then
+    None), so one bad file does not stop the others.  At most concurrency
+    calls are submitted at a time, whatever the number of files.  Closing
+    the generator early (or cancelling the task iterating over it) drops
+    the calls which have not started.
+    """
+    generator = _completed(func, ((None, f) for f in files), args, kwargs, concurrency, executor)
+    try:
+        async for _, filename, result, error in generator:
+            yield filename, result, error
+    finally:
+        await generator.aclose()
+
+
+async def _gather_ordered(func, files, args, kwargs, concurrency, executor):
+    """Return the [(result, error)] of the calls on files, in the order of files.
+    """
+    files = list(files)
+    results = [None] * len(files)
+    generator = _completed(func, enumerate(files), args, kwargs, concurrency, executor)
+    try:
+        async for k, _, result, error in generator:
+            results[k] = (result, error)
+    finally:
+        await generator.aclose()
+    return results
+
+
+async def aget_hdr_values_batch(files, keys, whichhdu=None, errors='raise', concurrency=DEFAULT_CONCURRENCY,
+                                executor=None):
+    """Return [(values, error)] of aget_hdr_values for many files, in the order of files.
+
+    error is an empty string or the exception raised for that file.
+    """
+    return await _gather_ordered(fitsutils.get_hdr_values, files, (keys, whichhdu, errors), {},
+                                 concurrency, executor)
+
+
+async def aget_special_metadata_batch(files, keys, whichhdu=None, errors='raise',
+                                      concurrency=DEFAULT_CONCURRENCY, executor=None):
+    """Return [(values, error)] of aget_special_metadata for many files, in the order of files.
+
+    error is an empty string or the exception raised for that file.
+    """
+    return await _gather_ordered(fits_special_metadata.get_special_metadata, files, (keys,),
+                                 {'whichhdu': whichhdu, 'errors': errors}, concurrency, executor)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+"""Interchangeable fits I/O backends: astropy and fitsio (cfitsio).
+
+Both backends implement the same operations with the same return types:
+
+    read_header(filename, whichhdu)  --> astropy fits.Header
+    list_hdus(filename)              --> list of HDUSummary
+    read_image(filename, whichhdu)   --> (numpy array, astropy fits.Header)
+    read_table(filename, whichhdu, columns, rows) --> numpy structured array
+    write_mef(outname, hdus, clobber, checksum)   --> None
+
+The backend is chosen per call with the backend argument of the module
+functions (a name or a Backend instance), else by the
+DESPYFITSUTILS_BACKEND environment variable, else astropy.
+
+Within the package only makeMEF goes through a backend, to read and
+write MEF images.  get_hdr, get_hdr_value(s), combine_cats and the HDU
+scanners of fitsutils read the raw fits blocks (or use astropy) whatever
+the backend setting.
+"""
+
+import collections
+import importlib.util
+import os
+
+import despyfitsutils._lazy as _lazy
+import despyfitsutils.fits_blocks as fits_blocks
+import despyfitsutils.fitsutils as fitsutils
+import despyfitsutils.instrument as instrument
+
+# Heavy dependencies, imported on first use
+np = _lazy.LazyModule('numpy')
+fits = _lazy.LazyModule('astropy.io.fits')
+fitsio = _lazy.LazyModule('fitsio')
+
+ENV_BACKEND = 'DESPYFITSUTILS_BACKEND'
+DEFAULT_BACKEND = 'astropy'
+
+# index, EXTNAME ('' if none) and kind: 'IMAGE' (tile-compressed or not),
+# 'BINTABLE' or 'TABLE'
+HDUSummary = collections.namedtuple('HDUSummary', ['index', 'extname', 'kind'])
+
+# Keywords a writer generates itself from the data.
+STRUCTURAL_KEYWORDS = ('SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'EXTEND', 'PCOUNT', 'GCOUNT')
+
+
+def _is_structural(keyword):
+    return keyword in STRUCTURAL_KEYWORDS or (keyword.startswith('NAXIS') and keyword[5:].isdigit())
+
+
+def _hdu_selector(whichhdu):
+    """Return whichhdu as an int index or upper case EXTNAME (None --> 0).
+    """
+    if whichhdu is None:
+        return 0
+    whichhdu = fitsutils._normalize_hdu(whichhdu)
+    if whichhdu == 'PRIMARY':
+        return 0
+    return whichhdu
+
+
+def _structured(names, arrays):
+    """Return a native-endian numpy structured array from column arrays.
+    """
+    arrays = [np.asarray(a) for a in arrays]
+    dtype = [(name, a.dtype.newbyteorder('=') if a.dtype.kind != 'U' else a.dtype, a.shape[1:])
+             for name, a in zip(names, arrays)]
+    nrows = len(arrays[0]) if arrays else 0
+    table = np.empty(nrows, dtype=dtype)
+    for name, a in zip(names, arrays):
+        table[name] = a
+    return table
+
+
+class Backend(object):
+    """Interface of a fits I/O backend.
+    """
+
+    name = None
+
+    def read_header(self, filename, whichhdu=None):
+        """Return the header of an HDU as an astropy fits.Header.
+        """
+        raise NotImplementedError
+
+    def list_hdus(self, filename):
+        """Return a list of HDUSummary, one per HDU of the file.
+        """
+        raise NotImplementedError
+
+    def read_image(self, filename, whichhdu=None):
+        """Return the (data, header) of an image HDU, decompressed if need be.
+        """
+        raise NotImplementedError
+
+    def read_table(self, filename, whichhdu=1, columns=None, rows=None):
+        """Return a table HDU as a numpy structured array.
+
+        columns is a list of column names to read (all by default) and rows
+        a list of row numbers or a slice.  String columns are returned
+        without trailing blanks, as numpy unicode arrays.
+        """
+        raise NotImplementedError
+
+    def write_mef(self, outname, hdus, clobber=False, checksum=False):
+        """Write images to a new MEF.
+
+        hdus is an iterable of (data, header) with header an astropy Header
+        (or None).  The first image goes in the Primary HDU and the others
+        in IMAGE extensions, as makeMEF does.  The iterable is consumed one
+        item at a time, so a generator keeps a single image in memory.
+        checksum=True adds the CHECKSUM and DATASUM keywords to every HDU.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "<%s backend>" % self.name
+
+
+class AstropyBackend(Backend):
+    """Backend on astropy.io.fits.
+    """
+
+    name = 'astropy'
+
+    def read_header(self, filename, whichhdu=None):
+        instrument.count('file_opens')
+        instrument.count('header_parses')
+        with fits.open(filename, 'readonly') as hdulist:
+            return hdulist[_hdu_selector(whichhdu)].header.copy()
+
+    def list_hdus(self, filename):
+        instrument.count('file_opens')
+        summary = []
+        with fits.open(filename, 'readonly') as hdulist:
+            for k, hdu in enumerate(hdulist):
+                if isinstance(hdu, fits.BinTableHDU) and not isinstance(hdu, fits.CompImageHDU):
+                    kind = 'BINTABLE'
+                elif isinstance(hdu, fits.TableHDU):
+                    kind = 'TABLE'
+                else:
+                    kind = 'IMAGE'
+                # not hdu.name, which astropy makes up when there is no EXTNAME
+                summary.append(HDUSummary(k, hdu.header.get('EXTNAME', '').strip(), kind))
+        return summary
+
+    def read_image(self, filename, whichhdu=None):
+        instrument.count('file_opens')
+        instrument.count('header_parses')
+        with fits.open(filename, 'readonly', memmap=False) as hdulist:
+            hdu = hdulist[_hdu_selector(whichhdu)]
+            return hdu.data, hdu.header.copy()
+
+    def read_table(self, filename, whichhdu=1, columns=None, rows=None):
+        instrument.count('file_opens')
+        with fits.open(filename, 'readonly') as hdulist:
+            data = hdulist[_hdu_selector(whichhdu)].data
+            names = list(columns) if columns is not None else list(data.names)
+            arrays = []
+            for name in names:
+                col = data[name]
+                if rows is not None:
+                    col = col[rows]
+                if col.dtype.kind == 'S':
+                    col = np.char.rstrip(np.char.decode(col, 'ascii'))
+                elif col.dtype.kind == 'U':
+                    col = np.char.rstrip(col)
+                arrays.append(np.array(col))
+            return _structured(names, arrays)
+
+    def write_mef(self, outname, hdus, clobber=False, checksum=False):
+        if os.path.exists(outname) and not clobber:
+            raise OSError("File %s already exists" % outname)
+        with open(outname, 'wb') as outfh:
+            for k, (data, header) in enumerate(hdus):
+                if k == 0:
+                    hdu = fits.PrimaryHDU(data, header=_clean_header(header))
+                    hdu.header['EXTEND'] = True
+                else:
+                    hdu = fits.ImageHDU(data, header=_clean_header(header))
+                # each HDU is appended on its own, without a Primary in front
+                fits.HDUList([hdu]).writeto(fitsutils._AppendStream(outfh), output_verify='ignore',
+                                            checksum=checksum)
+                instrument.count('hdus_copied')
+
+
+def _clean_header(header):
+    """Return a copy of header without the keywords the writer generates.
+    """
+    if header is None:
+        return None
+    header = header.copy()
+    for keyword in [card.keyword for card in header.cards if _is_structural(card.keyword)]:
+        if keyword in header:
+            del header[keyword]
+    return header
+
+
+class FitsioBackend(Backend):
+    """Backend on fitsio, the numpy wrapper of cfitsio.
+    """
+
+    name = 'fitsio'
+
+    def _header(self, hdr):
+        """Convert a fitsio FITSHDR to an astropy Header.
+        """
+        instrument.count('header_parses')
+        return fits.Header.fromstring(str(hdr), sep='\n')
+
+    def _read_header(self, filename, fitsfile, k):
+        """Return the header of HDU k of an open file as an astropy Header.
+
+        fitsio gives the binary table header of a tile-compressed image, so
+        its image header is rebuilt from the raw blocks as astropy does.
+        """
+        hdu = fitsfile[k]
+        if hdu.get_exttype() == 'IMAGE_HDU' and hdu.is_compressed():
+            return fits_blocks.header_from_info(filename, fits_blocks.find_hdu(filename, k))
+        return self._header(hdu.read_header())
+
+    def read_header(self, filename, whichhdu=None):
+        instrument.count('file_opens')
+        with fitsio.FITS(filename) as fitsfile:
+            return self._read_header(filename, fitsfile, self._find(fitsfile, whichhdu))
+
+    def _find(self, fitsfile, whichhdu):
+        """Return the index of an HDU, matching EXTNAMEs case insensitively.
+        """
+        ext = _hdu_selector(whichhdu)
+        if isinstance(ext, int):
+            if ext < 0:
+                ext += len(fitsfile)
+            if not 0 <= ext < len(fitsfile):
+                raise IndexError("HDU %s not found" % whichhdu)
+            return ext
+        for k, hdu in enumerate(fitsfile):
+            if hdu.get_extname().strip().upper() == ext:
+                return k
+        raise KeyError("Extension '%s' not found." % whichhdu)
+
+    def read_image(self, filename, whichhdu=None):
+        instrument.count('file_opens')
+        with fitsio.FITS(filename) as fitsfile:
+            k = self._find(fitsfile, whichhdu)
+            return fitsfile[k].read(), self._read_header(filename, fitsfile, k)
+
+    def list_hdus(self, filename):
+        instrument.count('file_opens')
+        kinds = {'IMAGE_HDU': 'IMAGE', 'BINARY_TBL': 'BINTABLE', 'ASCII_TBL': 'TABLE'}
+        summary = []
+        with fitsio.FITS(filename) as fitsfile:
+            for k, hdu in enumerate(fitsfile):
+                # tile-compressed images are IMAGE_HDU too
+                kind = kinds[hdu.get_exttype()]
+                summary.append(HDUSummary(k, hdu.get_extname().strip(), kind))
+        return summary
+
+    def read_table(self, filename, whichhdu=1, columns=None, rows=None):
+        instrument.count('file_opens')
+        if isinstance(rows, slice):
+            rows = range(*rows.indices(self._nrows(filename, whichhdu)))
+        if rows is not None:
+            rows = np.asarray(list(rows))
+        with fitsio.FITS(filename) as fitsfile:
+            data = fitsfile[self._find(fitsfile, whichhdu)].read(columns=columns, rows=rows)
+        names = list(columns) if columns is not None else list(data.dtype.names)
+        arrays = []
+        for name in names:
+            col = data[name]
+            if col.dtype.kind == 'S':
+                col = np.char.rstrip(np.char.decode(col, 'ascii'))
+            arrays.append(col)
+        return _structured(names, arrays)
+
+    def _nrows(self, filename, whichhdu):
+        with fitsio.FITS(filename) as fitsfile:
+            return fitsfile[self._find(fitsfile, whichhdu)].get_nrows()
+
+    def write_mef(self, outname, hdus, clobber=False, checksum=False):
+        if os.path.exists(outname) and not clobber:
+            raise OSError("File %s already exists" % outname)
+        with fitsio.FITS(outname, 'rw', clobber=True) as fitsfile:
+            for data, header in hdus:
+                records = []
+                extname = None
+                if header is not None:
+                    for card in header.cards:
+                        if not card.keyword or _is_structural(card.keyword):
+                            continue
+                        if card.keyword == 'EXTNAME':
+                            # fitsio drops EXTNAME from the records it is given
+                            extname = card.value
+                            continue
+                        records.append({'name': card.keyword, 'value': card.value, 'comment': card.comment})
+                fitsfile.write(data, header=records, extname=extname)
+                if checksum:
+                    fitsfile[-1].write_checksum()
+                instrument.count('hdus_copied')
+
+
+_BACKENDS = {
+    'astropy': AstropyBackend,
+    'fitsio': FitsioBackend,
+}
+
+_INSTANCES = {}
+
+
+def available_backends():
+    """Return the names of the backends whose library can be imported.
+    """
+    return [name for name in sorted(_BACKENDS) if importlib.util.find_spec(name) is not None]
+
+
+def get_backend(backend=None):
+    """Return a Backend instance.
+
+    backend may be a Backend instance, a backend name or None for the
+    DESPYFITSUTILS_BACKEND environment variable (default astropy).
+    """
+    if isinstance(backend, Backend):
+        return backend
+    if backend is None:
+        backend = os.environ.get(ENV_BACKEND) or DEFAULT_BACKEND
+    name = backend.lower()
+    if name not in _BACKENDS:
+        raise ValueError("Unknown fits backend: %s (choose from %s)" % (backend, ', '.join(sorted(_BACKENDS))))
+    if name not in _INSTANCES:
+        if importlib.util.find_spec(name) is None:
+            raise ImportError("Fits backend %s needs the %s package" % (name, name))
+        _INSTANCES[name] = _BACKENDS[name]()
+    return _INSTANCES[name]
+
+
+def read_header(filename, whichhdu=None, backend=None):
+    """Return the header of an HDU as an astropy fits.Header.
+    """
+    return get_backend(backend).read_header(filename, whichhdu)
+
+
+def list_hdus(filename, backend=None):
+    """Return a list of HDUSummary(index, extname, kind), one per HDU.
+    """
+    return get_backend(backend).list_hdus(filename)
+
+
+def read_image(filename, whichhdu=None, backend=None):
+    """Return the (data, header) of an image HDU.
+    """
+    return get_backend(backend).read_image(filename, whichhdu)
+
+
+def read_table(filename, whichhdu=1, columns=None, rows=None, backend=None):
+    """Return a table HDU as a numpy structured array.
+    """
+    return get_backend(backend).read_table(filename, whichhdu, columns, rows)
+
+
+def write_mef(outname, hdus, clobber=False, backend=None, checksum=False):
+    """Write (data, header) images to a new MEF, the first in the Primary HDU.
+    """
+    return get_backend(backend).write_mef(outname, hdus, clobber, checksum)
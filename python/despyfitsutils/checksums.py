@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""Verify the CHECKSUM and DATASUM keywords of many fits files.
+
+The data units are summed straight from a memory map of each file, in
+chunks, with the ones' complement sum of fits_blocks; headers are read
+with the raw block reader, so no astropy HDU is ever built.  Files are
+spread over a pool of worker processes.
+"""
+
+import collections
+import concurrent.futures
+import mmap
+
+import despyfitsutils.fits_blocks as fits_blocks
+import despyfitsutils.instrument as instrument
+
+# Bytes summed at a time from the memory map
+SUM_CHUNK = 16 * 1024 * 1024
+
+# datasum and checksum are True (matches), False (does not match) or
+# None (keyword not in the header)
+HDUChecksum = collections.namedtuple('HDUChecksum', ['index', 'name', 'datasum', 'checksum'])
+
+
+def _sum_range(buf, offset, size):
+    """Return the ones' complement sum of size bytes of buf at offset.
+    """
+    total = fits_blocks.OnesSum()
+    view = memoryview(buf)
+    try:
+        for start in range(offset, offset + size, SUM_CHUNK):
+            total.update(view[start:min(start + SUM_CHUNK, offset + size)])
+    finally:
+        view.release()
+    return total.digest()
+
+
+@instrument.timed
+def verify_file(filename):
+    """Return the list of HDUChecksum of the HDUs of a fits file.
+
+    Raises ValueError if the file is truncated.
+    """
+    infos = list(fits_blocks.iter_hdus(filename))
+    results = []
+    instrument.count('file_opens')
+    with open(filename, 'rb') as fileobj:
+        buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for info in infos:
+                size = fits_blocks.padded_size(info.data_size)
+                if info.data_offset + size > len(buf):
+                    raise ValueError("HDU %d of %s is truncated" % (info.index, filename))
+                offsets = fits_blocks.card_offsets(info.header)
+                datasum_card = fits_blocks._raw_value(info.header, offsets, 'DATASUM')
+                has_checksum = 'CHECKSUM' in offsets
+                if datasum_card is None and not has_checksum:
+                    results.append(HDUChecksum(info.index, info.name, None, None))
+                    continue
+                datasum = _sum_range(buf, info.data_offset, size)
+                instrument.count('bytes_read', size)
+                datasum_ok = None
+                if datasum_card is not None:
+                    try:
+                        datasum_ok = int(datasum_card) == datasum
+                    except ValueError:
+                        datasum_ok = False
+                checksum_ok = None
+                if has_checksum:
+                    total = fits_blocks._fold(fits_blocks.ones_sum(info.header) + datasum)
+                    checksum_ok = total == 0xffffffff
+                results.append(HDUChecksum(info.index, info.name, datasum_ok, checksum_ok))
+        finally:
+            buf.close()
+    return results
+
+
+def check_file(filename):
+    """Return (results, error) for one file.
+
+    results is the verify_file list, error an empty string, a message
+    naming the HDUs whose sums do not match, or what went wrong.
+    """
+    try:
+        results = verify_file(filename)
+    except Exception as err:
+        return [], "%s: %s" % (type(err).__name__, err)
+    bad = ["HDU %d (%s)" % (r.index, r.name or 'no EXTNAME') for r in results
+           if r.datasum is False or r.checksum is False]
+    if bad:
+        return results, "bad checksum in %s" % ', '.join(bad)
+    return results, ''
+
+
+@instrument.timed
+def verify_checksums(files, nproc=1, chunksize=None):
+    """Return the list of check_file() results for a list of files.
+
+    The files are spread over nproc worker processes, chunksize files at
+    a time (by default about 8 chunks per worker); results are in the
+    order of files.
+    """
+    files = list(files)
+    if nproc is None or nproc <= 1 or len(files) <= 1:
+        return [check_file(f) for f in files]
+
+    if chunksize is None:
+        chunksize = max(1, len(files) // (nproc * 8))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        return list(pool.map(check_file, files, chunksize=chunksize))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Tile-compress image HDUs on a pool of worker processes.
+
+Each worker reads one input image, compresses it with astropy (the same
+tile compression as fpack) and returns the bytes of the finished
+compressed HDU, which the caller appends to its output in order.  Only
+a few HDUs are in flight at a time, so memory does not grow with the
+number of inputs.  Binary tables are not compressed: astropy cannot
+write tile-compressed tables, so callers copy them as they are.
+"""
+
+import collections
+import concurrent.futures
+import io
+
+import despyfitsutils._lazy as _lazy
+import despyfitsutils.instrument as instrument
+
+# Heavy dependencies, imported on first use
+fits = _lazy.LazyModule('astropy.io.fits')
+
+COMPRESSION_TYPES = ('RICE_1', 'GZIP_1', 'GZIP_2', 'HCOMPRESS_1', 'PLIO_1')
+
+# Quantization of floating point images (see astropy's CompImageHDU)
+QUANTIZE_METHODS = {'NO_DITHER': -1, 'SUBTRACTIVE_DITHER_1': 1, 'SUBTRACTIVE_DITHER_2': 2}
+
+CompressOptions = collections.namedtuple('CompressOptions', ['compression_type', 'quantize_level',
+                                                             'quantize_method', 'dither_seed', 'tile_shape'])
+CompressOptions.__doc__ = """Tile compression settings, as taken by astropy's CompImageHDU.
+
+    compression_type:  one of COMPRESSION_TYPES
+    quantize_level:    quantization of floating point images (noise sigma / level)
+    quantize_method:   -1 (NO_DITHER), 1 (SUBTRACTIVE_DITHER_1) or 2 (SUBTRACTIVE_DITHER_2)
+    dither_seed:       seed of the dithering, 0 for one based on the clock
+    tile_shape:        tile shape in numpy order, None for row by row tiles
+"""
+
+
+def compress_options(compression_type='RICE_1', quantize_level=4.0, quantize_method='SUBTRACTIVE_DITHER_1',
+                     dither_seed=1, tile_shape=None):
+    """Return a checked CompressOptions.
+
+    The defaults are those of fpack, except for the fixed dither seed
+    which makes the output reproducible.  quantize_method may be given by
+    name or number.  Raises ValueError for an unknown setting.
+    """
+    compression_type = compression_type.upper()
+    if compression_type not in COMPRESSION_TYPES:
+        raise ValueError("Unknown compression type %s (choose from %s)" % (compression_type,
+                                                                          ', '.join(COMPRESSION_TYPES)))
+    if isinstance(quantize_method, str):
+        if quantize_method.upper() not in QUANTIZE_METHODS:
+            raise ValueError("Unknown quantize method %s (choose from %s)" % (quantize_method,
+                                                                             ', '.join(QUANTIZE_METHODS)))
+        quantize_method = QUANTIZE_METHODS[quantize_method.upper()]
+    if quantize_method not in QUANTIZE_METHODS.values():
+        raise ValueError("Unknown quantize method %s" % quantize_method)
+    if tile_shape is not None:
+        tile_shape = tuple([int(n) for n in tile_shape])
+    return CompressOptions(compression_type, float(quantize_level), quantize_method, int(dither_seed), tile_shape)
+
+
+def compress_image(data, header, options, checksum=False):
+    """Return the bytes of a tile-compressed extension holding an image.
+
+    header (an astropy Header, or None) gives the keywords of the image;
+    the ones describing the structure of a Primary HDU are dropped.
+    """
+    if header is not None:
+        header = header.copy()
+        for keyword in ('SIMPLE', 'EXTEND'):
+            if keyword in header:
+                del header[keyword]
+    hdu = fits.CompImageHDU(data, header=header, compression_type=options.compression_type,
+                            quantize_level=options.quantize_level, quantize_method=options.quantize_method,
+                            dither_seed=options.dither_seed, tile_shape=options.tile_shape)
+    buf = io.BytesIO()
+    # a lone extension, written without a Primary HDU in front
+    fits.HDUList([hdu]).writeto(buf, output_verify='ignore', checksum=checksum)
+    return buf.getvalue()
+
+
+@instrument.timed
+def compress_file_hdu(filename, whichhdu, options, cards=None, checksum=False):
+    """Return the bytes of the image of an HDU of a file, tile-compressed.
+
+    Compressed inputs are decompressed first.  cards is an optional list
+    of (keyword, value, comment, after) set in the header before the
+    image is compressed.
+    """
+    instrument.count('file_opens')
+    with fits.open(filename, memmap=False) as hdulist:
+        hdu = hdulist[whichhdu]
+        header = hdu.header.copy()
+        for keyword, value, comment, after in cards or []:
+            header.set(keyword, value, comment, after=after)
+        return compress_image(hdu.data, header, options, checksum)
+
+
+def imap_ordered(func, jobs, nproc=1, ahead=4):
+    """Yield func(*job) for each job, in the order of jobs.
+
+    With nproc > 1 the calls run on a pool of worker processes, at most
+    ahead * nproc jobs ahead of the result being consumed.  A job of None
+    yields None without going to the pool, so callers can interleave
+    work of their own (e.g. raw copies) in the same sequence.
+    """
+    if nproc is None or nproc <= 1:
+        for job in jobs:
+            yield None if job is None else func(*job)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        pending = collections.deque()
+        try:
+            for job in jobs:
+                pending.append(None if job is None else pool.submit(func, *job))
+                if len(pending) >= ahead * nproc:
+                    future = pending.popleft()
+                    yield None if future is None else future.result()
+            while pending:
+                future = pending.popleft()
+                yield None if future is None else future.result()
+        finally:
+            for future in pending:
+                if future is not None:
+                    future.cancel()
@@ -0,0 +1,970 @@
+#!/usr/bin/env python
+
+"""Low-level access to the 2880-byte blocks of fits files.
+
+These functions read fits headers directly from the file without building
+astropy HDUList or Header objects.  Each header is read block by block
+until its END card, and data segments are skipped using the size computed
+from BITPIX, NAXISn, PCOUNT and GCOUNT, so data is never read.  Only the
+cards that are asked for are parsed into values.
+"""
+
+import collections
+import datetime
+import os
+import re
+import tempfile
+
+from . import _lazy
+from . import instrument
+
+fits = _lazy.LazyModule('astropy.io.fits')
+np = _lazy.LazyModule('numpy')
+
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+CARDS_PER_BLOCK = BLOCK_SIZE // CARD_SIZE
+
+END_CARD = b'END' + b' ' * (CARD_SIZE - 3)
+
+# Keywords which do not carry a value, may appear more than once, or need
+# the full astropy header machinery to be looked up.
+COMMENTARY_KEYWORDS = ('', 'COMMENT', 'HISTORY')
+
+# Image keywords stored under another name in tile-compressed HDUs.
+COMPRESSED_REMAP = {
+    'SIMPLE': 'ZSIMPLE',
+    'XTENSION': 'ZTENSION',
+    'BITPIX': 'ZBITPIX',
+    'NAXIS': 'ZNAXIS',
+    'EXTEND': 'ZEXTEND',
+    'BLOCKED': 'ZBLOCKED',
+    'PCOUNT': 'ZPCOUNT',
+    'GCOUNT': 'ZGCOUNT',
+    'CHECKSUM': 'ZHECKSUM',
+    'DATASUM': 'ZDATASUM',
+}
+
+# Keywords describing the binary table holding the compressed tiles, which
+# are not part of the image header seen through astropy.
+COMPRESSED_RESERVED_RE = re.compile(
+    r"^(TFIELDS|THEAP|ZIMAGE|ZCMPTYPE|ZMASKCMP|ZQUANTIZ|ZDITHER0|ZBLANK|ZSCALE|ZZERO|"
+    r"ZSIMPLE|ZTENSION|ZBITPIX|ZNAXIS|ZEXTEND|ZBLOCKED|ZPCOUNT|ZGCOUNT|ZHECKSUM|ZDATASUM|"
+    r"(TTYPE|TFORM|TUNIT|TNULL|TSCAL|TZERO|TDISP|TBCOL|TDIM|TCTYP|TCUNI|TCRPX|TCRVL|TCDLT|TRPOS|"
+    r"ZNAXIS|ZTILE|ZNAME|ZVAL)[1-9][0-9]*)$")
+
+
+HDUInfo = collections.namedtuple('HDUInfo',
+                                 ['index', 'name', 'header_offset', 'data_offset',
+                                  'data_size', 'header'])
+HDUInfo.__doc__ = """Location and raw header of one HDU in a fits file.
+
+    index:          position of the HDU in the file (0 is the Primary HDU)
+    name:           upper case EXTNAME, or PRIMARY for an unnamed Primary HDU
+    header_offset:  byte offset of the start of the header
+    data_offset:    byte offset of the start of the data
+    data_size:      size of the data in bytes, without block padding
+    header:         raw header bytes, including END and block padding
+"""
+
+
+def padded_size(size):
+    """Return size rounded up to a whole number of fits blocks.
+    """
+    return ((size + BLOCK_SIZE - 1) // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def hdu_end(info):
+    """Return the byte offset just past the (padded) data of an HDU.
+    """
+    return info.data_offset + padded_size(info.data_size)
+
+
+def card_offsets(header):
+    """Return dict keyword --> offset of its first card in a raw header.
+
+    Parsing stops at the END card.
+    """
+    offsets = {}
+    for i in range(0, len(header), CARD_SIZE):
+        keyword = header[i:i + 8].rstrip().decode('ascii')
+        if keyword == 'END':
+            break
+        if keyword not in offsets:
+            offsets[keyword] = i
+    return offsets
+
+
+def _raw_value(header, offsets, keyword):
+    """Return the raw value field of a card as a stripped string, or None.
+    """
+    i = offsets.get(keyword)
+    if i is None or header[i + 8:i + 10] != b'= ':
+        return None
+    value = header[i + 10:i + CARD_SIZE].decode('ascii')
+    if value.lstrip().startswith("'"):
+        # string: value ends at the first lone closing quote
+        value = value.lstrip()
+        m = re.match(r"'((?:[^']|'')*)'", value)
+        return m.group(1).replace("''", "'").rstrip() if m else None
+    return value.split('/')[0].strip()
+
+
+def _raw_int(header, offsets, keyword, default=None):
+    value = _raw_value(header, offsets, keyword)
+    if value is None or value == '':
+        if default is None:
+            raise ValueError("Missing mandatory keyword %s in fits header" % keyword)
+        return default
+    return int(value)
+
+
+def data_size(header, offsets=None):
+    """Return the size in bytes (without padding) of the data following a raw header.
+    """
+    if offsets is None:
+        offsets = card_offsets(header)
+    bitpix = _raw_int(header, offsets, 'BITPIX')
+    naxis = _raw_int(header, offsets, 'NAXIS')
+    if naxis == 0:
+        return 0
+    axes = [_raw_int(header, offsets, 'NAXIS%d' % (i + 1)) for i in range(naxis)]
+    # random groups have NAXIS1 = 0, which does not count
+    if axes[0] == 0 and _raw_value(header, offsets, 'GROUPS') == 'T':
+        axes = axes[1:]
+    npix = 1
+    for n in axes:
+        npix *= n
+    pcount = _raw_int(header, offsets, 'PCOUNT', 0)
+    gcount = _raw_int(header, offsets, 'GCOUNT', 1)
+    return abs(bitpix) // 8 * gcount * (pcount + npix)
+
+
+def is_compressed(header, offsets=None):
+    """Return True if a raw header describes a tile-compressed image.
+    """
+    if offsets is None:
+        offsets = card_offsets(header)
+    return _raw_value(header, offsets, 'ZIMAGE') == 'T'
+
+
+def read_raw_header(fileobj):
+    """Read one raw header from the current position of an open binary file.
+
+    Returns the header bytes including END and block padding, or None at
+    end of file.
+    """
+    blocks = []
+    while True:
+        block = fileobj.read(BLOCK_SIZE)
+        if not block:
+            if blocks:
+                raise ValueError("Fits header is missing its END card")
+            return None
+        if len(block) < BLOCK_SIZE:
+            raise ValueError("Truncated fits header block")
+        if not blocks and block[:6] not in (b'SIMPLE', b'XTENSI'):
+            raise ValueError("Not a fits header block")
+        blocks.append(block)
+        for i in range(0, BLOCK_SIZE, CARD_SIZE):
+            if block[i:i + 8] == b'END     ':
+                instrument.count('header_parses')
+                instrument.count('bytes_read', BLOCK_SIZE * len(blocks))
+                return b''.join(blocks)
+
+
+def iter_hdus(filename):
+    """Yield an HDUInfo for each HDU of a fits file, reading headers only.
+    """
+    instrument.count('file_opens')
+    with open(filename, 'rb') as fileobj:
+        index = 0
+        offset = 0
+        while True:
+            fileobj.seek(offset)
+            header = read_raw_header(fileobj)
+            if header is None:
+                return
+            offsets = card_offsets(header)
+            name = _raw_value(header, offsets, 'EXTNAME')
+            if name:
+                name = name.upper()
+            else:
+                name = 'PRIMARY' if index == 0 else ''
+            size = data_size(header, offsets)
+            info = HDUInfo(index, name, offset, offset + len(header), size, header)
+            yield info
+            offset = hdu_end(info)
+            index += 1
+
+
+def find_hdu(filename, whichhdu=None):
+    """Return the HDUInfo of the HDU selected by index or name.
+
+    whichhdu follows get_hdr: None means the Primary HDU, an integer (or
+    string of digits) is an index and any other string an EXTNAME.
+    """
+    if whichhdu is None:
+        whichhdu = 'Primary'
+    try:
+        whichhdu = int(whichhdu)
+    except ValueError:
+        whichhdu = whichhdu.upper()
+
+    if isinstance(whichhdu, int):
+        if whichhdu < 0:
+            return list(iter_hdus(filename))[whichhdu]
+        for info in iter_hdus(filename):
+            if info.index == whichhdu:
+                return info
+        raise IndexError("HDU %d not found in %s" % (whichhdu, filename))
+
+    for info in iter_hdus(filename):
+        if info.name == whichhdu or (info.index == 0 and whichhdu == 'PRIMARY'):
+            return info
+    raise KeyError("Extension '%s' not found in %s" % (whichhdu, filename))
+
+
+def _compressed_card(header, offsets, keyword):
+    """Return the card an astropy compressed image header shows for keyword.
+    """
+    if keyword in COMPRESSED_REMAP or re.match(r'^NAXIS[1-9][0-9]*$', keyword):
+        zkeyword = 'Z' + keyword
+        if keyword in COMPRESSED_REMAP:
+            zkeyword = COMPRESSED_REMAP[keyword]
+        if keyword.startswith('NAXIS') and keyword != 'NAXIS':
+            if int(keyword[5:]) > _raw_int(header, offsets, 'ZNAXIS'):
+                return None
+        primary = 'ZSIMPLE' in offsets
+        if keyword == 'XTENSION' and not primary:
+            return fits.Card('XTENSION', 'IMAGE')
+        if keyword in ('PCOUNT', 'GCOUNT'):
+            if primary:
+                return None
+            if zkeyword not in offsets:
+                return fits.Card(keyword, 0 if keyword == 'PCOUNT' else 1)
+        if zkeyword not in offsets:
+            return None
+        zcard = _card_at(header, offsets[zkeyword])
+        return fits.Card(keyword, zcard.value, zcard.comment)
+    if COMPRESSED_RESERVED_RE.match(keyword):
+        return None
+    if keyword == 'BLANK' and keyword not in offsets and 'ZBLANK' in offsets:
+        zcard = _card_at(header, offsets['ZBLANK'])
+        return fits.Card(keyword, zcard.value)
+    if keyword not in offsets:
+        return None
+    card = _card_at(header, offsets[keyword])
+    if keyword == 'EXTNAME' and card.value == 'COMPRESSED_IMAGE':
+        return None
+    return card
+
+
+def _card_at(header, offset):
+    """Parse the card at offset, joining any CONTINUE cards of a long string.
+    """
+    end = offset + CARD_SIZE
+    while header[end:end + 8] == b'CONTINUE':
+        end += CARD_SIZE
+    return fits.Card.fromstring(header[offset:end].decode('ascii'))
+
+
+def get_cards(info, keys):
+    """Return dict key --> astropy Card for the keys found in an HDU.
+
+    Only the requested cards are parsed.  For tile-compressed HDUs the
+    cards are those of the image header astropy would show (ZNAXISn seen
+    as NAXISn, table keywords hidden, ...).  Missing keys are left out.
+    """
+    offsets = card_offsets(info.header)
+    compressed = is_compressed(info.header, offsets)
+    cards = {}
+    for key in keys:
+        ukey = key.upper()
+        if compressed:
+            card = _compressed_card(info.header, offsets, ukey)
+        elif ukey in offsets:
+            card = _card_at(info.header, offsets[ukey])
+        else:
+            card = None
+        if card is not None:
+            cards[ukey] = card
+    return cards
+
+
+def is_simple_keyword(key):
+    """Return True if key can be looked up with get_cards.
+
+    Commentary and HIERARCH keywords have to go through a full header parse.
+    """
+    ukey = key.upper()
+    return ukey not in COMMENTARY_KEYWORDS and len(ukey) <= 8 and ' ' not in ukey
+
+
+def values_from_info(info, keys, errors='raise'):
+    """Return dict key --> value for the given keys of an HDU.
+
+    Raises KeyError if a key is not in the header, unless errors is
+    'ignore' in which case missing keys are left out.
+    """
+    cards = get_cards(info, keys)
+    values = {}
+    for key in keys:
+        ukey = key.upper()
+        if ukey not in cards:
+            if errors == 'ignore':
+                continue
+            raise KeyError("Keyword '%s' not found." % ukey)
+        values[ukey] = cards[ukey].value
+    return values
+
+
+def header_from_info(filename, info):
+    """Return an astropy Header for an HDU found in filename.
+
+    Tile-compressed HDUs are read through astropy (headers only) since
+    their image header has to be reconstructed from the table header.
+    """
+    instrument.count('header_parses')
+    if is_compressed(info.header):
+        instrument.count('file_opens')
+        with fits.open(filename, 'readonly') as hdulist:
+            return hdulist[info.index].header.copy()
+    return fits.Header.fromstring(info.header.decode('ascii'))
+
+
+def get_raw_hdr_values(filename, keys, whichhdu=None):
+    """Return dict key --> value read straight from the header blocks.
+
+    Raises KeyError if a key is not in the header.
+    """
+    return values_from_info(find_hdu(filename, whichhdu), keys)
+
+
+def get_raw_hdr(filename, whichhdu=None):
+    """Return an astropy Header built straight from the header blocks.
+    """
+    return header_from_info(filename, find_hdu(filename, whichhdu))
+
+
+def is_image(info):
+    """Return True if an HDU holds an image (plain or tile-compressed).
+    """
+    if is_compressed(info.header):
+        return True
+    return info.data_size > 0 and (info.header.startswith(b'SIMPLE') or
+                                   info.header.startswith(b"XTENSION= 'IMAGE"))
+
+
+def header_cards(header):
+    """Return the list of 80-byte cards of a raw header, without END.
+    """
+    cards = []
+    for i in range(0, len(header), CARD_SIZE):
+        card = header[i:i + CARD_SIZE]
+        if card[:8] == b'END     ':
+            break
+        cards.append(card)
+    return cards
+
+
+def build_header(cards):
+    """Return raw header bytes from a list of 80-byte cards.
+
+    The END card and the blank padding to a whole block are added.
+    """
+    header = b''.join(cards) + END_CARD
+    return header + b' ' * (padded_size(len(header)) - len(header))
+
+
+def make_card(keyword, value, comment=None):
+    """Return the 80-byte image of a card, formatted by astropy.
+    """
+    return fits.Card(keyword, value, comment).image.encode('ascii')
+
+
+def _card_index(cards, keyword):
+    """Return the index of the first card with keyword, or None.
+    """
+    key = keyword.upper().encode('ascii').ljust(8)
+    for i, card in enumerate(cards):
+        if card[:8] == key:
+            return i
+    return None
+
+
+def set_card(header, keyword, value, comment=None, after=None):
+    """Return a raw header with a card set, as astropy's Header.set does.
+
+    An existing card is replaced in place, or moved after the given
+    keyword if after is given.  A new card goes after the given keyword,
+    or at the end of the header if that keyword is not present.
+    """
+    cards = header_cards(header)
+    card = make_card(keyword, value, comment)
+    idx = _card_index(cards, keyword)
+    if idx is not None and after is None:
+        cards[idx] = card
+    else:
+        if idx is not None:
+            del cards[idx]
+        pos = _card_index(cards, after) if after is not None else None
+        if pos is None:
+            cards.append(card)
+        else:
+            cards.insert(pos + 1, card)
+    return build_header(cards)
+
+
+def delete_card(header, keyword):
+    """Return a raw header without the first card with keyword.
+
+    CONTINUE cards of a long string value are removed with it.
+    """
+    cards = header_cards(header)
+    idx = _card_index(cards, keyword)
+    if idx is None:
+        return header
+    end = idx + 1
+    while end < len(cards) and cards[end][:8] == b'CONTINUE':
+        end += 1
+    del cards[idx:end]
+    return build_header(cards)
+
+
+# Keywords describing the HDU structure, which must never be edited
+STRUCTURAL_RE = re.compile(r"^(SIMPLE|XTENSION|BITPIX|NAXIS[0-9]*|EXTEND|PCOUNT|GCOUNT|GROUPS|"
+                           r"TFIELDS|THEAP|END|ZIMAGE|ZBITPIX|ZNAXIS[0-9]*|ZTENSION|ZSIMPLE|"
+                           r"ZPCOUNT|ZGCOUNT|ZCMPTYPE|ZTILE[0-9]+|ZNAME[0-9]+|ZVAL[0-9]+|"
+                           r"(TTYPE|TFORM|TDIM)[0-9]+)$")
+
+
+def merge_cards(header, cards):
+    """Return a raw header updated with a list of astropy Cards.
+
+    Cards of a keyword already in the header replace it where it stands,
+    others (and all COMMENT/HISTORY/blank cards) are added at the end.
+    Structural keywords (BITPIX, NAXISn, ...) are never touched.
+    """
+    hcards = header_cards(header)
+    for card in cards:
+        keyword = card.keyword.upper()
+        if STRUCTURAL_RE.match(keyword):
+            continue
+        image = card.image.encode('ascii')
+        idx = None
+        if keyword not in COMMENTARY_KEYWORDS:
+            idx = _card_index(hcards, keyword)
+        if idx is None:
+            hcards.append(image)
+        else:
+            end = idx + 1
+            while end < len(hcards) and hcards[end][:8] == b'CONTINUE':
+                end += 1
+            hcards[idx:end] = [image[i:i + CARD_SIZE] for i in range(0, len(image), CARD_SIZE)]
+    return build_header(hcards)
+
+
+def fit_header(header, nbytes):
+    """Return a raw header padded with blank cards to exactly nbytes, or None.
+
+    Used to rewrite a header in place: END has to stay in the last block
+    of the space the old header took.  Returns None if it does not fit.
+    """
+    if len(header) > nbytes:
+        return None
+    if len(header) == nbytes:
+        return header
+    cards = header_cards(header)
+    nblank = (nbytes - CARD_SIZE) // CARD_SIZE - len(cards)
+    return build_header(cards + [b' ' * CARD_SIZE] * nblank)
+
+
+def move_tail(fd, offset, shift, end):
+    """Move the bytes of a raw file descriptor from offset to end up by shift bytes.
+
+    The bytes are copied back to front through a large buffer, so the
+    ranges may overlap; what was at offset is left as it was.
+    """
+    instrument.count('bytes_read', end - offset)
+    instrument.count('bytes_written', end - offset)
+    stop = end
+    while stop > offset:
+        start = max(offset, stop - COPY_BUFSIZE)
+        data = os.pread(fd, stop - start, start)
+        if len(data) != stop - start:
+            raise ValueError("Unexpected end of file while moving data")
+        view = memoryview(data)
+        pos = start + shift
+        while len(view):
+            nwritten = os.pwrite(fd, view, pos)
+            view = view[nwritten:]
+            pos += nwritten
+        stop = start
+
+
+def _shift_headers(filename, infos, headers, fitted):
+    """Write headers in place, moving the file from the first one which grew.
+
+    fitted holds the headers fit_header could place in their old blocks,
+    None for those which need more.  The file is extended and everything
+    after the first grown header is moved up, HDU by HDU from the end, so
+    no HDU before it is read or written.
+    """
+    new = {}
+    grown = {}
+    for index, header in headers.items():
+        new[index] = fitted[index]
+        if new[index] is None:
+            new[index] = refresh_checksum(build_header(header_cards(header)))
+            grown[index] = len(new[index]) - len(infos[index].header)
+    first = min(grown)
+    # shifts[i]: bytes the data of HDU i move by
+    shifts = []
+    total = 0
+    for info in infos:
+        total += grown.get(info.index, 0)
+        shifts.append(total)
+    size = hdu_end(infos[-1])
+
+    instrument.count('file_opens')
+    with open(filename, 'r+b', buffering=0) as fileobj:
+        fd = fileobj.fileno()
+        os.ftruncate(fd, size + total)
+        for info in reversed(infos[first:]):
+            before = shifts[info.index - 1] if info.index > 0 else 0
+            if info.index not in headers:
+                move_tail(fd, info.header_offset, before, hdu_end(info))
+                continue
+            move_tail(fd, info.data_offset, shifts[info.index], hdu_end(info))
+        for index, header in new.items():
+            before = shifts[index - 1] if index > 0 else 0
+            os.pwrite(fd, header, infos[index].header_offset + before)
+            instrument.count('bytes_written', len(header))
+
+
+def rewrite_headers(filename, headers, fallback='rewrite'):
+    """Replace headers of a fits file, in place when they fit.
+
+    headers is a dict HDU index --> new raw header.  If every new header
+    fits in the blocks of the header it replaces, only the headers are
+    written, in place.  Otherwise, with fallback 'rewrite', the file is
+    rebuilt next to the original (unchanged HDUs and all data are copied
+    as byte ranges) and atomically renamed over it.  With fallback 'shift'
+    the file is instead extended in place and only the HDUs from the
+    first grown header onward are moved, which is much less I/O when that
+    header is near the end of a large file, but leaves the file damaged
+    if interrupted.
+
+    Returns True if the headers were written in place.
+    """
+    if fallback not in ('rewrite', 'shift'):
+        raise ValueError("Invalid value for fallback: %s" % fallback)
+    infos = list(iter_hdus(filename))
+    for index in headers:
+        if index >= len(infos):
+            raise IndexError("HDU %d not found in %s" % (index, filename))
+
+    fitted = {}
+    for index, header in headers.items():
+        fitted[index] = fit_header(header, len(infos[index].header))
+        if fitted[index] is not None:
+            # the blank cards fit_header adds are part of the checksum
+            fitted[index] = refresh_checksum(fitted[index])
+
+    if all([h is not None for h in fitted.values()]):
+        instrument.count('file_opens')
+        with open(filename, 'r+b', buffering=0) as fileobj:
+            for index, header in fitted.items():
+                fileobj.seek(infos[index].header_offset)
+                write_all(fileobj.fileno(), header)
+        return True
+
+    if fallback == 'shift':
+        _shift_headers(filename, infos, headers, fitted)
+        return False
+
+    instrument.count('file_opens')
+    dirname = os.path.dirname(os.path.abspath(filename))
+    tmpfd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.%s.' % os.path.basename(filename),
+                                      suffix='.tmp')
+    try:
+        with open(filename, 'rb', buffering=0) as infh:
+            os.chmod(tmpname, os.stat(infh.fileno()).st_mode & 0o7777)
+            for info in infos:
+                if info.index in headers:
+                    write_all(tmpfd, headers[info.index])
+                    copy_range(infh.fileno(), tmpfd, info.data_offset, padded_size(info.data_size))
+                else:
+                    copy_range(infh.fileno(), tmpfd, info.header_offset,
+                               hdu_end(info) - info.header_offset)
+        os.close(tmpfd)
+        tmpfd = None
+        os.replace(tmpname, filename)
+    except BaseException:
+        if tmpfd is not None:
+            os.close(tmpfd)
+        os.remove(tmpname)
+        raise
+    return False
+
+
+def _last_naxis_index(cards):
+    """Return the index of the last NAXIS/NAXISn card.
+    """
+    last = 0
+    for i, card in enumerate(cards):
+        if re.match(rb'^NAXIS[0-9]* *$', card[:8]):
+            last = i
+    return last
+
+
+# Keywords of the fixed-order cards opening a header
+MANDATORY_RE = re.compile(rb'^(SIMPLE|XTENSION|BITPIX|NAXIS[0-9]*|EXTEND|PCOUNT|GCOUNT|TFIELDS) *$')
+
+
+def last_mandatory_keyword(header):
+    """Return the keyword after which new cards can go in a raw header.
+
+    That is the last of the mandatory cards opening the header (SIMPLE or
+    XTENSION, BITPIX, NAXIS, NAXISn, then EXTEND, PCOUNT, GCOUNT or
+    TFIELDS), or for a tile-compressed image the last ZNAXISn card, where
+    the image header rebuilt by astropy has its last NAXISn card.
+    """
+    cards = header_cards(header)
+    if is_compressed(header):
+        last = _card_index(cards, 'ZNAXIS') or 0
+        for i, card in enumerate(cards):
+            if re.match(rb'^ZNAXIS[0-9]+ *$', card[:8]):
+                last = i
+    else:
+        last = 0
+        while last + 1 < len(cards) and MANDATORY_RE.match(cards[last + 1][:8]):
+            last += 1
+    return cards[last][:8].rstrip().decode('ascii')
+
+
+def primary_to_extension(header):
+    """Return a Primary HDU raw header converted to an IMAGE extension header.
+
+    The conversion is the one astropy does when a PrimaryHDU is appended
+    after the first HDU of an HDUList: SIMPLE becomes XTENSION, EXTEND is
+    dropped and PCOUNT and GCOUNT follow the NAXISn cards.
+    """
+    cards = header_cards(header)
+    if cards[0][:8] != b'SIMPLE  ':
+        return header
+    keywords = [c[:8].rstrip() for c in cards]
+    cards[0] = make_card('XTENSION', 'IMAGE', 'Image extension')
+    cards = [c for c in cards if c[:8] != b'EXTEND  ']
+    if b'PCOUNT' not in keywords:
+        last = _last_naxis_index(cards)
+        cards.insert(last + 1, make_card('PCOUNT', 0, 'number of parameters'))
+        cards.insert(last + 2, make_card('GCOUNT', 1, 'number of groups'))
+    return build_header(cards)
+
+
+def ensure_extend(header):
+    """Return a Primary HDU raw header with an EXTEND card, as astropy writes it.
+    """
+    cards = header_cards(header)
+    if cards[0][:8] != b'SIMPLE  ' or any([c[:8] == b'EXTEND  ' for c in cards]):
+        return header
+    cards.insert(_last_naxis_index(cards) + 1, make_card('EXTEND', True))
+    return build_header(cards)
+
+
+def data_padding(info):
+    """Return the fill bytes padding the data of an HDU to a whole block.
+
+    ASCII tables are padded with blanks, everything else with zeros.
+    """
+    fill = b'\0'
+    if info.header.startswith(b"XTENSION= 'TABLE"):
+        fill = b' '
+    return fill * (padded_size(info.data_size) - info.data_size)
+
+
+# Bytes per element of the binary table column types.  P and Q (variable
+# length arrays) point into the heap and are not listed.
+TFORM_BYTES = {'L': 1, 'B': 1, 'I': 2, 'J': 4, 'K': 8, 'A': 1, 'E': 4, 'D': 8, 'C': 8, 'M': 16}
+TFORM_RE = re.compile(r"^\s*([0-9]*)([A-Z])")
+
+# Keywords numbered after the column they describe
+COLUMN_KEYWORDS = ('TTYPE', 'TFORM', 'TUNIT', 'TNULL', 'TSCAL', 'TZERO', 'TDISP', 'TDIM',
+                   'TLMIN', 'TLMAX', 'TDMIN', 'TDMAX')
+
+TableColumn = collections.namedtuple('TableColumn', ['name', 'tform', 'offset', 'width', 'values', 'cards'])
+TableColumn.__doc__ = """Layout of one binary table column, from the raw header.
+
+    name:    TTYPEn
+    tform:   TFORMn normalized to repeat count and type code (e.g. '1E')
+    offset:  byte offset of the column in a row
+    width:   bytes the column takes in a row
+    values:  dict keyword without number (TDIM, TSCAL, ...) --> raw value
+    cards:   the raw 80-byte cards of the column keywords, in header order
+"""
+
+
+def table_columns(info):
+    """Return the list of TableColumn of a binary table HDU.
+
+    Raises ValueError if the HDU is not a binary table or has variable
+    length array columns.
+    """
+    header = info.header
+    offsets = card_offsets(header)
+    if _raw_value(header, offsets, 'XTENSION') != 'BINTABLE':
+        raise ValueError("HDU %s is not a binary table" % (info.name or info.index))
+    nfields = _raw_int(header, offsets, 'TFIELDS', 0)
+    keyword_re = re.compile(r"^(%s)([0-9]+)$" % '|'.join(COLUMN_KEYWORDS))
+    cards = [[] for _ in range(nfields)]
+    for card in header_cards(header):
+        m = keyword_re.match(card[:8].rstrip().decode('ascii'))
+        if m and 1 <= int(m.group(2)) <= nfields:
+            cards[int(m.group(2)) - 1].append(card)
+
+    columns = []
+    offset = 0
+    for n in range(1, nfields + 1):
+        tform = _raw_value(header, offsets, 'TFORM%d' % n) or ''
+        m = TFORM_RE.match(tform)
+        if m is None:
+            raise ValueError("Invalid TFORM%d = '%s'" % (n, tform))
+        repeat = int(m.group(1) or 1)
+        code = m.group(2)
+        if code == 'X':
+            width = (repeat + 7) // 8
+        elif code in TFORM_BYTES:
+            width = repeat * TFORM_BYTES[code]
+        else:
+            raise ValueError("Unsupported TFORM%d = '%s' (variable length arrays are not supported)" % (n, tform))
+        values = {}
+        for keyword in COLUMN_KEYWORDS:
+            value = _raw_value(header, offsets, '%s%d' % (keyword, n))
+            if value is not None:
+                values[keyword] = value
+        columns.append(TableColumn(values.get('TTYPE', 'col%d' % n), '%d%s' % (repeat, code),
+                                   offset, width, values, cards[n - 1]))
+        offset += width
+    if offset != _raw_int(header, offsets, 'NAXIS1'):
+        raise ValueError("Columns take %d bytes but NAXIS1 = %d" % (offset, _raw_int(header, offsets, 'NAXIS1')))
+    return columns
+
+
+def renumber_cards(cards, number):
+    """Return raw column cards with their keywords renumbered to number.
+    """
+    renumbered = []
+    for card in cards:
+        keyword = card[:8].rstrip().decode('ascii').rstrip('0123456789')
+        renumbered.append(('%s%d' % (keyword, number)).encode('ascii').ljust(8) + card[8:])
+    return renumbered
+
+
+def _fold(value):
+    """Fold the carries of a sum of 32-bit words back in (ones' complement).
+    """
+    while value >> 32:
+        value = (value & 0xffffffff) + (value >> 32)
+    return value
+
+
+class OnesSum(object):
+    """Running 32-bit ones' complement sum of a byte stream.
+
+    This is the sum the FITS CHECKSUM and DATASUM keywords are based on:
+    the stream is read as big-endian 32-bit words (starting at the
+    beginning of a header or data unit), added with end-around carry.
+    Chunks given to update() need not be multiples of 4 bytes.
+    """
+
+    def __init__(self, value=0):
+        self.value = value
+        self._tail = b''
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        if self._tail:
+            data = self._tail + bytes(data)
+        nwords = len(data) // 4
+        self._tail = bytes(data[nwords * 4:])
+        if nwords:
+            # uint64 partial sums cannot overflow for less than 2**32 words
+            total = int(np.frombuffer(data, dtype='>u4', count=nwords).sum(dtype=np.uint64))
+            self.value = _fold(self.value + total)
+        return self
+
+    def digest(self):
+        """Return the sum, the last partial word padded with zeros.
+        """
+        if self._tail:
+            return _fold(self.value + int.from_bytes(self._tail.ljust(4, b'\0'), 'big'))
+        return self.value
+
+
+def ones_sum(data):
+    """Return the 32-bit ones' complement sum of data (see OnesSum).
+    """
+    return OnesSum().update(data).digest()
+
+
+# Characters the ASCII encoding of CHECKSUM must avoid (punctuation
+# between the digits and letters).
+_CHECKSUM_EXCLUDE = tuple(range(0x3a, 0x41)) + tuple(range(0x5b, 0x61))
+
+
+def encode_checksum(value, complement=True):
+    """Return the 16 character ASCII encoding of a 32-bit sum.
+
+    This is the encoding of the FITS checksum convention: with complement
+    set, a CHECKSUM card holding it makes the HDU sum to -0.
+    """
+    if complement:
+        value = 0xffffffff - value
+    chars = [0] * 16
+    for i in range(4):
+        byte = (value >> (24 - 8 * i)) & 0xff
+        ch = [byte // 4 + 0x30] * 4
+        ch[0] += byte % 4
+        changed = True
+        while changed:
+            changed = False
+            for j in (0, 2):
+                if ch[j] in _CHECKSUM_EXCLUDE or ch[j + 1] in _CHECKSUM_EXCLUDE:
+                    ch[j] += 1
+                    ch[j + 1] -= 1
+                    changed = True
+        for j in range(4):
+            chars[4 * j + i] = ch[j]
+    # rotated right by one byte, as the sum is over 32-bit words
+    return bytes(chars[-1:] + chars[:-1]).decode('ascii')
+
+
+def checksum_header(header, datasum):
+    """Return a raw header with its CHECKSUM and DATASUM cards set.
+
+    datasum is the ones' complement sum of the data unit (including its
+    padding) the header goes with.  The cards are added at the end of
+    the header if missing, as astropy does, or replaced where they are,
+    so a header which already has both keeps its size.
+    """
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    header = set_card(header, 'CHECKSUM', '0' * 16, 'HDU checksum updated %s' % stamp)
+    header = set_card(header, 'DATASUM', str(datasum), 'data unit checksum updated %s' % stamp)
+    total = _fold(ones_sum(header) + datasum)
+    return set_card(header, 'CHECKSUM', encode_checksum(total), 'HDU checksum updated %s' % stamp)
+
+
+def refresh_checksum(header):
+    """Return a raw header whose CHECKSUM agrees with its (edited) cards.
+
+    Only the header is read: a stored DATASUM still holds when the data
+    are untouched, so CHECKSUM is recomputed from it.  Without a DATASUM
+    card the CHECKSUM card is removed.  Headers without CHECKSUM are
+    returned as is.
+    """
+    offsets = card_offsets(header)
+    if 'CHECKSUM' not in offsets:
+        return header
+    datasum = _raw_value(header, offsets, 'DATASUM')
+    try:
+        datasum = int(datasum)
+    except (TypeError, ValueError):
+        return delete_card(header, 'CHECKSUM')
+    return checksum_header(header, datasum)
+
+
+COPY_BUFSIZE = 8 * 1024 * 1024
+
+
+def write_all(fd, data):
+    """Write all of data to a raw file descriptor.
+    """
+    view = memoryview(data)
+    instrument.count('bytes_written', len(view))
+    while len(view):
+        view = view[os.write(fd, view):]
+
+
+def copy_range(infd, outfd, offset, size, datasum=None):
+    """Copy size bytes at offset of infd to the current position of outfd.
+
+    Both are raw file descriptors.  The copy is done in the kernel with
+    copy_file_range or sendfile when available, else through a large buffer.
+    If datasum (an OnesSum) is given the bytes go through the buffer and
+    are added to it on the way.
+    """
+    instrument.count('bytes_read', size)
+    remaining = size
+    for func in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, func) or remaining == 0 or datasum is not None:
+            continue
+        try:
+            while remaining > 0:
+                if func == 'copy_file_range':
+                    ncopy = os.copy_file_range(infd, outfd, min(remaining, 1 << 30),
+                                               offset + size - remaining)
+                else:
+                    ncopy = os.sendfile(outfd, infd, offset + size - remaining,
+                                        min(remaining, 1 << 30))
+                if ncopy == 0:
+                    raise ValueError("Unexpected end of file while copying data")
+                remaining -= ncopy
+        except OSError:
+            continue
+        break
+    # what the kernel copied; write_all() counts the rest
+    instrument.count('bytes_written', size - remaining)
+
+    while remaining > 0:
+        nbytes = min(COPY_BUFSIZE, remaining)
+        if hasattr(os, 'pread'):
+            data = os.pread(infd, nbytes, offset + size - remaining)
+        else:
+            os.lseek(infd, offset + size - remaining, os.SEEK_SET)
+            data = os.read(infd, nbytes)
+        if not data:
+            raise ValueError("Unexpected end of file while copying data")
+        if datasum is not None:
+            datasum.update(data)
+        write_all(outfd, data)
+        remaining -= len(data)
+
+
+def copy_hdu(infd, outfd, info, header=None, checksum=False):
+    """Append an HDU of infd to outfd: its header, data and padding.
+
+    header replaces the raw header of info if given.  With checksum set
+    the CHECKSUM and DATASUM cards are computed while the data are copied:
+    the header is written with placeholder values and rewritten in place
+    once the data sum is known, so nothing is read twice.
+    """
+    if header is None:
+        header = info.header
+    padding = data_padding(info)
+    if not checksum:
+        write_all(outfd, header)
+        copy_range(infd, outfd, info.data_offset, info.data_size)
+        write_all(outfd, padding)
+        return
+    start = os.lseek(outfd, 0, os.SEEK_CUR)
+    placeholder = checksum_header(header, 0)
+    write_all(outfd, placeholder)
+    datasum = OnesSum()
+    copy_range(infd, outfd, info.data_offset, info.data_size, datasum)
+    datasum.update(padding)
+    write_all(outfd, padding)
+    final = checksum_header(header, datasum.digest())
+    if len(final) != len(placeholder):
+        raise ValueError("Header changed size while setting its checksum")
+    os.pwrite(outfd, final, start)
+
+
+def is_fits_file(filename):
+    """Return True if filename starts with a fits header block.
+    """
+    instrument.count('file_opens')
+    with open(filename, 'rb') as fileobj:
+        return fileobj.read(6) == b'SIMPLE'
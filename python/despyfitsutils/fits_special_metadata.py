@@ -2,9 +2,14 @@
 """Specialized functions for computing metadata.
 """
 
-from astropy.io import fits
+import despyfitsutils._lazy as _lazy
 import despyfitsutils.fitsutils as fitsutils
-import despymisc.create_special_metadata as spmeta
+import despyfitsutils.instrument as instrument
+
+# Heavy dependencies, imported on first use
+np = _lazy.LazyModule('numpy')
+fits = _lazy.LazyModule('astropy.io.fits')
+spmeta = _lazy.LazyModule('despymisc.create_special_metadata')
 
 
 ######################################################################
@@ -13,157 +18,324 @@ import despymisc.create_special_metadata as spmeta
 ######################################################################
 
 
-def func_band(filename, hdulist=None, whichhdu=None):
-    """Create band from the filter keyword.
+# Description of every special metadata value:
+#     special key --> (header keyword, spmeta converter, honour whichhdu)
+# A converter of None means the raw header value is returned as is.  Keys
+# which do not honour whichhdu are always read from the Primary HDU.
+SPECIAL_KEYS = {
+    'band': ('FILTER', 'create_band', True),
+    'camsym': ('INSTRUME', 'create_camsym', True),
+    'nite': ('DATE-OBS', 'create_nite', True),
+    'objects': ('NAXIS2', None, True),
+    'field': ('OBJECT', 'create_field', True),
+    'radeg': ('RA', 'convert_ra_to_deg', True),
+    'tradeg': ('TELRA', 'convert_ra_to_deg', False),
+    'decdeg': ('DEC', 'convert_dec_to_deg', True),
+    'tdecdeg': ('TELDEC', 'convert_dec_to_deg', False),
+}
+
+# Special keys whose header keyword may live in the LDAC_IMHEAD of a
+# catalog when it is missing from the requested HDU.
+LDAC_FALLBACK = ('field',)
+
+
+def get_special_keywords(keys):
+    """Return the raw header keywords needed to compute the given special keys.
+    """
+    return sorted(set([SPECIAL_KEYS[k.lower()][0] for k in keys]))
+
+
+@instrument.timed
+def get_special_metadata(filename, keys, hdulist=None, whichhdu=None, errors='raise'):
+    """Compute several special metadata values with a single file open.
+
+    The file is opened once (unless an open hdulist is given) and each
+    HDU header needed is looked up only once, however many keys use it.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the fits file, ignored if hdulist is given.
+    keys : list of str
+        Special keys to compute (e.g. ['band', 'nite', 'radeg']).
+    hdulist : HDUList, optional
+        Already opened fits file.
+    whichhdu : int or str, optional
+        HDU to read the header keywords from, defaults to the Primary HDU.
+    errors : str, optional
+        'raise' to propagate the first error, 'ignore' to leave the values
+        which cannot be computed out of the returned dictionary.
+
+    Returns
+    -------
+    dict
+        Computed values keyed by the lowercase special key.
     """
+    if errors not in ('raise', 'ignore'):
+        raise ValueError("Invalid value for errors: %s" % errors)
+
+    wanted = [k.lower() for k in keys]
+    for k in wanted:
+        if k not in SPECIAL_KEYS:
+            raise KeyError("Unknown special metadata key: %s" % k)
+
     hdulist2 = None
     if hdulist is None:
         hdulist2 = fits.open(filename, 'readonly')
+        instrument.count('file_opens')
     else:
         hdulist2 = hdulist
 
-    filterval = fitsutils.get_hdr_value(hdulist2, 'FILTER', whichhdu)
+    hdrs = {}
 
-    if hdulist is None:
-        hdulist2.close()
+    def lookup(keyword, hdu):
+        if hdu not in hdrs:
+            hdrs[hdu] = fitsutils.get_hdr(hdulist2, hdu)
+        return hdrs[hdu][keyword]
 
-    return spmeta.create_band(filterval)
+    results = {}
+    try:
+        for k in wanted:
+            keyword, conv, honour_hdu = SPECIAL_KEYS[k]
+            hdu = whichhdu if honour_hdu else None
+            try:
+                try:
+                    val = lookup(keyword, hdu)
+                except Exception:
+                    if k not in LDAC_FALLBACK:
+                        raise
+                    val = lookup(keyword, 'LDAC_IMHEAD')
+                if conv is not None:
+                    val = getattr(spmeta, conv)(val)
+            except Exception:
+                if errors == 'raise':
+                    raise
+                continue
+            results[k] = val
+    finally:
+        if hdulist is None:
+            hdulist2.close()
+
+    return results
+
+
+@instrument.timed
+def func_band(filename, hdulist=None, whichhdu=None):
+    """Create band from the filter keyword.
+    """
+    return get_special_metadata(filename, ['band'], hdulist, whichhdu)['band']
 
 
+@instrument.timed
 def func_camsym(filename, hdulist=None, whichhdu=None):
     """Create camsys from the INSTRUME keyword.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
-
-    instrume = fitsutils.get_hdr_value(hdulist2, 'INSTRUME', whichhdu)
-
-    if hdulist is None:
-        hdulist2.close()
-
-    return spmeta.create_camsym(instrume)
+    return get_special_metadata(filename, ['camsym'], hdulist, whichhdu)['camsym']
 
 
+@instrument.timed
 def func_nite(filename, hdulist=None, whichhdu=None):
     """Create nite from the DATE-OBS keyword.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    return get_special_metadata(filename, ['nite'], hdulist, whichhdu)['nite']
 
-    date_obs = fitsutils.get_hdr_value(hdulist2, 'DATE-OBS', whichhdu)
 
-    if hdulist is None:
-        hdulist2.close()
+@instrument.timed
+def func_objects(filename, hdulist=None, whichhdu=None):
+    """Return the number of objects in fits catalog.
+    """
+    return get_special_metadata(filename, ['objects'], hdulist, whichhdu)['objects']
 
-    return spmeta.create_nite(date_obs)
 
+@instrument.timed
+def func_field(filename, hdulist=None, whichhdu=None):
+    """Return the field from OBJECT fits header value.
+    """
+    return get_special_metadata(filename, ['field'], hdulist, whichhdu)['field']
 
-def func_objects(filename, hdulist=None, whichhdu=None):
-    """Return the number of objects in fits catalog.
+
+@instrument.timed
+def func_radeg(filename, hdulist=None, whichhdu=None):
+    """Return the fits header value RA in degrees.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    return get_special_metadata(filename, ['radeg'], hdulist, whichhdu)['radeg']
 
-    objects = fitsutils.get_hdr_value(hdulist2, 'NAXIS2', whichhdu)
 
-    if hdulist is None:
-        hdulist2.close()
+@instrument.timed
+def func_tradeg(filename, hdulist=None, whichhdu=None):
+    """Return the fits header value TELRA in degrees.
+    """
+    return get_special_metadata(filename, ['tradeg'], hdulist, whichhdu)['tradeg']
 
-    return objects
 
+@instrument.timed
+def func_decdeg(filename, hdulist=None, whichhdu=None):
+    """Return the fits header value DEC in degrees.
+    """
+    return get_special_metadata(filename, ['decdeg'], hdulist, whichhdu)['decdeg']
 
-def func_field(filename, hdulist=None, whichhdu=None):
-    """Return the field from OBJECT fits header value.
+
+@instrument.timed
+def func_tdecdeg(filename, hdulist=None, whichhdu=None):
+    """Return the fits header value TELDEC in degrees.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    return get_special_metadata(filename, ['tdecdeg'], hdulist, whichhdu)['tdecdeg']
 
-    try:
-        objectval = fitsutils.get_hdr_value(hdulist2, 'OBJECT', whichhdu)
-    except:
-        objectval = fitsutils.get_hdr_value(hdulist2, 'OBJECT', 'LDAC_IMHEAD')
 
-    if hdulist is None:
-        hdulist2.close()
+######################################################################
+# Batch converters: same results as the scalar converters above, for
+# arrays of raw header values (e.g. columns of a harvested table).
+######################################################################
 
-    return spmeta.create_field(objectval)
 
+def _round6(values):
+    """Round an array to 6 decimals exactly like Python's round(x, 6).
 
-def func_radeg(filename, hdulist=None, whichhdu=None):
-    """Return the fits header value RA in degrees.
+    np.round() decides on the rounded product x * 1e6, which goes the
+    wrong way when the exact product is within an ulp of a half (common
+    for RA/DEC given to the millisecond).  The rounding error of the
+    product is recovered exactly (Dekker's product, 1e6 needs no
+    splitting) so the decision is made on the exact value, with ties to
+    even like Python.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 1.0e6
+    split = values * 134217729.0     # 2**27 + 1
+    high = split - (split - values)
+    error = (high * 1.0e6 - scaled) + (values - high) * 1.0e6
+    floor = np.floor(scaled)
+    above = (scaled - floor - 0.5) + error
+    up = (above > 0) | ((above == 0) & (np.fmod(floor, 2) != 0))
+    return (floor + up) / 1.0e6
+
+
+def _split_sexagesimal(values):
+    """Split an array of header values into sexagesimal fields and plain numbers.
+
+    Returns (sexa, fields, numbers): sexa tells which values contain a
+    ':', fields holds their three fields as an (N, 3) float array (a
+    leading '-' is kept, so '-00' gives -0.0) and numbers the float value
+    of the other values.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        return np.zeros(values.shape, dtype=bool), np.zeros((0, 3)), values.astype(np.float64).ravel()
+
+    values = values.astype(str)
+    sexa = np.char.find(values, ':') >= 0
+    others = values[~sexa].tolist()
+    numbers = np.fromiter(map(float, others), dtype=np.float64, count=len(others))
+
+    # Every value must have exactly three fields, checked per value so a
+    # short value cannot be made up for by a long one
+    fields = values[sexa]
+    bad = fields[np.char.count(fields, ':') != 2]
+    if bad.size:
+        raise ValueError("Invalid sexagesimal value %s" % bad[0])
+    if not fields.size:
+        return sexa, np.zeros((0, 3)), numbers
+    first = np.char.partition(fields, ':')
+    rest = np.char.partition(first[:, 2], ':')
+    try:
+        parsed = np.stack([first[:, 0], rest[:, 0], rest[:, 2]], axis=1).astype(np.float64)
+    except ValueError:
+        raise ValueError("Invalid sexagesimal value in %s" % fields)
+    return sexa, parsed, numbers
 
-    ra = fitsutils.get_hdr_value(hdulist2, 'RA', whichhdu)
 
-    if hdulist is None:
-        hdulist2.close()
+def _from_sexagesimal(values, degrees):
+    """Build the degrees array from plain numbers and the converted sexagesimal values.
+    """
+    sexa, fields, numbers = _split_sexagesimal(values)
+    result = np.empty(sexa.shape, dtype=np.float64)
+    result[~sexa] = numbers
+    result[sexa] = _round6(degrees(fields))
+    return result
 
-    return spmeta.convert_ra_to_deg(ra)
 
+@instrument.timed
+def batch_radeg(values):
+    """Convert an array of RA header values to degrees.
 
-def func_tradeg(filename, hdulist=None, whichhdu=None):
-    """Return the fits header value TELRA in degrees.
+    Vector version of spmeta.convert_ra_to_deg(): 'hh:mm:ss.s' strings
+    are converted from hours and rounded to 6 decimals, plain numbers are
+    taken as degrees.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    def degrees(fields):
+        return 15.0 * (fields[:, 0] + fields[:, 1] / 60.0 + fields[:, 2] / 3600.0)
+    return _from_sexagesimal(values, degrees)
 
-    telra = fitsutils.get_hdr_value(hdulist2, 'TELRA')
 
-    if hdulist is None:
-        hdulist2.close()
+@instrument.timed
+def batch_tradeg(values):
+    """Convert an array of TELRA header values to degrees.
+    """
+    return batch_radeg(values)
 
-    return spmeta.convert_ra_to_deg(telra)
 
+@instrument.timed
+def batch_decdeg(values):
+    """Convert an array of DEC header values to degrees.
 
-def func_decdeg(filename, hdulist=None, whichhdu=None):
-    """Return the fits header value DEC in degrees.
+    Vector version of spmeta.convert_dec_to_deg(): 'dd:mm:ss.s' strings
+    are negative when the degrees field starts with '-' (including
+    '-00') and are rounded to 6 decimals, plain numbers are taken as they
+    are.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    def degrees(fields):
+        deg = np.abs(fields[:, 0]) + fields[:, 1] / 60.0 + fields[:, 2] / 3600.0
+        return np.where(np.signbit(fields[:, 0]), -deg, deg)
+    return _from_sexagesimal(values, degrees)
 
-    dec = fitsutils.get_hdr_value(hdulist2, 'DEC', whichhdu)
 
-    if hdulist is None:
-        hdulist2.close()
+@instrument.timed
+def batch_tdecdeg(values):
+    """Convert an array of TELDEC header values to degrees.
+    """
+    return batch_decdeg(values)
 
-    return spmeta.convert_dec_to_deg(dec)
 
+_NITE_PREVIOUS_DAY = None
 
-def func_tdecdeg(filename, hdulist=None, whichhdu=None):
-    """Return the fits header value TELDEC in degrees.
+
+def _nite_previous_day():
+    """Return a boolean table telling for each hour of DATE-OBS whether it
+    belongs to the nite of the previous day.
+
+    The table is built once from spmeta.create_nite() so the batch version
+    follows its convention for the hour the nite changes.
     """
-    hdulist2 = None
-    if hdulist is None:
-        hdulist2 = fits.open(filename, 'readonly')
-    else:
-        hdulist2 = hdulist
+    global _NITE_PREVIOUS_DAY
+    if _NITE_PREVIOUS_DAY is None:
+        _NITE_PREVIOUS_DAY = np.array([spmeta.create_nite('2000-01-02T%02d:00:00' % hh) == '20000101'
+                                       for hh in range(24)])
+    return _NITE_PREVIOUS_DAY
 
-    teldec = fitsutils.get_hdr_value(hdulist2, 'TELDEC')
 
-    if hdulist is None:
-        hdulist2.close()
+@instrument.timed
+def batch_nite(values):
+    """Compute nite (YYYYMMDD strings) from an array of DATE-OBS values.
+
+    Vector version of spmeta.create_nite(): the calendar date of each
+    DATE-OBS, moved back a day for the hours of the night that belong to
+    the previous nite.
+    """
+    values = np.asarray(values).astype(str)
+    dates = values.astype('U10').astype('datetime64[D]')
+    hours = np.char.partition(values, 'T')[..., 2].astype('U2').astype(np.int64)
+    dates = dates - _nite_previous_day()[hours].astype('timedelta64[D]')
+    return np.char.replace(np.datetime_as_string(dates, unit='D'), '-', '')
 
-    return spmeta.convert_dec_to_deg(teldec)
+
+@instrument.timed
+def batch_band(values):
+    """Compute band from an array of FILTER values.
+
+    Each distinct FILTER value is converted once with spmeta.create_band()
+    and the results are mapped back through a lookup table; an invalid
+    filter raises KeyError like the scalar version.
+    """
+    values = np.asarray(values).astype(str)
+    filters, inverse = np.unique(values, return_inverse=True)
+    bands = np.array([spmeta.create_band(f) for f in filters.tolist()], dtype=str)
+    return bands[inverse].reshape(values.shape)
@@ -3,19 +3,230 @@
 """Miscellaneous generic support functions for fits files.
 """
 
+# Names exported by "from despyfitsutils import *": the public API, and
+# the modules the package always exported (the heavy ones as lazy proxies)
+__all__ = ['re', 'os', 'sys', 'astropy', 'fits', 'miscutils',
+           'makeMEF', 'combine_cats', 'shard_name', 'manifest_name', 'plan_shards',
+           'get_scamp_head_segments', 'splitScampHead', 'apply_scamp_head', 'apply_scamp_heads',
+           'HeaderEdit', 'edit_header', 'set_hdr_values', 'delete_hdr_keys', 'edit_headers',
+           'is_filename', 'get_hdr', 'get_hdr_values', 'get_hdr_value', 'get_hdr_extra', 'read_hdu',
+           'HeaderCache', 'enable_header_cache', 'disable_header_cache', 'invalidate_header_cache',
+           'header_cache_stats', 'get_ldac_imhead_as_cardlist', 'get_ldac_imhead_as_hdr']
+
 import re
+import io
 import os
+import bisect
+import mmap
 import sys
-import astropy
-from astropy.io import fits
+import queue
+import collections
+import concurrent.futures
+import itertools
+import threading
+import weakref
+import json
+import tempfile
+
+from . import _lazy
+from . import fits_blocks
+from . import hduindex
+from . import instrument
+
+# Heavy dependencies, imported on first use
+astropy = _lazy.LazyModule('astropy')
+fits = _lazy.LazyModule('astropy.io.fits')
+np = _lazy.LazyModule('numpy')
+miscutils = _lazy.LazyModule('despymisc.miscutils')
+
+
+class _MemoryBudget(object):
+    """Bound the number of inputs, and their data bytes, held at once.
+
+    A request is always granted when nothing is held, so a single input
+    larger than the ceiling can still go through.
+    """
+
+    def __init__(self, max_memory=None, max_items=2):
+        self.max_memory = max_memory
+        self.max_items = max_items
+        self.nbytes = 0
+        self.nitems = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, nbytes, stop):
+        with self.cond:
+            while self.nitems > 0 and not stop.is_set() and \
+                    (self.nitems >= self.max_items or
+                     (self.max_memory is not None and self.nbytes + nbytes > self.max_memory)):
+                self.cond.wait(0.1)
+            if stop.is_set():
+                return False
+            self.nbytes += nbytes
+            self.nitems += 1
+            return True
+
+    def release(self, nbytes):
+        with self.cond:
+            self.nbytes -= nbytes
+            self.nitems -= 1
+            self.cond.notify_all()
+
+
+def _data_nbytes(fname):
+    """Return the size of the Primary HDU data of a file, from its header.
+    """
+    try:
+        return fits_blocks.find_hdu(fname, 0).data_size
+    except ValueError:
+        return os.path.getsize(fname)
+
+
+def _read_primary(fname):
+    """Return an HDUList of the Primary HDU of a file, read into memory.
+
+    The bytes of the HDU are read, but the data are only decoded (and
+    scaled, for BSCALE/BZERO images) when the HDU is written, as in
+    read() and write(): astropy lays the header cards out differently
+    when the scaling keywords are dropped before EXTNAME is set.  Files
+    the block scanner cannot read (e.g. gzipped) are left to astropy and
+    read when written.
+    """
+    try:
+        info = fits_blocks.find_hdu(fname, 0)
+    except ValueError:
+        return fits.open(fname, memmap=False)
+    with open(fname, 'rb') as fileobj:
+        raw = fileobj.read(fits_blocks.hdu_end(info))
+    instrument.count('bytes_read', len(raw))
+    return fits.open(io.BytesIO(raw), memmap=False)
+
+
+def _prefetch(filenames, budget, verb=False):
+    """Yield (k, hdulist, nbytes) for each file, reading ahead on a thread.
+
+    The Primary HDU of each file is read on the background thread while
+    the caller works on the previous one.  The caller must release nbytes
+    from the budget once it is done with an hdulist.
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for k, fname in enumerate(filenames):
+                nbytes = _data_nbytes(fname)
+                if not budget.acquire(nbytes, stop):
+                    return
+                if verb:
+                    print("# Reading %s --> HDU %s" % (fname, k))
+                hdulist = _read_primary(fname)
+                instrument.count('file_opens')
+                results.put((k, hdulist, nbytes))
+        except Exception as err:
+            results.put(err)
+        finally:
+            results.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+        while not results.empty():
+            item = results.get()
+            if isinstance(item, tuple):
+                item[1].close()
+
+
+class _AppendStream(object):
+    """Anonymous write-only view of an open file.
+
+    astropy refuses to write an HDUList into a named, non-empty file object;
+    through this wrapper each HDU is simply appended at the current position.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        instrument.count('bytes_written', len(data))
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
 
-import despymisc.miscutils as miscutils
+    def tell(self):
+        return self.fileobj.tell()
+
+
+def _image_hdu_info(fname):
+    """Return the HDUInfo of the image HDU of a file.
+
+    That is the first tile-compressed HDU, else the first HDU with data,
+    else the Primary HDU.
+    """
+    infos = list(fits_blocks.iter_hdus(fname))
+    for info in infos:
+        if fits_blocks.is_compressed(info.header):
+            return info
+    for info in infos:
+        if info.data_size > 0:
+            return info
+    return infos[0]
+
+
+def _extname_cards(extname):
+    """Return the (keyword, value, comment, after) cards makeMEF sets for an EXTNAME.
+    """
+    cards = [('EXTNAME', extname, 'Extension Name', 'NAXIS2')]
+    if extname in makeMEF.DES_EXT:
+        cards.append(('DES_EXT', makeMEF.DES_EXT[extname], 'DESDM Extension Name', 'EXTNAME'))
+    return cards
 
 
 class makeMEF(object):
     """A Class to create a MEF fits files using astropy.io.fits.
 
     We might want to migrated this to use fitsio in the future.
+
+    By default the MEF is streamed: each input is read on a background
+    thread while the previous one is written, so only a couple of inputs
+    (and no more than max_memory bytes of data, if given) are in memory at
+    any time.  With stream=False all inputs are read first, as read() and
+    write() do.
+
+    backend='fitsio' (or DESPYFITSUTILS_BACKEND=fitsio) reads and writes
+    the images with fitsio instead, one at a time; see
+    despyfitsutils.backends.  It applies to this default mode only, not
+    to passthrough or compress, nor to the other fitsutils functions.
+
+    checksum=True writes the CHECKSUM and DATASUM keywords of every HDU,
+    computed as the HDUs are written.
+
+    compress='RICE_1' (or GZIP_1, GZIP_2, HCOMPRESS_1, PLIO_1, or a
+    despyfitsutils.compress.CompressOptions) writes tile-compressed image
+    extensions after an empty Primary HDU, as fpack does, with the
+    quantize_level, quantize_method, dither_seed and tile_shape settings
+    of floating point images.  The inputs are compressed by nproc worker
+    processes and written in order.
+
+    preflight=True checks the headers of all inputs before anything is
+    read (on nproc processes) and raises a
+    despyfitsutils.preflight.PreflightError listing every missing,
+    truncated or imageless input, and duplicate extension names.
+
+    index=True saves the HDU offsets of the output in a sidecar file (see
+    despyfitsutils.hduindex), so that, with sidecars enabled, any extension
+    can later be read without scanning the ones before it.
     """
 
     # -----------------------------------
@@ -33,6 +244,21 @@ class makeMEF(object):
         self.clobber = kwargs.pop('clobber', False)
         self.extnames = kwargs.pop('extnames', None)
         self.verb = kwargs.pop('verb', False)
+        self.stream_mode = kwargs.pop('stream', True)
+        self.max_memory = kwargs.pop('max_memory', None)
+        self.passthrough = kwargs.pop('passthrough', False)
+        self.backend = kwargs.pop('backend', None)
+        self.checksum = kwargs.pop('checksum', False)
+        self.compress = kwargs.pop('compress', None)
+        self.nproc = kwargs.pop('nproc', 1)
+        self.preflight = kwargs.pop('preflight', False)
+        self.index = kwargs.pop('index', False)
+        compress_kwargs = {}
+        for key in ('quantize_level', 'quantize_method', 'dither_seed', 'tile_shape'):
+            value = kwargs.pop(key, None)
+            if value is not None:
+                compress_kwargs[key] = value
+        self.HDU = []
 
         # Make sure that filenames and outname are defined
         if not self.filenames:
@@ -48,13 +274,50 @@ class makeMEF(object):
         # Get the astropy version as a float.
         self.astropyVersion = float(".".join(astropy.__version__.split(".")[0:2]))
 
-        self.read()
-        if self.extnames:
-            self.addEXTNAME()
-        self.write()
+        if self.extnames and len(self.extnames) != len(self.filenames):
+            sys.exit("ERROR: number of extension names doesn't match filenames")
+
+        if self.compress and self.passthrough:
+            sys.exit("ERROR: compress and passthrough cannot be used together")
+        if isinstance(self.compress, str):
+            from . import compress
+            self.compress = compress.compress_options(self.compress, **compress_kwargs)
+
+        if self.preflight:
+            self.checkInputs()
 
+        from . import backends
+        if self.passthrough:
+            self.copyHDUs()
+        elif self.compress:
+            self.writeCompressed()
+        elif backends.get_backend(self.backend).name != 'astropy':
+            self.writeBackend()
+        elif self.stream_mode:
+            self.stream()
+        else:
+            self.read()
+            if self.extnames:
+                self.addEXTNAME()
+            self.write()
+
+        if self.index:
+            hduindex.write_index(self.outname)
         return
 
+    @instrument.timed
+    def checkInputs(self, **kwargs):
+        """Check the headers of all inputs before any image is read.
+
+        Raises PreflightError listing every problem.  The SCI, MSK and WGT
+        planes of a CCD must also have the same shape.
+        """
+        from . import preflight
+        whichhdu = None if (self.passthrough or self.compress) else 0
+        planes = bool(self.extnames) and set([e.upper() for e in self.extnames]) <= set(makeMEF.DES_EXT)
+        return preflight.preflight_images(self.filenames, self.extnames, whichhdu, same_shape=planes,
+                                          nproc=self.nproc)
+
     def addEXTNAME(self, **kwargs):
         """Add a user-provided list of extension names to the MEF.
         """
@@ -64,24 +327,27 @@ class makeMEF(object):
 
         k = 0
         for extname, hdu in zip(self.extnames, self.HDU):
+            self.setEXTNAME(hdu[0].header, extname, k)
+            k = k + 1
+        return
 
-            if self.verb:
-                print("# Adding EXTNAME=%s to HDU %s" % (extname, k))
-
-            if self.astropyVersion < 0.2:
-                hdu[0].header.update('EXTNAME', extname, 'Extension Name', after='NAXIS2')
-                if extname in list(makeMEF.DES_EXT.keys()):
-                    hdu[0].header.update('DES_EXT', makeMEF.DES_EXT[extname],
-                                         'DESDM Extension Name', after='EXTNAME')
-            else:
-                hdu[0].header.set('EXTNAME', extname, 'Extension Name', after='NAXIS2')
-                if extname in list(makeMEF.DES_EXT.keys()):
-                    hdu[0].header.set('DES_EXT', makeMEF.DES_EXT[extname],
-                                      'DESDM Extension Name', after='EXTNAME')
+    def setEXTNAME(self, header, extname, k=0):
+        """Set EXTNAME (and DES_EXT when known) in the header of HDU k.
+        """
+        if self.verb:
+            print("# Adding EXTNAME=%s to HDU %s" % (extname, k))
 
-            k = k + 1
+        if self.astropyVersion < 0.2:
+            header.update('EXTNAME', extname, 'Extension Name', after='NAXIS2')
+            if extname in list(makeMEF.DES_EXT.keys()):
+                header.update('DES_EXT', makeMEF.DES_EXT[extname],
+                              'DESDM Extension Name', after='EXTNAME')
+        else:
+            for keyword, value, comment, after in _extname_cards(extname):
+                header.set(keyword, value, comment, after=after)
         return
 
+    @instrument.timed
     def read(self, **kwargs):
         """Read in the HDUs.
         """
@@ -91,32 +357,598 @@ class makeMEF(object):
             if self.verb:
                 print("# Reading %s --> HDU %s" % (fname, k))
             self.HDU.append(fits.open(fname))
+            instrument.count('file_opens')
             k = k + 1
         return
 
+    @instrument.timed
     def write(self, **kwargs):
         """Write MEF file with no Primary HDU.
+
+        Streams the inputs if they have not been read in.
         """
+        if not self.HDU:
+            return self.stream()
+
         newhdu = fits.HDUList()
 
         for hdu in self.HDU:
             newhdu.append(hdu[0])# ,hdu[0].header)
+            instrument.count('hdus_copied')
         if self.verb:
             print("# Writing to: %s" % self.outname)
         if self.astropyVersion > 1.2:
-            newhdu.writeto(self.outname, overwrite=self.clobber)
+            newhdu.writeto(self.outname, overwrite=self.clobber, checksum=self.checksum)
         else:
-            newhdu.writeto(self.outname, clobber=self.clobber)
+            newhdu.writeto(self.outname, clobber=self.clobber, checksum=self.checksum)
+        return
+
+    @instrument.timed
+    def stream(self, **kwargs):
+        """Write MEF file one input at a time, reading ahead on a thread.
+
+        Gives the same file as read() followed by write().
+        """
+        if self.verb:
+            print("# Writing to: %s" % self.outname)
+
+        budget = _MemoryBudget(self.max_memory)
+        nfiles = len(self.filenames)
+        with open(self.outname, 'wb' if self.clobber else 'xb') as outfh:
+            try:
+                for k, hdulist, nbytes in _prefetch(self.filenames, budget, self.verb):
+                    try:
+                        hdu = hdulist[0]
+                        if self.extnames:
+                            self.setEXTNAME(hdu.header, self.extnames[k], k)
+                        self._writeHDU(outfh, hdu, k, nfiles)
+                    finally:
+                        hdulist.close()
+                        budget.release(nbytes)
+            except BaseException:
+                # do not leave a partial MEF behind
+                outfh.close()
+                os.remove(self.outname)
+                raise
+        return
+
+    @instrument.timed
+    def copyHDUs(self, **kwargs):
+        """Write MEF file by copying the bytes of each input image HDU.
+
+        Pass-through mode for (mostly) fpacked inputs: the binary table
+        holding the compressed tiles of each input is copied as is, so pixels
+        are never decompressed nor recompressed.  Only the EXTNAME and
+        DES_EXT header cards are rewritten.  Uncompressed inputs are copied
+        as IMAGE extensions.  As in fpack output, the HDUs follow an empty
+        Primary HDU.
+        """
+        sources = []
+        for fname in self.filenames:
+            sources.append((fname, _image_hdu_info(fname)))
+
+        if self.verb:
+            print("# Writing to: %s" % self.outname)
+        with open(self.outname, 'wb' if self.clobber else 'xb', buffering=0) as outfh:
+            try:
+                outfd = outfh.fileno()
+                primary = fits.PrimaryHDU().header.tostring().encode('ascii')
+                if self.checksum:
+                    primary = fits_blocks.checksum_header(primary, 0)
+                fits_blocks.write_all(outfd, primary)
+                for k, (fname, info) in enumerate(sources):
+                    if self.verb:
+                        print("# Copying %s HDU %d --> HDU %s" % (fname, info.index, k + 1))
+                    header = info.header
+                    if info.index == 0:
+                        header = fits_blocks.primary_to_extension(header)
+                    if self.extnames:
+                        header = self._setRawEXTNAME(header, self.extnames[k], k)
+                    with open(fname, 'rb', buffering=0) as infh:
+                        fits_blocks.copy_hdu(infh.fileno(), outfd, info, header, self.checksum)
+                    instrument.count('file_opens')
+                    instrument.count('hdus_copied')
+            except BaseException:
+                outfh.close()
+                os.remove(self.outname)
+                raise
+        return
+
+    @instrument.timed
+    def writeCompressed(self, **kwargs):
+        """Write MEF file of tile-compressed image extensions.
+
+        Each input is read and compressed by one of nproc worker processes
+        and the compressed HDUs are appended in order as they come back,
+        after an empty Primary HDU.
+        """
+        from . import compress
+        jobs = []
+        for k, fname in enumerate(self.filenames):
+            cards = []
+            if self.extnames:
+                if self.verb:
+                    print("# Adding EXTNAME=%s to HDU %s" % (self.extnames[k], k + 1))
+                cards = _extname_cards(self.extnames[k])
+            jobs.append((fname, _image_hdu_info(fname).index, self.compress, cards, self.checksum))
+
+        if self.verb:
+            print("# Writing to: %s (%s)" % (self.outname, self.compress.compression_type))
+        with open(self.outname, 'wb' if self.clobber else 'xb', buffering=0) as outfh:
+            try:
+                outfd = outfh.fileno()
+                primary = fits.PrimaryHDU().header.tostring().encode('ascii')
+                if self.checksum:
+                    primary = fits_blocks.checksum_header(primary, 0)
+                fits_blocks.write_all(outfd, primary)
+                for hdu in compress.imap_ordered(compress.compress_file_hdu, jobs, self.nproc):
+                    fits_blocks.write_all(outfd, hdu)
+                    instrument.count('hdus_copied')
+            except BaseException:
+                outfh.close()
+                os.remove(self.outname)
+                raise
+        return
+
+    @instrument.timed
+    def writeBackend(self, **kwargs):
+        """Write MEF file through a despyfitsutils.backends backend.
+
+        Each input is read and written before the next one is read.
+        """
+        from . import backends
+        backend = backends.get_backend(self.backend)
+
+        def images():
+            for k, fname in enumerate(self.filenames):
+                if self.verb:
+                    print("# Reading %s --> HDU %s" % (fname, k))
+                data, header = backend.read_image(fname, 0)
+                if self.extnames:
+                    self.setEXTNAME(header, self.extnames[k], k)
+                yield data, header
+
+        if self.verb:
+            print("# Writing to: %s (%s backend)" % (self.outname, backend.name))
+        existed = os.path.exists(self.outname)
+        try:
+            backend.write_mef(self.outname, images(), clobber=self.clobber, checksum=self.checksum)
+        except BaseException:
+            # do not leave a partial MEF behind (nor remove a file we did not write)
+            if (self.clobber or not existed) and os.path.exists(self.outname):
+                os.remove(self.outname)
+            raise
         return
 
+    def _setRawEXTNAME(self, header, extname, k=0):
+        """Set EXTNAME (and DES_EXT when known) in a raw header of HDU k.
+
+        The cards go after the mandatory cards of the header (GCOUNT for a
+        converted Primary HDU, the last ZNAXISn of a tile-compressed image,
+        which is where they show up once the image header is rebuilt).
+        """
+        if self.verb:
+            print("# Adding EXTNAME=%s to HDU %s" % (extname, k))
+
+        after = fits_blocks.last_mandatory_keyword(header)
+        header = fits_blocks.set_card(header, 'EXTNAME', extname, 'Extension Name', after=after)
+        if extname in list(makeMEF.DES_EXT.keys()):
+            header = fits_blocks.set_card(header, 'DES_EXT', makeMEF.DES_EXT[extname],
+                                          'DESDM Extension Name', after='EXTNAME')
+        # the header changed: recompute a stored CHECKSUM from DATASUM
+        return fits_blocks.refresh_checksum(header)
+
+    def _writeHDU(self, outfh, hdu, k, nfiles):
+        """Append hdu to the open output file as HDU k of nfiles.
+
+        The HDU goes through HDUList.append, as in write(), so that Primary
+        HDUs after the first are converted to IMAGE extensions identically.
+        """
+        if k == 0:
+            newhdu = fits.HDUList()
+            newhdu.append(hdu)
+            if nfiles > 1:
+                # what HDUList.update_extend does for a multi-HDU list
+                hdr = newhdu[0].header
+                if 'EXTEND' in hdr:
+                    if not hdr['EXTEND']:
+                        hdr['EXTEND'] = True
+                elif hdr['NAXIS'] == 0:
+                    hdr.set('EXTEND', True, after='NAXIS')
+                else:
+                    hdr.set('EXTEND', True, after='NAXIS' + str(hdr['NAXIS']))
+            newhdu.writeto(_AppendStream(outfh), checksum=self.checksum)
+        else:
+            newhdu = fits.HDUList([fits.PrimaryHDU()])
+            newhdu.append(hdu)
+            ext = newhdu[1]
+            ext.verify('exception')
+            # a lone extension, written without a Primary HDU in front
+            fits.HDUList([ext]).writeto(_AppendStream(outfh), output_verify='ignore', checksum=self.checksum)
+        outfh.flush()
+        instrument.count('hdus_copied')
+
+
+# Table merged by combine_cats(mode='merge'), the index column added to it
+# and the table listing the catalogs the index refers to.
+MERGE_TABLE = 'LDAC_OBJECTS'
+MERGE_INDEX_COLUMN = 'CAT_INDEX'
+MERGE_CATALOGS_TABLE = 'CATALOGS'
+MERGE_CHUNK_ROWS = 65536
+
 
-def combine_cats(incats, outcat):
+@instrument.timed
+def combine_cats(incats, outcat, mode='stream', columns=None, chunk_rows=MERGE_CHUNK_ROWS, checksum=False,
+                 compress=None, nproc=1, preflight=False, index=False, max_bytes=None, max_hdus=None,
+                 manifest=None):
     """Combine all input catalogs (each with 3 hdus) into a single fits file.
+
+    With mode='stream' the header and data blocks of each input HDU are
+    copied straight into the output without being decoded, so memory use
+    does not grow with the number of catalogs.  With mode='astropy' all
+    HDUs are gathered in an HDUList which is then written.  Stream mode
+    falls back to astropy if an input cannot be scanned (e.g. gzipped).
+
+    With mode='merge' the LDAC_OBJECTS tables of all catalogs are merged
+    into a single binary table, see _combine_cats_merge; columns (a list
+    or comma-separated string) restricts it to some columns and chunk_rows
+    is the number of rows copied at a time.
+
+    checksum=True writes the CHECKSUM and DATASUM keywords of every HDU;
+    in stream and merge modes they are computed while the data are
+    copied, so the output is never read back.
+
+    compress (a compression type such as 'RICE_1' or GZIP_1, or a
+    despyfitsutils.compress.CompressOptions) tile-compresses the image
+    HDUs of the catalogs in stream mode, on nproc worker processes.
+    Only images with data are compressed: tables, and so the LDAC tables
+    themselves, are copied uncompressed, so compress does nothing for
+    normal LDAC catalogs, whose Primary HDUs are empty.
+
+    preflight=True checks the headers of all catalogs before anything is
+    written (on nproc processes) and raises a
+    despyfitsutils.preflight.PreflightError listing every missing,
+    truncated or malformed catalog, LDAC_OBJECTS tables with a broken
+    column layout and, in merge mode, tables whose columns differ.  In
+    stream mode the HDUs found by the check are then copied without
+    reading the headers again.
+
+    index=True saves the HDU offsets of the output in a sidecar file (see
+    despyfitsutils.hduindex), for direct access to any catalog's HDUs when
+    sidecars are enabled.
+
+    With max_bytes and/or max_hdus the output is split into shards no
+    larger than that (outcat with _0000, _0001, ... before its extension),
+    each holding the usual 3 HDUs of whole catalogs, and written by nproc
+    worker processes at once; see _combine_cats_sharded.  The manifest
+    is then returned.
     """
+    if mode not in ('stream', 'astropy', 'merge'):
+        raise ValueError("Invalid combine_cats mode: %s" % mode)
+    sharded = max_bytes is not None or max_hdus is not None
+    if sharded and (mode != 'stream' or compress):
+        raise ValueError("combine_cats can only write shards in stream mode, without compression")
+
     # if incats is comma-separated list, split into python list
     comma_re = re.compile(r"\s*,\s*")
     incat_lst = comma_re.split(incats)
 
+    if isinstance(columns, str):
+        columns = comma_re.split(columns.strip())
+
+    checks = None
+    if preflight:
+        from . import preflight as _preflight
+        # merged tables must also share their columns
+        checks = _preflight.preflight_catalogs(incat_lst, nproc=nproc, same_schema=(mode == 'merge'),
+                                               columns=columns)
+
+    if sharded:
+        return _combine_cats_sharded(incat_lst, outcat, max_bytes, max_hdus, manifest, checksum, nproc, index)
+
+    if compress and mode != 'stream':
+        raise ValueError("combine_cats can only compress in stream mode")
+    if isinstance(compress, str):
+        from . import compress as _compress
+        compress = _compress.compress_options(compress)
+
+    if mode == 'merge':
+        # check every schema before the output is touched
+        layout = _merge_layout(incat_lst, columns)
+        if os.path.exists(outcat):
+            os.remove(outcat)
+            miscutils.fwdebug_print("Removing pre-existing version of fullcat %s" % outcat)
+        _combine_cats_merge(incat_lst, layout, outcat, chunk_rows, checksum)
+        if index:
+            hduindex.write_index(outcat)
+        return
+
+    extents = None
+    if mode == 'stream' and checks and all([check.infos for check in checks]):
+        extents = [(check.filename, check.infos[:CATALOG_HDUS]) for check in checks]
+    elif mode == 'stream':
+        try:
+            extents = [(incat, _catalog_extents(incat)) for incat in incat_lst]
+        except ValueError as err:
+            if compress:
+                raise
+            miscutils.fwdebug_print("Cannot stream catalogs (%s), using astropy" % err)
+
+    # And write the full hdulist to the output file
+    if os.path.exists(outcat):
+        os.remove(outcat)
+        miscutils.fwdebug_print("Removing pre-existing version of fullcat %s" % outcat)
+
+    if extents is not None:
+        _combine_cats_stream(extents, outcat, checksum, compress, nproc)
+    else:
+        _combine_cats_astropy(incat_lst, outcat, checksum)
+    if index:
+        hduindex.write_index(outcat)
+
+
+def _catalog_extents(incat, nhdus=3):
+    """Return the HDUInfo of the first nhdus HDUs of a catalog.
+    """
+    infos = list(itertools.islice(fits_blocks.iter_hdus(incat), nhdus))
+    if len(infos) < nhdus:
+        raise IndexError("Catalog %s has %d HDUs, expected %d" % (incat, len(infos), nhdus))
+    return infos
+
+
+def _combine_cats_stream(extents, outcat, checksum=False, compress=None, nproc=1):
+    """Write the HDUs located by extents to outcat as raw byte ranges.
+
+    The Primary HDUs of all but the first catalog are turned into IMAGE
+    extensions the same way astropy does; every data segment is copied
+    untouched, unless compress is given: uncompressed images (but for the
+    first Primary HDU) are then tile-compressed on nproc worker processes,
+    which are only started if there is such an image.
+    """
+    jobs = []
+    for k, (incat, infos) in enumerate(extents):
+        for info in infos:
+            job = None
+            if compress and (k, info.index) != (0, 0) and fits_blocks.is_image(info) and \
+               not fits_blocks.is_compressed(info.header):
+                job = (incat, info.index, compress, None, checksum)
+            jobs.append(job)
+    if any(jobs):
+        from . import compress as _compress
+        compressed = _compress.imap_ordered(_compress.compress_file_hdu, jobs, nproc)
+    else:
+        # nothing to compress (e.g. LDAC catalogs): no worker pool
+        compressed = (None for _ in jobs)
+
+    if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+        miscutils.fwdebug_print("Writing results to fullcat --> %s" % outcat)
+    try:
+        with open(outcat, 'wb', buffering=0) as outfh:
+            outfd = outfh.fileno()
+            for k, (incat, infos) in enumerate(extents):
+                if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+                    miscutils.fwdebug_print("Appending %d HDUs from cat --> %s" % (len(infos), incat))
+                instrument.count('file_opens')
+                with open(incat, 'rb', buffering=0) as infh:
+                    for info in infos:
+                        hdu = next(compressed)
+                        if hdu is not None:
+                            fits_blocks.write_all(outfd, hdu)
+                            instrument.count('hdus_copied')
+                            continue
+                        header = info.header
+                        if info.index == 0:
+                            if k == 0:
+                                header = fits_blocks.ensure_extend(header)
+                            else:
+                                header = fits_blocks.primary_to_extension(header)
+                        fits_blocks.copy_hdu(infh.fileno(), outfd, info, header, checksum)
+                        instrument.count('hdus_copied')
+    finally:
+        # stops the worker pool if something went wrong
+        compressed.close()
+
+
+# Column keywords which have to agree for two columns to be merged
+_MERGE_SCHEMA_KEYWORDS = ('TDIM', 'TSCAL', 'TZERO', 'TNULL')
+
+MergeInput = collections.namedtuple('MergeInput', ['filename', 'info', 'nrows', 'row_bytes', 'byte_index'])
+
+
+def _schema_value(keyword, value):
+    """Return a column keyword value in a form which compares across files.
+    """
+    if keyword == 'TDIM':
+        return value.replace(' ', '')
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _merge_layout(incat_lst, columns=None):
+    """Check the tables to merge and return (output columns, [MergeInput]).
+
+    The output columns are the TableColumns of the first catalog, all or
+    the ones named in columns, in that order.  Every catalog must have
+    those columns with the same type, dimensions and scaling, though not
+    necessarily in the same order; without columns they must also have
+    no other column.  All problems are reported in a single ValueError.
+    """
+    problems = []
+    tables = []
+    for incat in incat_lst:
+        try:
+            info = fits_blocks.find_hdu(incat, MERGE_TABLE)
+            tables.append((incat, info, fits_blocks.table_columns(info)))
+        except (OSError, KeyError, ValueError) as err:
+            problems.append("%s: %s" % (incat, err))
+    if not tables:
+        raise ValueError("Cannot merge catalogs:\n  " + "\n  ".join(problems))
+
+    first = dict([(col.name.upper(), col) for col in tables[0][2]])
+    if columns is None:
+        selected = list(tables[0][2])
+    else:
+        selected = []
+        for name in columns:
+            if name.upper() in first:
+                selected.append(first[name.upper()])
+            else:
+                problems.append("%s: no column %s" % (tables[0][0], name))
+    if columns is not None and not columns:
+        problems.append("No column to merge")
+    names = [col.name.upper() for col in selected]
+    if MERGE_INDEX_COLUMN in names:
+        problems.append("Column %s clashes with the catalog index column" % MERGE_INDEX_COLUMN)
+
+    inputs = []
+    for incat, info, cols in tables:
+        bynames = dict([(col.name.upper(), col) for col in cols])
+        if columns is None:
+            for name in sorted(set(bynames) - set(names)):
+                problems.append("%s: extra column %s" % (incat, name))
+        byte_index = []
+        for ref in selected:
+            col = bynames.get(ref.name.upper())
+            if col is None:
+                problems.append("%s: missing column %s" % (incat, ref.name))
+                continue
+            if col.tform != ref.tform:
+                problems.append("%s: column %s has TFORM %s, expected %s" % (incat, ref.name, col.tform, ref.tform))
+            for keyword in _MERGE_SCHEMA_KEYWORDS:
+                value = col.values.get(keyword)
+                expected = ref.values.get(keyword)
+                if (value is None) != (expected is None) or \
+                   (value is not None and _schema_value(keyword, value) != _schema_value(keyword, expected)):
+                    problems.append("%s: column %s has %s %s, expected %s" % (incat, ref.name, keyword,
+                                                                                 value, expected))
+            byte_index.append((col.offset, col.width))
+        offsets = fits_blocks.card_offsets(info.header)
+        if fits_blocks._raw_int(info.header, offsets, 'PCOUNT', 0) != 0:
+            problems.append("%s: %s has a heap (PCOUNT != 0)" % (incat, MERGE_TABLE))
+            continue
+        row_bytes = fits_blocks._raw_int(info.header, offsets, 'NAXIS1')
+        nrows = fits_blocks._raw_int(info.header, offsets, 'NAXIS2')
+        inputs.append(MergeInput(incat, info, nrows, row_bytes, byte_index))
+
+    if problems:
+        raise ValueError("Cannot merge catalogs:\n  " + "\n  ".join(problems))
+    return selected, inputs
+
+
+def _merge_header(selected, nrows):
+    """Return the raw header of the merged table.
+    """
+    row_bytes = sum([col.width for col in selected]) + 4
+    cards = [fits_blocks.make_card('XTENSION', 'BINTABLE', 'binary table extension'),
+             fits_blocks.make_card('BITPIX', 8, 'array data type'),
+             fits_blocks.make_card('NAXIS', 2, 'number of array dimensions'),
+             fits_blocks.make_card('NAXIS1', row_bytes, 'length of dimension 1'),
+             fits_blocks.make_card('NAXIS2', nrows, 'length of dimension 2'),
+             fits_blocks.make_card('PCOUNT', 0, 'number of group parameters'),
+             fits_blocks.make_card('GCOUNT', 1, 'number of groups'),
+             fits_blocks.make_card('TFIELDS', len(selected) + 1, 'number of table fields')]
+    for n, col in enumerate(selected):
+        cards.extend(fits_blocks.renumber_cards(col.cards, n + 1))
+    number = len(selected) + 1
+    cards.append(fits_blocks.make_card('TTYPE%d' % number, MERGE_INDEX_COLUMN))
+    cards.append(fits_blocks.make_card('TFORM%d' % number, 'J'))
+    cards.append(fits_blocks.make_card('EXTNAME', MERGE_TABLE, 'extension name'))
+    return fits_blocks.build_header(cards)
+
+
+def _combine_cats_merge(incat_lst, layout, outcat, chunk_rows=MERGE_CHUNK_ROWS, checksum=False):
+    """Write the LDAC_OBJECTS rows of all catalogs to a single table.
+
+    layout is what _merge_layout returns.  The output has an empty Primary
+    HDU, the merged LDAC_OBJECTS table with an extra CAT_INDEX column (the
+    index of the catalog each row comes from in incat_lst) and a CATALOGS
+    table with the catalog file names.  Rows are copied as raw bytes,
+    chunk_rows at a time from a memory map of each input, picking the
+    bytes of the selected columns, so memory use does not depend on the
+    size of the catalogs.  With checksum set the table header is written
+    with placeholder CHECKSUM/DATASUM values and rewritten once the rows
+    have been summed.
+    """
+    selected, inputs = layout
+    if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+        miscutils.fwdebug_print("Merging %d catalogs into --> %s" % (len(inputs), outcat))
+    width = sum([col.width for col in selected])
+    nrows = sum([inp.nrows for inp in inputs])
+    chunk_rows = max(1, int(chunk_rows))
+    buf = np.empty((chunk_rows, width + 4), dtype=np.uint8)
+
+    with open(outcat, 'wb', buffering=0) as outfh:
+        outfd = outfh.fileno()
+        primary = fits_blocks.build_header([
+            fits_blocks.make_card('SIMPLE', True, 'conforms to FITS standard'),
+            fits_blocks.make_card('BITPIX', 8, 'array data type'),
+            fits_blocks.make_card('NAXIS', 0, 'number of array dimensions'),
+            fits_blocks.make_card('EXTEND', True)])
+        header = _merge_header(selected, nrows)
+        datasum = None
+        if checksum:
+            primary = fits_blocks.checksum_header(primary, 0)
+            datasum = fits_blocks.OnesSum()
+            header_offset = len(primary)
+            placeholder = fits_blocks.checksum_header(header, 0)
+            fits_blocks.write_all(outfd, primary)
+            fits_blocks.write_all(outfd, placeholder)
+        else:
+            fits_blocks.write_all(outfd, primary)
+            fits_blocks.write_all(outfd, header)
+
+        for k, inp in enumerate(inputs):
+            if inp.nrows == 0:
+                continue
+            if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+                miscutils.fwdebug_print("Appending %d rows from cat --> %s" % (inp.nrows, inp.filename))
+            # byte columns of the input row to copy, in output order
+            index = np.concatenate([np.arange(offset, offset + size) for offset, size in inp.byte_index])
+            identity = len(index) == inp.row_bytes and (index == np.arange(inp.row_bytes)).all()
+            buf[:, width:] = np.full(1, k, dtype='>i4').view(np.uint8)
+            instrument.count('file_opens')
+            rows = np.memmap(inp.filename, dtype=np.uint8, mode='r', offset=inp.info.data_offset,
+                             shape=(inp.nrows, inp.row_bytes))
+            try:
+                for start in range(0, inp.nrows, chunk_rows):
+                    chunk = rows[start:start + chunk_rows]
+                    n = len(chunk)
+                    if identity:
+                        buf[:n, :width] = chunk
+                    else:
+                        buf[:n, :width] = chunk[:, index]
+                    instrument.count('bytes_read', chunk.nbytes)
+                    if datasum is not None:
+                        datasum.update(buf[:n])
+                    fits_blocks.write_all(outfd, buf[:n])
+            finally:
+                del rows
+
+        size = nrows * (width + 4)
+        fits_blocks.write_all(outfd, b'\0' * (fits_blocks.padded_size(size) - size))
+        if datasum is not None:
+            # the zero padding adds nothing to the sum
+            final = fits_blocks.checksum_header(header, datasum.digest())
+            if len(final) != len(placeholder):
+                raise ValueError("Header changed size while setting its checksum")
+            os.pwrite(outfd, final, header_offset)
+        instrument.count('hdus_copied')
+
+    # the table of catalog names is small: let astropy write it
+    names = [inp.filename for inp in inputs]
+    catalogs = fits.BinTableHDU.from_columns([
+        fits.Column('INDEX', 'J', array=np.arange(len(names))),
+        fits.Column('FILENAME', '%dA' % max([len(name) for name in names] + [1]), array=names)],
+        name=MERGE_CATALOGS_TABLE)
+    with open(outcat, 'ab') as outfh:
+        fits.HDUList([catalogs]).writeto(_AppendStream(outfh), output_verify='ignore', checksum=checksum)
+
+
+def _combine_cats_astropy(incat_lst, outcat, checksum=False):
+    """Combine catalogs by appending their HDUs to an astropy HDUList.
+    """
     if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
         miscutils.fwdebug_print("Constructing hdulist object for single fits file")
     # Construct hdulist object to append hdus from individual catalogs to
@@ -130,74 +962,503 @@ def combine_cats(incats, outcat):
         hdulist.append(hdulist1[0])
         hdulist.append(hdulist1[1])
         hdulist.append(hdulist1[2])
+        instrument.count('file_opens')
+        instrument.count('hdus_copied', 3)
         #hdulist1.close()
 
-    # And write the full hdulist to the output file
-    if os.path.exists(outcat):
-        os.remove(outcat)
-        miscutils.fwdebug_print("Removing pre-existing version of fullcat %s" % outcat)
-
     if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
         miscutils.fwdebug_print("Writing results to fullcat --> %s" % outcat)
-    hdulist.writeto(outcat)
+    hdulist.writeto(outcat, checksum=checksum)
+    instrument.count('bytes_written', os.path.getsize(outcat))
 
     if miscutils.fwdebug_check(6, 'FITSUTILS_DEBUG'):
         miscutils.fwdebug_print("Using fits_close to close fullcat --> %s" % outcat)
     hdulist.close()
 
 
+# HDUs each catalog takes in a combined output
+CATALOG_HDUS = 3
+
+
+def shard_name(outcat, k):
+    """Return the name of shard k of a sharded combine_cats output.
+
+    The shard number goes before the fits extension (combined.fits -->
+    combined_0003.fits), or at the end of a name without one.
+    """
+    pos = outcat.rfind('.fits')
+    if pos <= 0:
+        return '%s_%04d' % (outcat, k)
+    return '%s_%04d%s' % (outcat[:pos], k, outcat[pos:])
+
+
+def manifest_name(outcat):
+    """Return the default name of the manifest of a sharded combine_cats output.
+    """
+    pos = outcat.rfind('.fits')
+    return '%s_manifest.json' % (outcat[:pos] if pos > 0 else outcat)
+
+
+def _catalog_output_size(incat, checksum=False):
+    """Return the bytes (first, other) a catalog takes in a combined output.
+
+    first is its size as the first catalog of a file, whose Primary HDU
+    stays a Primary HDU, other its size after another catalog, when the
+    Primary HDU becomes an IMAGE extension.  The headers are rebuilt the
+    way _combine_cats_stream writes them, so the sizes are exact.
+    """
+    sizes = [0, 0]
+    for info in _catalog_extents(incat, CATALOG_HDUS):
+        for k in range(2):
+            header = info.header
+            if info.index == 0:
+                header = fits_blocks.ensure_extend(header) if k == 0 else fits_blocks.primary_to_extension(header)
+            if checksum:
+                header = fits_blocks.checksum_header(header, 0)
+            sizes[k] += len(header) + fits_blocks.padded_size(info.data_size)
+    return tuple(sizes)
+
+
+def plan_shards(sizes, max_bytes=None, max_hdus=None, nhdus=CATALOG_HDUS):
+    """Split catalogs into shards, in order; return lists of catalog positions.
+
+    sizes holds the (first, other) output sizes of each catalog.  A shard
+    is closed when the next catalog would take it over max_bytes or
+    max_hdus (nhdus HDUs per catalog).  A catalog larger than max_bytes on
+    its own gets a shard of its own.
+    """
+    if max_hdus is not None and max_hdus < nhdus:
+        raise ValueError("max_hdus must be at least %d (the HDUs of one catalog)" % nhdus)
+    shards = []
+    current = []
+    nbytes = 0
+    for k, (first, other) in enumerate(sizes):
+        if current:
+            full = max_hdus is not None and (len(current) + 1) * nhdus > max_hdus
+            full = full or (max_bytes is not None and nbytes + other > max_bytes)
+            if not full:
+                current.append(k)
+                nbytes += other
+                continue
+            shards.append(current)
+        current = [k]
+        nbytes = first
+    if current:
+        shards.append(current)
+    return shards
+
+
+def _write_json(filename, data):
+    """Write data as JSON to a temporary file renamed over filename.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    tmpfd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.%s.' % os.path.basename(filename), suffix='.tmp')
+    try:
+        with os.fdopen(tmpfd, 'w') as fileobj:
+            json.dump(data, fileobj, indent=1)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+@instrument.timed
+def _write_shard(incats, filename, checksum=False, index=False):
+    """Combine catalogs into one shard, in stream mode; return its size.
+
+    The shard is written under a temporary name and renamed when complete,
+    so a shard file which exists is always whole.
+    """
+    tmpname = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                           '.%s.%d.tmp' % (os.path.basename(filename), os.getpid()))
+    try:
+        extents = [(incat, _catalog_extents(incat, CATALOG_HDUS)) for incat in incats]
+        _combine_cats_stream(extents, tmpname, checksum)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    if index:
+        hduindex.write_index(filename)
+    return os.path.getsize(filename)
+
+
+def _combine_cats_sharded(incat_lst, outcat, max_bytes=None, max_hdus=None, manifest=None, checksum=False,
+                          nproc=1, index=False):
+    """Combine catalogs into shards capped by max_bytes and/or max_hdus.
+
+    The catalogs are split in order by plan_shards, from their headers
+    alone, and the shards are written concurrently by nproc worker
+    processes.  The manifest (a JSON file, by default manifest_name(outcat))
+    lists every shard with its file name, catalogs, HDU count, size and
+    status.  It is written before any shard, with every status 'pending',
+    and updated as each shard is finished ('done'), so downstream jobs can
+    start on finished shards early.  Returns the manifest.
+    """
+    if manifest is None:
+        manifest = manifest_name(outcat)
+    if nproc is None or nproc <= 1:
+        sizes = [_catalog_output_size(incat, checksum) for incat in incat_lst]
+    else:
+        chunksize = max(1, len(incat_lst) // (nproc * 8))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+            sizes = list(pool.map(_catalog_output_size, incat_lst, [checksum] * len(incat_lst),
+                                  chunksize=chunksize))
+
+    shards = []
+    for k, positions in enumerate(plan_shards(sizes, max_bytes, max_hdus)):
+        nbytes = sizes[positions[0]][0] + sum([sizes[p][1] for p in positions[1:]])
+        shards.append({'filename': shard_name(outcat, k), 'incats': [incat_lst[p] for p in positions],
+                       'nhdus': CATALOG_HDUS * len(positions), 'bytes': nbytes, 'status': 'pending'})
+    content = {'outcat': outcat, 'max_bytes': max_bytes, 'max_hdus': max_hdus, 'shards': shards}
+    _write_json(manifest, content)
+    if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+        miscutils.fwdebug_print("Combining %d catalogs into %d shards, manifest %s" % (
+            len(incat_lst), len(shards), manifest))
+
+    if nproc is None or nproc <= 1 or len(shards) <= 1:
+        for shard in shards:
+            shard['bytes'] = _write_shard(shard['incats'], shard['filename'], checksum, index)
+            shard['status'] = 'done'
+            _write_json(manifest, content)
+        return content
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        futures = dict([(pool.submit(_write_shard, shard['incats'], shard['filename'], checksum, index), shard)
+                        for shard in shards])
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                shard = futures[future]
+                shard['bytes'] = future.result()
+                shard['status'] = 'done'
+                _write_json(manifest, content)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return content
+
+
+_SCAMP_HISTORY_RE = re.compile(rb"^HISTORY   Astrometric solution by SCAMP", re.M)
+_SCAMP_END_RE = re.compile(rb"^END", re.M)
+
+
+def _scamp_head_bounds(data, head_lst=None):
+    """Return (start, end) byte offsets of each solution in SCAMP head data.
+
+    A solution runs from its "HISTORY   Astrometric solution by SCAMP" line
+    to the next one (or the end of the data), and must contain exactly one
+    END line.  head_lst, if given, names the files the solutions go to and is
+    only used for error messages.
+    """
+    starts = [m.start() for m in _SCAMP_HISTORY_RE.finditer(data)]
+    ends = [m.start() for m in _SCAMP_END_RE.finditer(data)]
+    if len(data) and (not starts or starts[0] != 0):
+        raise ValueError("SCAMP head file does not start with an Astrometric solution HISTORY line")
+
+    for headcount in range(1, len(starts)):
+        endcount = bisect.bisect_left(ends, starts[headcount])
+        if endcount != headcount:
+            if head_lst is not None:
+                miscutils.fwdebug_print("Error: problem when writing %s" % head_lst[headcount - 1])
+            raise ValueError(
+                "Number of END lines (%d) does not match number of HISTORY lines (%d)" % (endcount, headcount))
+
+    endcount = len(ends)
+    headcount = len(starts)
+    if endcount != headcount:
+        if head_lst is not None and headcount > 0:
+            miscutils.fwdebug_print("Error: problem when writing %s" % head_lst[headcount - 1])
+        raise ValueError("Number of END lines (%d) does not match number of HISTORY lines (%d)" %
+                         (endcount, headcount))
+
+    return list(zip(starts, starts[1:] + [len(data)]))
+
+
+def _map_file(fileobj):
+    """Return a read-only mmap of an open file, or b'' if it is empty.
+    """
+    if os.fstat(fileobj.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@instrument.timed
+def get_scamp_head_segments(head_out, as_headers=False):
+    """Return the individual solutions of a SCAMP output head file.
+
+    Same as splitScampHead, but the solutions are returned as a list of
+    bytes (or of fits.Header if as_headers is True) instead of being
+    written to files.
+    """
+    instrument.count('file_opens')
+    with open(head_out, 'rb') as headfh:
+        data = _map_file(headfh)
+        instrument.count('bytes_read', len(data))
+        try:
+            segments = [data[start:end] for start, end in _scamp_head_bounds(data)]
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    if as_headers:
+        segments = [fits.Header.fromstring(seg.decode('ascii'), sep='\n') for seg in segments]
+        instrument.count('header_parses', len(segments))
+    return segments
+
+
+@instrument.timed
 def splitScampHead(head_out, heads):
     """Split single SCAMP output head file into individual files
 
       head_out:  SCAMP output
       head_lst:  list of filenames to use for individual files
       reqheadcount: expected number of individual head files
+
+    The SCAMP output is memory-mapped, the solution boundaries are found
+    with a scan of the raw bytes and each individual file is written with
+    a single write call.
     """
     comma_re = re.compile(r"\s*,\s*")
     head_lst = comma_re.split(heads)
     reqheadcount = len(head_lst)
-    headcount = 0
-    endcount = 0
-    linecount = 0
-    linecount_tot = 0
-    filehead = None
-    for line in open(head_out, 'r'):
-        if re.match(r"^HISTORY   Astrometric solution by SCAMP.*", line):
-            if filehead != None:
-                filehead.close()
-                if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
-                    miscutils.fwdebug_print("Closing .head file after writing %d lines." % linecount)
-                if endcount != headcount:
-                    miscutils.fwdebug_print("Error: problem when writing %s" % head_lst[headcount])
-                    raise ValueError(
-                        "Number of END lines (%d) does not match number of HISTORY lines (%d)" % (endcount, headcount))
-            if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
-                miscutils.fwdebug_print("Opening .head file %d --> %s" % (headcount, head_lst[headcount]))
-            filehead = open(head_lst[headcount], 'w')
-            headcount += 1
-            linecount = 0
-        elif re.match(r"^END\s*", line):
-            endcount += 1
-        filehead.write(line)
-        linecount += 1
-        linecount_tot += 1
-    filehead.close()
 
-    if endcount != headcount:
-        miscutils.fwdebug_print("Error: problem when writing %s" % head_lst[headcount])
-        raise ValueError("Number of END lines (%d) does not match number of HISTORY lines (%d)" %
-                         (endcount, headcount))
+    instrument.count('file_opens')
+    with open(head_out, 'rb') as headfh:
+        data = _map_file(headfh)
+        instrument.count('bytes_read', len(data))
+        try:
+            bounds = _scamp_head_bounds(data, head_lst)
+            headcount = len(bounds)
+            if headcount != reqheadcount:
+                raise ValueError("Number of head files made (%d) does not match required number of head files (%d)" % (
+                    headcount, reqheadcount))
 
+            view = memoryview(data)
+            try:
+                for k, (start, end) in enumerate(bounds):
+                    if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+                        miscutils.fwdebug_print("Opening .head file %d --> %s" % (k, head_lst[k]))
+                    with open(head_lst[k], 'wb') as filehead:
+                        filehead.write(view[start:end])
+                    instrument.count('bytes_written', end - start)
+                    if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+                        miscutils.fwdebug_print("Closing .head file after writing %d bytes." % (end - start))
+            finally:
+                view.release()
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+@instrument.timed
+def apply_scamp_head(headfile, mef, hdus=None):
+    """Merge the solutions of a SCAMP head file into the headers of a MEF.
+
+    Solution k goes to the k-th image HDU of the MEF (or to HDU hdus[k] if
+    a list of HDU indexes is given).  Cards of the solution replace those
+    of the same keyword, others are added.  The headers are rewritten in
+    place when they fit in their existing blocks; otherwise the file is
+    rebuilt, copying data untouched, and renamed over the original.
+
+    Returns True if the MEF was updated in place.
+    """
+    segments = get_scamp_head_segments(headfile, as_headers=True)
+    infos = list(fits_blocks.iter_hdus(mef))
+    if hdus is None:
+        hdus = [info.index for info in infos if fits_blocks.is_image(info)]
+    if len(segments) != len(hdus):
+        raise ValueError("Number of SCAMP solutions (%d) does not match number of HDUs to update (%d) in %s" % (
+            len(segments), len(hdus), mef))
+
+    headers = {}
+    for seg, index in zip(segments, hdus):
+        header = fits_blocks.merge_cards(infos[index].header, list(seg.cards))
+        # the header changed: recompute a stored CHECKSUM from DATASUM
+        headers[index] = fits_blocks.refresh_checksum(header)
+
+    inplace = fits_blocks.rewrite_headers(mef, headers)
+    invalidate_header_cache(mef)
+    hduindex.refresh_index(mef)
     if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
-        miscutils.fwdebug_print("Closing .head file after writing %d lines.\n" % linecount)
+        miscutils.fwdebug_print("Applied %s to %s (%s)" % (headfile, mef, "in place" if inplace else "rewritten"))
+    return inplace
 
-    if headcount != reqheadcount:
-        raise ValueError("Number of head files made (%d) does not match required number of head files (%d)" % (
-            headcount, reqheadcount))
 
+def _apply_scamp_head_args(args):
+    return apply_scamp_head(*args)
+
+
+@instrument.timed
+def apply_scamp_heads(pairs, nproc=1):
+    """Apply many (headfile, mef) pairs with apply_scamp_head.
+
+    The pairs are spread over a pool of nproc worker processes.  Returns
+    the apply_scamp_head results in the order of pairs.
+    """
+    pairs = list(pairs)
+    if nproc <= 1 or len(pairs) <= 1:
+        return [apply_scamp_head(head, mef) for head, mef in pairs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        return list(pool.map(_apply_scamp_head_args, pairs))
+
+
+# A header edit sets a keyword (adding it if missing), updates a keyword
+# already in the header or deletes it
+EDIT_ACTIONS = ('set', 'update', 'delete')
+
+HeaderEdit = collections.namedtuple('HeaderEdit', ['whichhdu', 'action', 'keyword', 'value', 'comment'],
+                                    defaults=(None, None))
+HeaderEdit.__doc__ = """One keyword edit of edit_header.
+
+    whichhdu:  HDU index or EXTNAME, as for get_hdr (None for the Primary HDU)
+    action:    one of EDIT_ACTIONS
+    keyword:   the keyword; commentary keywords (HISTORY, COMMENT) can only be set
+    value:     the new value (set, update)
+    comment:   the new comment; None keeps the comment of an existing card
+"""
+
+
+def _select_hdu(infos, whichhdu, filename):
+    """Return the index of the HDU selected as find_hdu does, from a list of HDUInfo.
+    """
+    whichhdu = _normalize_hdu(whichhdu)
+    if isinstance(whichhdu, int):
+        if not -len(infos) <= whichhdu < len(infos):
+            raise IndexError("HDU %d not found in %s" % (whichhdu, filename))
+        return infos[whichhdu].index
+    for info in infos:
+        if info.name == whichhdu or (info.index == 0 and whichhdu == 'PRIMARY'):
+            return info.index
+    raise KeyError("Extension '%s' not found in %s" % (whichhdu, filename))
+
+
+def _edit_card(header, edit, errors='raise'):
+    """Return a raw header with one HeaderEdit applied.
+    """
+    keyword = edit.keyword.upper()
+    if edit.action not in EDIT_ACTIONS:
+        raise ValueError("Invalid header edit action: %s" % edit.action)
+    if fits_blocks.STRUCTURAL_RE.match(keyword) or keyword in ('CHECKSUM', 'DATASUM'):
+        raise ValueError("Cannot edit keyword %s: it describes the HDU structure or checksum" % keyword)
+    if len(keyword) > 8:
+        raise ValueError("Cannot edit HIERARCH keyword %s" % keyword)
+
+    commentary = keyword in fits_blocks.COMMENTARY_KEYWORDS
+    if commentary and edit.action != 'set':
+        raise ValueError("Commentary keyword %s can only be set" % keyword)
+    offsets = fits_blocks.card_offsets(header)
+    if edit.action != 'set' and keyword not in offsets:
+        if errors == 'ignore':
+            return header
+        raise KeyError("Keyword '%s' not found" % keyword)
+
+    if edit.action == 'delete':
+        return fits_blocks.delete_card(header, keyword)
+    comment = edit.comment
+    if comment is None and keyword in offsets and not commentary:
+        comment = fits_blocks._card_at(header, offsets[keyword]).comment
+    return fits_blocks.merge_cards(header, [fits.Card(keyword, edit.value, comment)])
+
+
+@instrument.timed
+def edit_header(filename, edits, errors='raise', fallback='rewrite'):
+    """Set, update or delete header keywords of a fits file in place.
+
+    edits is a list of HeaderEdit (or tuples of their fields), applied in
+    order and possibly to several HDUs.  Headers are rewritten in the
+    free space of their last block when the new cards fit, and data are
+    never read.  When a header needs more blocks, fallback chooses how
+    the file grows (see fits_blocks.rewrite_headers): 'rewrite' copies it
+    to a new file renamed over the original, 'shift' moves in place only
+    the HDUs from that header onward.  A stored CHECKSUM is recomputed
+    from DATASUM.  Updating or deleting a missing keyword raises KeyError,
+    unless errors is 'ignore'.
+
+    Returns True if the headers were written in place.
+    """
+    if errors not in ('raise', 'ignore'):
+        raise ValueError("Invalid value for errors: %s" % errors)
+    infos = list(fits_blocks.iter_hdus(filename))
+    headers = {}
+    for edit in edits:
+        edit = HeaderEdit(*edit)
+        index = _select_hdu(infos, edit.whichhdu, filename)
+        try:
+            headers[index] = _edit_card(headers.get(index, infos[index].header), edit, errors)
+        except KeyError as err:
+            raise KeyError("%s in HDU %d of %s" % (err.args[0], index, filename))
+
+    headers = dict([(index, fits_blocks.refresh_checksum(header)) for index, header in headers.items()
+                    if header != infos[index].header])
+    if not headers:
+        return True
+    inplace = fits_blocks.rewrite_headers(filename, headers, fallback)
+    invalidate_header_cache(filename)
+    hduindex.refresh_index(filename)
+    if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+        miscutils.fwdebug_print("Edited %d headers of %s (%s)" % (len(headers), filename,
+                                                                  "in place" if inplace else fallback))
+    return inplace
+
+
+def set_hdr_values(filename, values, whichhdu=None, fallback='rewrite'):
+    """Set several keywords of one HDU of a file, with edit_header.
+
+    values is a dict key --> value or (value, comment), as astropy's
+    Header takes them.
+    """
+    edits = []
+    for key, value in values.items():
+        comment = None
+        if isinstance(value, tuple):
+            value, comment = value
+        edits.append(HeaderEdit(whichhdu, 'set', key, value, comment))
+    return edit_header(filename, edits, fallback=fallback)
+
+
+def delete_hdr_keys(filename, keys, whichhdu=None, errors='raise', fallback='rewrite'):
+    """Delete several keywords of one HDU of a file, with edit_header.
+    """
+    return edit_header(filename, [HeaderEdit(whichhdu, 'delete', key) for key in keys],
+                       errors=errors, fallback=fallback)
+
+
+def _edit_header_args(args):
+    return edit_header(*args)
+
+
+@instrument.timed
+def edit_headers(jobs, nproc=1, errors='raise', fallback='rewrite'):
+    """Apply edit_header to many files.
+
+    jobs is a list of (filename, edits); the edits of a file named more
+    than once are applied together, in order.  The files are spread over
+    a pool of nproc worker processes.  Returns dict filename --> the
+    edit_header result.
+    """
+    grouped = collections.OrderedDict()
+    for filename, edits in jobs:
+        grouped.setdefault(filename, []).extend(edits)
+    args = [(filename, edits, errors, fallback) for filename, edits in grouped.items()]
+    if nproc <= 1 or len(args) <= 1:
+        results = [edit_header(*arg) for arg in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+            results = list(pool.map(_edit_header_args, args))
+    return dict(zip(grouped, results))
 
-def get_hdr(hdulist, whichhdu):
 
+def is_filename(hdulist):
+    """Return True if hdulist is a file name rather than an open HDUList.
+    """
+    return isinstance(hdulist, (str, bytes, os.PathLike))
+
+
+def _normalize_hdu(whichhdu):
+    """Return an HDU selector as an int index or upper case name.
+    """
     if whichhdu is None:
         whichhdu = 'Primary'
 
@@ -205,6 +1466,21 @@ def get_hdr(hdulist, whichhdu):
         whichhdu = int(whichhdu)  # if number, convert type
     except ValueError:
         whichhdu = whichhdu.upper()
+    return whichhdu
+
+
+@instrument.timed
+def get_hdr(hdulist, whichhdu):
+    """Return the header of the given HDU.
+
+    hdulist may be an open HDUList or a file name.  Given a file name the
+    header is read straight from the fits blocks, without building an
+    HDUList or reading any data.
+    """
+    whichhdu = _normalize_hdu(whichhdu)
+
+    if is_filename(hdulist):
+        return _get_hdr_from_file(hdulist, whichhdu)
 
     hdr = None
     if whichhdu == 'LDAC_IMHEAD':
@@ -219,15 +1495,218 @@ def get_hdr(hdulist, whichhdu):
     return hdr
 
 
-def get_hdr_value(hdulist, key, whichhdu=None):
-    ukey = key.upper()
+class _CachedHeader(object):
+    """The raw HDUInfo of a cached header, and its astropy Header once parsed.
+    """
+
+    __slots__ = ('info', 'header')
+
+    def __init__(self, info):
+        self.info = info
+        self.header = None
+
+
+class HeaderCache(object):
+    """A process-wide LRU cache of headers read from files.
+
+    Entries are keyed by (realpath, st_mtime_ns, st_size, hdu selector), so
+    a file modified since its header was cached is read again.  Each entry
+    holds the raw header and, once get_header has been called for it, the
+    parsed astropy Header, so repeated get_hdr calls do not parse the
+    header again.  The cache is bounded both by number of entries and by
+    total raw header bytes.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(filename):
+        realpath = os.path.realpath(filename)
+        st = os.stat(realpath)
+        return (realpath, st.st_mtime_ns, st.st_size)
+
+    def _entry(self, filename, whichhdu):
+        """Return (realpath, _CachedHeader) for an HDU of filename, reading it on a miss.
+        """
+        key = self._stat_key(filename) + (whichhdu,)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return key[0], entry
+            self.misses += 1
+
+        entry = _CachedHeader(hduindex.find_hdu(key[0], whichhdu))
+
+        # Do not keep a header if the file changed while it was being read.
+        if self._stat_key(filename) + (whichhdu,) != key:
+            return key[0], entry
+
+        size = len(entry.info.header)
+        if size > self.max_bytes:
+            return key[0], entry
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.nbytes += size
+            entry = self._entries[key]
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= len(old.info.header)
+                self.evictions += 1
+        return key[0], entry
+
+    def get(self, filename, whichhdu):
+        """Return the HDUInfo for an HDU of filename, reading it on a miss.
+        """
+        return self._entry(filename, whichhdu)[1].info
+
+    def get_header(self, filename, whichhdu):
+        """Return a copy of the astropy Header of an HDU of filename.
+
+        The header is parsed the first time it is asked for and kept with
+        the raw bytes; the caller may change the copy it gets.
+        """
+        realpath, entry = self._entry(filename, whichhdu)
+        hdr = entry.header
+        if hdr is None:
+            hdr = entry.header = fits_blocks.header_from_info(realpath, entry.info)
+        return hdr.copy()
+
+    def invalidate(self, filename=None):
+        """Drop the cached headers of filename, or of every file.
+        """
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+                self.nbytes = 0
+                return
+            realpath = os.path.realpath(filename)
+            for key in [k for k in self._entries if k[0] == realpath]:
+                self.nbytes -= len(self._entries.pop(key).info.header)
+
+    def stats(self):
+        """Return dict of cache counters.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.nbytes}
+
+
+_HDR_CACHE = None
+
+
+def enable_header_cache(max_entries=1024, max_bytes=64 * 1024 * 1024):
+    """Turn on caching of headers read from files by get_hdr and friends.
+
+    Any previously cached headers are dropped.
+    """
+    global _HDR_CACHE
+    _HDR_CACHE = HeaderCache(max_entries, max_bytes)
+    return _HDR_CACHE
+
+
+def disable_header_cache():
+    """Turn off (and empty) the header cache.
+    """
+    global _HDR_CACHE
+    _HDR_CACHE = None
+
+
+def invalidate_header_cache(filename=None):
+    """Drop cached headers of filename, or of every file if None.
+    """
+    if _HDR_CACHE is not None:
+        _HDR_CACHE.invalidate(filename)
+
+
+def header_cache_stats():
+    """Return the header cache counters, or None if the cache is disabled.
+    """
+    if _HDR_CACHE is None:
+        return None
+    return _HDR_CACHE.stats()
+
+
+def _find_hdu(filename, whichhdu):
+    """Return the HDUInfo of an HDU, through the header cache when enabled.
+
+    With sidecars enabled (see hduindex.enable_sidecars), a file with a
+    current HDU index sidecar has its HDU read directly, without scanning
+    the headers before it.
+    """
+    cache = _HDR_CACHE
+    if cache is None:
+        return hduindex.find_hdu(filename, whichhdu)
+    return cache.get(filename, whichhdu)
+
+
+def _get_hdr_from_file(filename, whichhdu):
+    """Return the header of the given HDU of a file.
+
+    Files the block scanner cannot read (e.g. gzipped) and LDAC_IMHEAD,
+    which lives in the data, go through astropy.
+    """
+    if whichhdu != 'LDAC_IMHEAD':
+        cache = _HDR_CACHE
+        try:
+            if cache is not None:
+                return cache.get_header(filename, whichhdu)
+            return fits_blocks.header_from_info(filename, hduindex.find_hdu(filename, whichhdu))
+        except ValueError:
+            if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+                miscutils.fwdebug_print("Cannot scan %s, reading header with astropy" % filename)
+
+    instrument.count('file_opens')
+    instrument.count('header_parses')
+    with fits.open(filename, 'readonly') as hdulist:
+        return get_hdr(hdulist, whichhdu).copy()
+
+
+@instrument.timed
+def get_hdr_values(hdulist, keys, whichhdu=None, errors='raise'):
+    """Return dict upper case key --> value for several keys of one HDU.
+
+    Given a file name, only the requested cards are parsed from the raw
+    header blocks.  A missing key raises KeyError, unless errors is
+    'ignore' in which case it is left out of the returned dictionary.
+    """
+    if errors not in ('raise', 'ignore'):
+        raise ValueError("Invalid value for errors: %s" % errors)
+
+    ukeys = [key.upper() for key in keys]
+
+    if is_filename(hdulist) and str(whichhdu).upper() != 'LDAC_IMHEAD' and \
+            all([fits_blocks.is_simple_keyword(k) for k in ukeys]):
+        try:
+            return fits_blocks.values_from_info(_find_hdu(hdulist, _normalize_hdu(whichhdu)), ukeys, errors)
+        except ValueError:
+            if miscutils.fwdebug_check(3, 'FITSUTILS_DEBUG'):
+                miscutils.fwdebug_print("Cannot scan %s, reading header with astropy" % hdulist)
 
     hdr = get_hdr(hdulist, whichhdu)
-    val = hdr[ukey]
+    if errors == 'ignore':
+        return dict([(ukey, hdr[ukey]) for ukey in ukeys if ukey in hdr])
+    return dict([(ukey, hdr[ukey]) for ukey in ukeys])
 
-    return val
 
+@instrument.timed
+def get_hdr_value(hdulist, key, whichhdu=None):
+    ukey = key.upper()
+
+    return get_hdr_values(hdulist, [ukey], whichhdu)[ukey]
 
+
+@instrument.timed
 def get_hdr_extra(hdulist, key, whichhdu=None):
     ukey = key.upper()
 
@@ -238,14 +1717,55 @@ def get_hdr_extra(hdulist, key, whichhdu=None):
     return hcomment, htype
 
 
+@instrument.timed
+def read_hdu(filename, whichhdu=None):
+    """Return one HDU of a file as an astropy HDU, header and data.
+
+    Only the bytes of that HDU are read: it is found as get_hdr finds it
+    (with a single seek when sidecars are enabled and the file has an HDU
+    index sidecar, so the cost does not depend on the number of HDUs
+    before it) and decoded on its own.  Tile-compressed HDUs come back as
+    CompImageHDU.
+    """
+    info = _find_hdu(filename, _normalize_hdu(whichhdu))
+    instrument.count('file_opens')
+    with open(filename, 'rb') as fileobj:
+        fileobj.seek(info.data_offset)
+        data = fileobj.read(fits_blocks.padded_size(info.data_size))
+    instrument.count('bytes_read', len(data))
+    if len(data) < info.data_size:
+        raise ValueError("HDU %d of %s is truncated" % (info.index, filename))
+    if info.index == 0:
+        return fits.HDUList.fromstring(info.header + data)[0]
+    # an extension is only valid after a Primary HDU
+    primary = fits_blocks.build_header([fits_blocks.make_card('SIMPLE', True),
+                                        fits_blocks.make_card('BITPIX', 8),
+                                        fits_blocks.make_card('NAXIS', 0),
+                                        fits_blocks.make_card('EXTEND', True)])
+    return fits.HDUList.fromstring(primary + info.header + data)[1]
+
+
+# LDAC_IMHEAD headers already decoded, keyed by their HDU
+_LDAC_HDRS = weakref.WeakKeyDictionary()
+
+
 def get_ldac_imhead_as_cardlist(imhead):
-    data = imhead.data
-    cards = []
-    for cd in data[0][0]:
-        cards.append(fits.Card.fromstring(cd))
-    return cards
+    return list(get_ldac_imhead_as_hdr(imhead).cards)
 
 
 def get_ldac_imhead_as_hdr(imhead):
-    hdr = fits.Header(get_ldac_imhead_as_cardlist(imhead))
-    return hdr
+    """Return the image header stored in the data of an LDAC_IMHEAD HDU.
+
+    All the 80-char records are parsed in a single pass, and the result is
+    memoized against the HDU, so repeated lookups on the same open catalog
+    do not decode the header again.  Each call returns a copy, which the
+    caller may change.
+    """
+    hdr = _LDAC_HDRS.get(imhead)
+    if hdr is None:
+        # records lose their trailing blanks when read, so separate them
+        # with newlines rather than relying on the 80-char card width
+        hdr = fits.Header.fromstring('\n'.join(imhead.data[0][0]), sep='\n')
+        instrument.count('header_parses')
+        _LDAC_HDRS[imhead] = hdr
+    return hdr.copy()
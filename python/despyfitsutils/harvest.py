@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""Harvest header keywords from many fits files into a table.
+"""
+
+import concurrent.futures
+import csv
+import functools
+import glob
+import math
+import os
+
+import despyfitsutils._lazy as _lazy
+import despyfitsutils.fitsutils as fitsutils
+import despyfitsutils.fits_special_metadata as fits_special_metadata
+
+# Heavy dependencies, imported on first use
+np = _lazy.LazyModule('numpy')
+fits = _lazy.LazyModule('astropy.io.fits')
+
+
+def expand_files(patterns):
+    """Return the list of files named by a list of file names or globs.
+
+    Items containing glob characters are expanded (recursively for '**')
+    and sorted; plain names are kept as they are, in order.
+    """
+    files = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            files.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            files.append(pattern)
+    return files
+
+
+def harvest_file(filename, keys, whichhdu=None, special=None):
+    """Return (values, error) for one file.
+
+    values is a dict with the header keys (upper case) and special
+    metadata keys (lower case) that could be read, error an empty string
+    or a message naming what is missing or went wrong.
+    """
+    values = {}
+    try:
+        if keys:
+            values.update(fitsutils.get_hdr_values(filename, keys, whichhdu, errors='ignore'))
+        if special:
+            values.update(fits_special_metadata.get_special_metadata(filename, special, whichhdu=whichhdu,
+                                                                     errors='ignore'))
+    except Exception as err:
+        return values, "%s: %s" % (type(err).__name__, err)
+
+    missing = [k.upper() for k in keys or [] if k.upper() not in values]
+    missing += [k.lower() for k in special or [] if k.lower() not in values]
+    if missing:
+        return values, "missing %s" % ', '.join(missing)
+    return values, ''
+
+
+def _column(values):
+    """Return a numpy array for one column of harvested values (None if missing).
+
+    Integer columns with missing values become float with NaN; anything that
+    is not numeric becomes a string column with '' for missing values.
+    """
+    present = [v for v in values if v is not None]
+    if present and all([isinstance(v, bool) for v in present]) and len(present) == len(values):
+        return np.array(values, dtype=bool)
+    if present and all([isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in present]) \
+            and len(present) == len(values):
+        return np.array(values, dtype=np.int64)
+    if present and all([isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool)
+                        for v in present]):
+        return np.array([math.nan if v is None else v for v in values], dtype=np.float64)
+    strings = ['' if v is None else str(v) for v in values]
+    return np.array(strings, dtype='U%d' % max([1] + [len(s) for s in strings]))
+
+
+def harvest_files(files, keys, whichhdu=None, special=None, nproc=1, chunksize=None):
+    """Return the list of harvest_file() results for a list of files.
+
+    The files are spread over nproc worker processes, chunksize files at
+    a time (by default about 8 chunks per worker); results are in the
+    order of files.
+    """
+    func = functools.partial(harvest_file, keys=keys, whichhdu=whichhdu, special=special)
+    if nproc is None or nproc <= 1 or len(files) <= 1:
+        return [func(f) for f in files]
+
+    if chunksize is None:
+        chunksize = max(1, len(files) // (nproc * 8))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        return list(pool.map(func, files, chunksize=chunksize))
+
+
+def harvest_headers(files, keys, whichhdu=None, special=None, nproc=1, chunksize=None):
+    """Read header keywords from many files into a NumPy structured array.
+
+    Parameters
+    ----------
+    files : list of str
+        File names and/or glob patterns.
+    keys : list of str or None
+        Header keywords to read.
+    whichhdu : int or str, optional
+        HDU to read them from, defaults to the Primary HDU.
+    special : list of str, optional
+        fits_special_metadata keys to compute as well (band, nite, ...).
+    nproc : int, optional
+        Number of worker processes.
+    chunksize : int, optional
+        Number of files handed to a worker at a time; by default the files
+        are split in about 8 chunks per worker.
+
+    Returns
+    -------
+    numpy.ndarray
+        One row per file with a FILENAME column, one column per keyword
+        (upper case) and special key (lower case), and an ERROR column
+        which is empty unless something could not be read for that file.
+    """
+    files = expand_files(files)
+    keys = [k.upper() for k in keys or []]
+    special = [k.lower() for k in special or []]
+    results = harvest_files(files, keys, whichhdu, special, nproc, chunksize)
+
+    columns = [('FILENAME', _column(files))]
+    for key in keys + special:
+        columns.append((key, _column([vals.get(key) for vals, _ in results])))
+    columns.append(('ERROR', _column([err for _, err in results])))
+
+    table = np.zeros(len(files), dtype=[(name, col.dtype) for name, col in columns])
+    for name, col in columns:
+        table[name] = col
+    return table
+
+
+def write_table(table, filename, fmt=None, clobber=False):
+    """Write a harvested table as a fits binary table or CSV file.
+
+    fmt is 'fits' or 'csv', by default guessed from the file name.
+    """
+    if fmt is None:
+        fmt = 'csv' if filename.lower().endswith('.csv') else 'fits'
+    if fmt == 'fits':
+        fits.BinTableHDU(data=table).writeto(filename, overwrite=clobber)
+    elif fmt == 'csv':
+        if os.path.exists(filename) and not clobber:
+            raise OSError("File %s already exists" % filename)
+        with open(filename, 'w', newline='') as csvfh:
+            writer = csv.writer(csvfh)
+            writer.writerow(table.dtype.names)
+            for row in table:
+                writer.writerow(row.tolist())
+    else:
+        raise ValueError("Unknown table format: %s" % fmt)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""Persistent SQLite index of header keywords for trees of fits files.
+"""
+
+import fnmatch
+import os
+import sqlite3
+
+import despyfitsutils.harvest as harvest
+import despyfitsutils.fits_special_metadata as fits_special_metadata
+
+
+# Special metadata values indexed unless asked otherwise.
+DEFAULT_SPECIAL = ('band', 'nite', 'radeg', 'decdeg', 'camsym', 'field', 'objects')
+
+# Columns every index has, in front of the keyword columns.
+FILE_COLUMNS = ('path', 'mtime_ns', 'size', 'error')
+
+
+def _quote(name):
+    """Return name quoted as an SQL identifier (keywords may contain '-').
+    """
+    return '"%s"' % name.replace('"', '""')
+
+
+def _sql_value(value):
+    """Return value as something sqlite3 can store.
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def iter_fits_files(roots, pattern='*.fits*'):
+    """Yield the absolute names of the files under roots matching pattern.
+
+    roots may contain file names as well as directories; directories are
+    walked recursively.
+    """
+    for root in roots:
+        if not os.path.isdir(root):
+            yield os.path.abspath(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for fname in sorted(fnmatch.filter(filenames, pattern)):
+                yield os.path.abspath(os.path.join(dirpath, fname))
+
+
+class HeaderIndex(object):
+    """SQLite database of header keywords and special metadata of fits files.
+
+    One row is kept per file with its path, st_mtime_ns and st_size, one
+    column per header keyword (upper case) and special metadata key
+    (lower case) and an error column for what could not be read.  update()
+    only re-reads the files whose mtime or size changed since they were
+    indexed.
+
+    Parameters
+    ----------
+    dbname : str
+        Name of the SQLite database, created if needed.
+    keys : list of str, optional
+        Header keywords to index.
+    special : list of str, optional
+        fits_special_metadata keys to index, defaults to DEFAULT_SPECIAL
+        for a new database.
+    whichhdu : int or str, optional
+        HDU to read the keywords from.  It is fixed when the database is
+        created (by default the Primary HDU) and must match afterwards.
+
+    Keywords and special keys already in an existing database are kept;
+    new ones are added as columns and every file is re-read on the next
+    update().
+    """
+
+    def __init__(self, dbname, keys=None, special=None, whichhdu=None):
+        self.dbname = dbname
+        self.conn = sqlite3.connect(dbname)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS index_columns (name TEXT PRIMARY KEY, kind TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS index_config (name TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, "
+                              "size INTEGER, error TEXT)")
+        self._check_hdu(whichhdu)
+
+        if special is None:
+            # Only a new index gets the default special keys
+            nexisting = self.conn.execute("SELECT COUNT(*) FROM index_columns").fetchone()[0]
+            special = [] if nexisting else DEFAULT_SPECIAL
+        wanted = [(k.upper(), 'key') for k in keys or []]
+        for k in special:
+            if k.lower() not in fits_special_metadata.SPECIAL_KEYS:
+                raise KeyError("Unknown special metadata key: %s" % k)
+            wanted.append((k.lower(), 'special'))
+        self._add_columns(wanted)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the database.
+        """
+        self.conn.close()
+
+    def _check_hdu(self, whichhdu):
+        """Store whichhdu, or check it matches the one the index was built with.
+        """
+        row = self.conn.execute("SELECT value FROM index_config WHERE name = 'whichhdu'").fetchone()
+        if row is None:
+            value = '' if whichhdu is None else str(whichhdu)
+            with self.conn:
+                self.conn.execute("INSERT INTO index_config VALUES ('whichhdu', ?)", (value,))
+        else:
+            value = row[0]
+            if whichhdu is not None and str(whichhdu) != value:
+                raise ValueError("Index %s was built from HDU '%s', not '%s'" % (self.dbname, value, whichhdu))
+
+        self.whichhdu = None
+        if value:
+            self.whichhdu = int(value) if value.lstrip('-').isdigit() else value
+
+    def _add_columns(self, wanted):
+        """Add the (name, kind) columns not yet in the index.
+        """
+        existing = dict([(r['name'], r['kind']) for r in self.conn.execute("SELECT * FROM index_columns")])
+        folded = dict([(name.lower(), name) for name in list(existing) + list(FILE_COLUMNS)])
+        added = []
+        for name, kind in wanted:
+            if name in existing:
+                continue
+            # SQLite column names are case insensitive
+            if name.lower() in folded:
+                raise ValueError("Column %s clashes with column %s" % (name, folded[name.lower()]))
+            folded[name.lower()] = name
+            added.append((name, kind))
+
+        if added:
+            with self.conn:
+                for name, kind in added:
+                    self.conn.execute("ALTER TABLE files ADD COLUMN %s" % _quote(name))
+                    self.conn.execute("INSERT INTO index_columns VALUES (?, ?)", (name, kind))
+                # Force the files already indexed to be read again
+                self.conn.execute("UPDATE files SET mtime_ns = -1")
+
+        rows = self.conn.execute("SELECT * FROM index_columns ORDER BY rowid").fetchall()
+        self.keys = [r['name'] for r in rows if r['kind'] == 'key']
+        self.special = [r['name'] for r in rows if r['kind'] == 'special']
+
+    @property
+    def columns(self):
+        """Names of all the columns of the files table.
+        """
+        return list(FILE_COLUMNS) + self.keys + self.special
+
+    def update(self, roots, pattern='*.fits*', nproc=1, chunksize=None, prune=True):
+        """Index the new and changed files under roots.
+
+        Parameters
+        ----------
+        roots : list of str
+            Directories (walked recursively) and/or file names.
+        pattern : str, optional
+            fnmatch pattern of the file names to index in directories.
+        nproc : int, optional
+            Number of worker processes reading headers.
+        chunksize : int, optional
+            Number of files handed to a worker at a time.
+        prune : bool, optional
+            Remove from the index the files under roots which no longer
+            exist.
+
+        Returns
+        -------
+        dict
+            Number of files 'added', 'updated', 'removed' and 'unchanged'.
+        """
+        if isinstance(roots, str):
+            roots = [roots]
+
+        known = dict([(r['path'], (r['mtime_ns'], r['size']))
+                      for r in self.conn.execute("SELECT path, mtime_ns, size FROM files")])
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        seen = set()
+        todo = []
+        for path in iter_fits_files(roots, pattern):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            seen.add(path)
+            if known.get(path) == (st.st_mtime_ns, st.st_size):
+                counts['unchanged'] += 1
+            else:
+                counts['updated' if path in known else 'added'] += 1
+                todo.append((path, st))
+
+        results = harvest.harvest_files([path for path, _ in todo], self.keys, self.whichhdu,
+                                        self.special, nproc, chunksize)
+
+        names = self.columns
+        sql = "INSERT OR REPLACE INTO files (%s) VALUES (%s)" % (', '.join([_quote(n) for n in names]),
+                                                                ', '.join(['?'] * len(names)))
+        with self.conn:
+            rows = []
+            for (path, st), (values, error) in zip(todo, results):
+                row = [path, st.st_mtime_ns, st.st_size, error or None]
+                row.extend([_sql_value(values.get(k)) for k in self.keys + self.special])
+                rows.append(row)
+            self.conn.executemany(sql, rows)
+
+            if prune:
+                dirs = [os.path.join(os.path.abspath(r), '') for r in roots if os.path.isdir(r)]
+                files = set([os.path.abspath(r) for r in roots if not os.path.isdir(r)])
+                gone = [path for path in known if path not in seen and
+                        (path in files or any([path.startswith(d) for d in dirs]))]
+                self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in gone])
+                counts['removed'] = len(gone)
+        return counts
+
+    def query(self, where=None, params=(), columns=None, order_by='path'):
+        """Return the rows of the index matching an SQL condition.
+
+        Parameters
+        ----------
+        where : str, optional
+            SQL condition, e.g. "NAXIS2 > ?" (keywords with a '-' must be
+            double quoted: '"DATE-OBS" > ?').
+        params : sequence, optional
+            Values for the ? placeholders in where.
+        columns : list of str, optional
+            Columns to return, all of them by default.
+        order_by : str, optional
+            Column to sort the rows by.
+
+        Returns
+        -------
+        list of dict
+            One dictionary per file mapping column names to values.
+        """
+        if columns is None:
+            columns = self.columns
+        for col in list(columns) + ([order_by] if order_by else []):
+            if col not in self.columns:
+                raise KeyError("Column %s is not in index %s" % (col, self.dbname))
+
+        sql = "SELECT %s FROM files" % ', '.join([_quote(c) for c in columns])
+        if where:
+            sql += " WHERE %s" % where
+        if order_by:
+            sql += " ORDER BY %s" % _quote(order_by)
+        return [dict(zip(columns, row)) for row in self.conn.execute(sql, tuple(params))]
+
+    def find(self, **criteria):
+        """Return the paths of the files whose columns equal the given values.
+
+        For instance find(band='r', nite='20240101').
+        """
+        names = sorted(criteria)
+        where = ' AND '.join(["%s = ?" % _quote(n) for n in names])
+        rows = self.query(where, [criteria[n] for n in names], columns=['path'])
+        return [row['path'] for row in rows]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
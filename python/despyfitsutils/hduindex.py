@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""Byte offset index of the HDUs of a fits file.
+
+The index lists, for every HDU, its number, EXTNAME, header offset, data
+offset and data size, found in one pass over the headers.  It can be
+kept in memory or saved in a small sidecar file (<file>.hduindex, JSON)
+next to the fits file, so that the header or data of any HDU, selected
+by number or EXTNAME, is read with a single seek however many HDUs the
+file has.  An index records the st_mtime_ns and st_size of its file and
+is ignored once the file has changed.
+
+The header readers of fitsutils only look for sidecars once
+enable_sidecars() is called (or DESPYFITSUTILS_HDUINDEX=1 is set), so
+that files without one cost no extra file system calls by default.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import threading
+
+import despyfitsutils.fits_blocks as fits_blocks
+import despyfitsutils.instrument as instrument
+
+INDEX_SUFFIX = '.hduindex'
+INDEX_VERSION = 1
+
+# Indexes loaded from sidecar files kept in memory, most recent last
+MAX_CACHED = 256
+
+# Environment variable turning on the use of sidecars by find_hdu
+SIDECAR_ENV = 'DESPYFITSUTILS_HDUINDEX'
+
+HDUEntry = collections.namedtuple('HDUEntry', ['index', 'name', 'header_offset', 'data_offset', 'data_size'])
+
+
+def index_name(filename):
+    """Return the name of the sidecar index file of a fits file.
+    """
+    return filename + INDEX_SUFFIX
+
+
+def _stat(filename):
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+class HDUIndex(object):
+    """The HDU offsets of one fits file, with lookups by number or EXTNAME.
+
+    mtime_ns and size are those of the file when it was indexed.
+    """
+
+    def __init__(self, entries, mtime_ns, size):
+        self.entries = list(entries)
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._names = {}
+        for entry in self.entries:
+            self._names.setdefault(entry.name, entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_current(self, filename):
+        """Return True if filename has not changed since it was indexed.
+        """
+        try:
+            return _stat(filename) == (self.mtime_ns, self.size)
+        except OSError:
+            return False
+
+    def find(self, whichhdu=None):
+        """Return the HDUEntry selected as fits_blocks.find_hdu selects an HDU.
+        """
+        if whichhdu is None:
+            whichhdu = 'Primary'
+        try:
+            whichhdu = int(whichhdu)
+        except ValueError:
+            whichhdu = whichhdu.upper()
+
+        if isinstance(whichhdu, int):
+            if not -len(self.entries) <= whichhdu < len(self.entries):
+                raise IndexError("HDU %d not found" % whichhdu)
+            return self.entries[whichhdu]
+        if whichhdu == 'PRIMARY' and self.entries:
+            return self.entries[0]
+        try:
+            return self._names[whichhdu]
+        except KeyError:
+            raise KeyError("Extension '%s' not found" % whichhdu)
+
+    def read_info(self, filename, whichhdu=None):
+        """Return the fits_blocks.HDUInfo of an HDU, reading only its header.
+        """
+        entry = self.find(whichhdu)
+        instrument.count('file_opens')
+        with open(filename, 'rb') as fileobj:
+            fileobj.seek(entry.header_offset)
+            header = fileobj.read(entry.data_offset - entry.header_offset)
+        instrument.count('bytes_read', len(header))
+        if not header.startswith(b'SIMPLE') and not header.startswith(b'XTENSION'):
+            raise ValueError("HDU index of %s does not match the file" % filename)
+        return fits_blocks.HDUInfo(entry.index, entry.name, entry.header_offset, entry.data_offset,
+                                   entry.data_size, header)
+
+    def to_dict(self):
+        return {'version': INDEX_VERSION, 'mtime_ns': self.mtime_ns, 'size': self.size,
+                'hdus': [list(entry) for entry in self.entries]}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError("Unsupported HDU index version %s" % data.get('version'))
+        return cls([HDUEntry(*entry) for entry in data['hdus']], data['mtime_ns'], data['size'])
+
+
+@instrument.timed
+def build_index(filename):
+    """Return the HDUIndex of a fits file, from one pass over its headers.
+    """
+    mtime_ns, size = _stat(filename)
+    entries = [HDUEntry(info.index, info.name, info.header_offset, info.data_offset, info.data_size)
+               for info in fits_blocks.iter_hdus(filename)]
+    if _stat(filename) != (mtime_ns, size):
+        raise ValueError("%s changed while it was being indexed" % filename)
+    return HDUIndex(entries, mtime_ns, size)
+
+
+@instrument.timed
+def write_index(filename, index=None):
+    """Save the index of a fits file (built if not given) in its sidecar file.
+
+    The sidecar is written to a temporary file renamed over the old one.
+    Returns the HDUIndex.
+    """
+    if index is None:
+        index = build_index(filename)
+    sidecar = index_name(filename)
+    dirname = os.path.dirname(os.path.abspath(sidecar))
+    tmpfd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.%s.' % os.path.basename(sidecar), suffix='.tmp')
+    try:
+        with os.fdopen(tmpfd, 'w') as fileobj:
+            json.dump(index.to_dict(), fileobj)
+        os.replace(tmpname, sidecar)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+    _remember(filename, index)
+    return index
+
+
+# realpath --> HDUIndex, or the (st_mtime_ns, st_size) of a file found
+# without a sidecar
+_CACHE = collections.OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+_USE_SIDECARS = None
+
+
+def _remember(filename, index):
+    with _CACHE_LOCK:
+        _CACHE[os.path.realpath(filename)] = index
+        _CACHE.move_to_end(os.path.realpath(filename))
+        while len(_CACHE) > MAX_CACHED:
+            _CACHE.popitem(last=False)
+
+
+def enable_sidecars():
+    """Make find_hdu (and so the fitsutils header readers) use sidecar indexes.
+    """
+    global _USE_SIDECARS
+    _USE_SIDECARS = True
+
+
+def disable_sidecars():
+    """Make find_hdu always scan the headers, ignoring sidecar indexes.
+    """
+    global _USE_SIDECARS
+    _USE_SIDECARS = False
+
+
+def sidecars_enabled():
+    """Return True if find_hdu uses sidecar indexes.
+    """
+    if _USE_SIDECARS is None:
+        return os.environ.get(SIDECAR_ENV, '').lower() in ('1', 'true', 'yes')
+    return _USE_SIDECARS
+
+
+def load_index(filename):
+    """Return the HDUIndex of a fits file from memory or its sidecar, or None.
+
+    None is returned when there is no sidecar, or it cannot be read, or
+    the file changed since it was indexed.  Loaded indexes are kept in
+    memory while their file is unchanged, and so is the absence of a
+    sidecar: a sidecar written by another process for a file already
+    looked up is only seen once the file changes.
+    """
+    realpath = os.path.realpath(filename)
+    try:
+        stat = _stat(realpath)
+    except OSError:
+        return None
+    with _CACHE_LOCK:
+        cached = _CACHE.get(realpath)
+    if isinstance(cached, HDUIndex) and (cached.mtime_ns, cached.size) == stat:
+        return cached
+    if cached == stat:
+        return None
+
+    index = None
+    try:
+        with open(index_name(filename), 'r') as fileobj:
+            index = HDUIndex.from_dict(json.load(fileobj))
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    if index is None or (index.mtime_ns, index.size) != stat:
+        _remember(filename, stat)
+        return None
+    _remember(filename, index)
+    return index
+
+
+def get_index(filename, write=False):
+    """Return the HDUIndex of a fits file, building it if there is no current one.
+
+    A built index is kept in memory, and saved in the sidecar if write is set.
+    """
+    index = load_index(filename)
+    if index is None:
+        index = build_index(filename)
+        if write:
+            write_index(filename, index)
+        else:
+            _remember(filename, index)
+    return index
+
+
+def refresh_index(filename):
+    """Rewrite the sidecar of a fits file which has one, after the file changed.
+
+    Returns True if there was a sidecar to refresh.
+    """
+    if not os.path.exists(index_name(filename)):
+        return False
+    write_index(filename)
+    return True
+
+
+def find_hdu(filename, whichhdu=None):
+    """Return the HDUInfo of an HDU, as fits_blocks.find_hdu does.
+
+    When sidecars are enabled and the file has a current index, the
+    header of the HDU is read directly; otherwise the headers are scanned
+    from the start of the file.
+    """
+    index = load_index(filename) if sidecars_enabled() else None
+    if index is not None:
+        try:
+            return index.read_info(filename, whichhdu)
+        except (IndexError, KeyError) as err:
+            raise type(err)("%s in %s" % (err.args[0], filename))
+        except ValueError:
+            pass
+    return fits_blocks.find_hdu(filename, whichhdu)
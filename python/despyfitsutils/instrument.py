@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""Counters and timers for the despyfitsutils I/O hot paths.
+
+Nothing is recorded unless a collector is active, and the hooks then
+cost a single test of a module-level list.  Counters recorded:
+
+    file_opens      files opened (astropy or raw)
+    header_parses   headers parsed (raw FITS blocks or astropy Header)
+    bytes_read      bytes read from fits files by this package
+    bytes_written   bytes written to fits/head files by this package
+    hdus_copied     HDUs copied to an output MEF or catalog
+
+and, for every function decorated with timed(), the number of calls and
+the total wall and CPU (calling thread) time.  Nested calls are counted
+in both functions.  Work done in worker processes (nproc > 1) is not
+seen by the collectors of the parent process.
+
+Usage:
+
+    with instrument.collect(sink='ingest.jsonl') as report:
+        ...
+    print(report.format())
+
+Setting DESPYFITSUTILS_INSTRUMENT to a file name collects everything the
+process does into that JSON-lines file, without changing any code.
+"""
+
+import atexit
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+
+# Active collectors; empty when instrumentation is disabled.
+_COLLECTORS = []
+_LOCK = threading.Lock()
+
+ENV_SINK = 'DESPYFITSUTILS_INSTRUMENT'
+
+
+class Report(object):
+    """Counters and timings gathered by one collector.
+
+    When sink is given (a file name, opened in append mode, or a file
+    object) every timed call is written to it as a JSON line, followed by
+    a final line with the whole report when the collector stops.
+    """
+
+    def __init__(self, sink=None):
+        self.counters = collections.Counter()
+        self.timings = {}
+        self.start = time.time()
+        self.elapsed = None
+        self._own_sink = isinstance(sink, str)
+        self.sink = open(sink, 'a') if self._own_sink else sink
+
+    def add(self, name, value):
+        self.counters[name] += value
+
+    def record(self, name, wall, cpu):
+        timing = self.timings.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+        timing['calls'] += 1
+        timing['wall'] += wall
+        timing['cpu'] += cpu
+        if self.sink is not None:
+            self._write({'type': 'call', 'name': name, 'time': time.time(), 'wall': wall, 'cpu': cpu})
+
+    def _write(self, record):
+        self.sink.write(json.dumps(record) + '\n')
+
+    def stop(self):
+        """Stop the wall clock and write the report to the sink.
+        """
+        self.elapsed = time.time() - self.start
+        if self.sink is not None:
+            self._write(dict(self.as_dict(), type='report'))
+            if self._own_sink:
+                self.sink.close()
+            else:
+                self.sink.flush()
+            self.sink = None
+
+    def as_dict(self):
+        """Return the report as a JSON-serializable dictionary.
+        """
+        return {'start': self.start, 'elapsed': self.elapsed, 'counters': dict(self.counters),
+                'timings': dict([(name, dict(t)) for name, t in self.timings.items()])}
+
+    def format(self):
+        """Return the report as a text table, slowest functions first.
+        """
+        lines = ["%-14s %14d" % (name, value) for name, value in sorted(self.counters.items())]
+        lines.append("%-40s %8s %12s %12s" % ('function', 'calls', 'wall (s)', 'cpu (s)'))
+        for name, t in sorted(self.timings.items(), key=lambda item: -item[1]['wall']):
+            lines.append("%-40s %8d %12.6f %12.6f" % (name, t['calls'], t['wall'], t['cpu']))
+        return '\n'.join(lines)
+
+
+def enabled():
+    """Return True if a collector is active.
+    """
+    return bool(_COLLECTORS)
+
+
+def count(name, value=1):
+    """Add value to counter name of the active collectors.
+    """
+    if _COLLECTORS:
+        with _LOCK:
+            for report in _COLLECTORS:
+                report.add(name, value)
+
+
+def _record(name, wall, cpu):
+    with _LOCK:
+        for report in _COLLECTORS:
+            report.record(name, wall, cpu)
+
+
+def timed(func):
+    """Decorator recording the calls, wall and CPU time of func.
+    """
+    name = '%s.%s' % (func.__module__.rsplit('.', 1)[-1], func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _COLLECTORS:
+            return func(*args, **kwargs)
+        wall0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter() - wall0, time.thread_time() - cpu0)
+    return wrapper
+
+
+def start(sink=None):
+    """Start a collector and return its Report.
+    """
+    report = Report(sink)
+    with _LOCK:
+        _COLLECTORS.append(report)
+    return report
+
+
+def stop(report):
+    """Stop a collector started with start().
+    """
+    with _LOCK:
+        if report in _COLLECTORS:
+            _COLLECTORS.remove(report)
+    report.stop()
+    return report
+
+
+class collect(object):
+    """Context manager collecting counters and timings into a Report.
+
+    Collectors can be nested; each one sees what happens while it is
+    active.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.report = None
+
+    def __enter__(self):
+        self.report = start(self.sink)
+        return self.report
+
+    def __exit__(self, *exc):
+        stop(self.report)
+
+
+if os.environ.get(ENV_SINK):
+    atexit.register(stop, start(os.environ[ENV_SINK]))
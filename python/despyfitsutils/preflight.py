@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+"""Check the inputs of combine_cats and makeMEF before writing anything.
+
+Only headers are read (with the raw block reader), on a pool of worker
+processes, and every problem found in every input is reported at once in
+a single PreflightError, so a bad input is caught before hours of I/O
+rather than after.
+"""
+
+import collections
+import concurrent.futures
+import os
+
+import despyfitsutils._lazy as _lazy
+import despyfitsutils.fits_blocks as fits_blocks
+import despyfitsutils.fitsutils as fitsutils
+import despyfitsutils.instrument as instrument
+
+# Heavy dependencies, imported on first use
+fits = _lazy.LazyModule('astropy.io.fits')
+
+# EXTNAMEs of the HDUs of a SExtractor LDAC catalog after the Primary HDU
+LDAC_EXTNAMES = ('LDAC_IMHEAD', 'LDAC_OBJECTS')
+
+# At most this many problems are listed in the PreflightError message
+MAX_LISTED = 50
+
+# shape is in numpy order (NAXISn, ..., NAXIS1), None if unknown; infos
+# is the fits_blocks.HDUInfo list of the HDUs scanned, None if the file
+# could not be scanned (e.g. gzipped); columns is the schema of the
+# LDAC_OBJECTS table of a catalog (see table_schema), None if unknown
+InputCheck = collections.namedtuple('InputCheck', ['filename', 'problems', 'shape', 'infos', 'columns'])
+
+
+class PreflightError(ValueError):
+    """Raised when some inputs fail the preflight checks.
+
+    problems holds the list of all the problems, each naming its file.
+    """
+
+    def __init__(self, problems, what='inputs'):
+        self.problems = list(problems)
+        listed = self.problems[:MAX_LISTED]
+        if len(self.problems) > MAX_LISTED:
+            listed.append("... and %d more" % (len(self.problems) - MAX_LISTED))
+        ValueError.__init__(self, "%d problems found in %s:\n  %s" % (len(self.problems), what,
+                                                                       "\n  ".join(listed)))
+
+
+def _scan(filename):
+    """Return (HDUInfo list, problems) from the headers of a file.
+
+    The HDUs found before a damaged header are returned along with the
+    problem; a file whose data run past its end is reported as truncated.
+    """
+    if not os.path.exists(filename):
+        return [], ["%s: file not found" % filename]
+    infos = []
+    problems = []
+    try:
+        for info in fits_blocks.iter_hdus(filename):
+            infos.append(info)
+    except (OSError, ValueError) as err:
+        problems.append("%s: HDU %d: %s" % (filename, len(infos), err))
+    if infos:
+        size = os.path.getsize(filename)
+        last = infos[-1]
+        if last.data_offset + last.data_size > size:
+            problems.append("%s: truncated in HDU %d (%d bytes missing)" % (
+                filename, last.index, last.data_offset + last.data_size - size))
+    return infos, problems
+
+
+def table_schema(info):
+    """Return the schema of a binary table HDU as [(NAME, TFORM, keywords)].
+
+    keywords is a tuple of the (keyword, value) of the column keywords
+    which must agree for two columns to be merged (TDIM, TSCAL, TZERO,
+    TNULL), with values which compare across files.  Raises ValueError if
+    the table layout (TFIELDS, TFORMn, NAXIS1) is broken.
+    """
+    schema = []
+    for col in fits_blocks.table_columns(info):
+        keywords = [(keyword, fitsutils._schema_value(keyword, col.values[keyword]))
+                    for keyword in fitsutils._MERGE_SCHEMA_KEYWORDS if keyword in col.values]
+        schema.append((col.name.upper(), col.tform, tuple(keywords)))
+    return schema
+
+
+def _is_gzipped(filename):
+    try:
+        with open(filename, 'rb') as fileobj:
+            return fileobj.read(2) == b'\x1f\x8b'
+    except OSError:
+        return False
+
+
+def _astropy_names(filename, nhdus):
+    """Return the EXTNAMEs of the first nhdus HDUs of a file astropy can open (e.g. gzipped).
+    """
+    instrument.count('file_opens')
+    with fits.open(filename) as hdulist:
+        return [hdu.header.get('EXTNAME', '').strip().upper() for hdu in hdulist[:nhdus]]
+
+
+@instrument.timed
+def check_catalog(filename, nhdus=3):
+    """Return the InputCheck of one combine_cats input.
+
+    The catalog must have nhdus HDUs, LDAC_IMHEAD and LDAC_OBJECTS after
+    the Primary HDU, none of them truncated, and LDAC_OBJECTS must be a
+    binary table.  Gzipped catalogs (which can only be combined through
+    astropy) are checked through astropy.
+    """
+    if _is_gzipped(filename):
+        try:
+            names = _astropy_names(filename, nhdus)
+        except Exception as err:
+            return InputCheck(filename, ["%s: %s: %s" % (filename, type(err).__name__, err)], None, None, None)
+        infos = [fits_blocks.HDUInfo(k, name, 0, 0, 0, b'') for k, name in enumerate(names)]
+        scanned = None
+        problems = []
+    else:
+        infos, problems = _scan(filename)
+        scanned = infos
+        if not infos:
+            return InputCheck(filename, problems, None, None, None)
+    if len(infos) < nhdus:
+        problems.append("%s: %d HDUs, expected %d" % (filename, len(infos), nhdus))
+    for k, extname in enumerate(LDAC_EXTNAMES):
+        if k + 1 < len(infos) and infos[k + 1].name != extname:
+            problems.append("%s: HDU %d is '%s', expected %s" % (filename, k + 1, infos[k + 1].name, extname))
+    columns = None
+    if len(infos) > 2 and infos[2].header:
+        offsets = fits_blocks.card_offsets(infos[2].header)
+        if fits_blocks._raw_value(infos[2].header, offsets, 'XTENSION') != 'BINTABLE':
+            problems.append("%s: %s is not a binary table" % (filename, LDAC_EXTNAMES[1]))
+        else:
+            try:
+                columns = table_schema(infos[2])
+            except ValueError as err:
+                problems.append("%s: %s: %s" % (filename, LDAC_EXTNAMES[1], err))
+    return InputCheck(filename, problems, None, scanned, columns)
+
+
+@instrument.timed
+def check_image(filename, whichhdu=None):
+    """Return the InputCheck of one makeMEF input, with its image shape.
+
+    whichhdu is the index of the image HDU; by default the first
+    tile-compressed HDU, else the first HDU with data.  The file must
+    not be truncated and the image must have data.
+    """
+    infos, problems = _scan(filename)
+    if not infos:
+        return InputCheck(filename, problems, None, None, None)
+    if whichhdu is None:
+        compressed = [info for info in infos if fits_blocks.is_compressed(info.header)]
+        data = [info for info in infos if info.data_size > 0]
+        info = (compressed or data or infos)[0]
+    elif whichhdu < len(infos):
+        info = infos[whichhdu]
+    else:
+        problems.append("%s: HDU %d not found" % (filename, whichhdu))
+        return InputCheck(filename, problems, None, infos, None)
+
+    shape = None
+    try:
+        values = fits_blocks.values_from_info(info, ['NAXIS'])
+        naxis = values['NAXIS']
+        axes = fits_blocks.values_from_info(info, ['NAXIS%d' % (n + 1) for n in range(naxis)])
+        shape = tuple([axes['NAXIS%d' % n] for n in range(naxis, 0, -1)])
+    except (KeyError, ValueError) as err:
+        problems.append("%s: HDU %d: bad image header (%s)" % (filename, info.index, err))
+    if shape is not None and (not shape or 0 in shape):
+        problems.append("%s: HDU %d has no image data" % (filename, info.index))
+    return InputCheck(filename, problems, shape, infos, None)
+
+
+def _run(func, jobs, nproc=1, chunksize=None):
+    """Return [func(*job)] for each job, on nproc worker processes.
+    """
+    if nproc is None or nproc <= 1 or len(jobs) <= 1:
+        return [func(*job) for job in jobs]
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (nproc * 8))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as pool:
+        return list(pool.map(func, *zip(*jobs), chunksize=chunksize))
+
+
+def _schema_problems(checks, columns=None):
+    """Return the differences between the LDAC_OBJECTS schemas of catalogs.
+
+    Every catalog is compared with the first one whose schema is known,
+    on all columns, or only on the ones named in columns.
+    """
+    checks = [check for check in checks if check.columns is not None]
+    if not checks:
+        return []
+    problems = []
+    ref = checks[0]
+    refcols = dict([(col[0], col) for col in ref.columns])
+    if columns is None:
+        names = [col[0] for col in ref.columns]
+    else:
+        names = []
+        for name in columns:
+            if name.upper() in refcols:
+                names.append(name.upper())
+            else:
+                problems.append("%s: no column %s" % (ref.filename, name))
+
+    for check in checks[1:]:
+        bynames = dict([(col[0], col) for col in check.columns])
+        if columns is None:
+            for name in sorted(set(bynames) - set(names)):
+                problems.append("%s: extra column %s" % (check.filename, name))
+        for name in names:
+            col = bynames.get(name)
+            if col is None:
+                problems.append("%s: missing column %s" % (check.filename, name))
+            elif col[1] != refcols[name][1]:
+                problems.append("%s: column %s has TFORM %s, expected %s as in %s" % (
+                    check.filename, name, col[1], refcols[name][1], ref.filename))
+            elif col[2] != refcols[name][2]:
+                problems.append("%s: column %s has %s, expected %s as in %s" % (
+                    check.filename, name, dict(col[2]), dict(refcols[name][2]), ref.filename))
+    return problems
+
+
+@instrument.timed
+def preflight_catalogs(incats, nhdus=3, nproc=1, chunksize=None, same_schema=False, columns=None):
+    """Check all combine_cats inputs; raise PreflightError listing every problem.
+
+    With same_schema set the LDAC_OBJECTS tables of all catalogs must
+    also have the same columns, with the same types, dimensions and
+    scaling, as combine_cats(mode='merge') needs; given columns (a list
+    of names), only those columns are compared.  Returns the list of
+    InputCheck.
+    """
+    incats = list(incats)
+    checks = _run(check_catalog, [(incat, nhdus) for incat in incats], nproc, chunksize)
+    problems = []
+    for check in checks:
+        problems.extend(check.problems)
+    if same_schema:
+        problems.extend(_schema_problems(checks, columns))
+    if problems:
+        raise PreflightError(problems, "%d catalogs" % len(incats))
+    return checks
+
+
+@instrument.timed
+def preflight_images(filenames, extnames=None, whichhdu=None, same_shape=False, nproc=1, chunksize=None):
+    """Check all makeMEF inputs; raise PreflightError listing every problem.
+
+    extnames, if given, must match the inputs one to one and be unique.
+    With same_shape set all images must have the same shape (as the SCI,
+    MSK and WGT planes of a CCD do).  Returns the list of InputCheck.
+    """
+    filenames = list(filenames)
+    problems = []
+    if extnames:
+        if len(extnames) != len(filenames):
+            problems.append("%d extension names for %d files" % (len(extnames), len(filenames)))
+        counts = collections.Counter([extname.upper() for extname in extnames])
+        for extname in sorted([e for e, n in counts.items() if n > 1]):
+            problems.append("extension name %s used %d times" % (extname, counts[extname]))
+
+    checks = _run(check_image, [(fname, whichhdu) for fname in filenames], nproc, chunksize)
+    for check in checks:
+        problems.extend(check.problems)
+    if same_shape:
+        shapes = [check.shape for check in checks if check.shape]
+        if shapes:
+            common = collections.Counter(shapes).most_common(1)[0][0]
+            for check in checks:
+                if check.shape and check.shape != common:
+                    problems.append("%s: image shape %s differs from %s" % (check.filename, check.shape, common))
+    if problems:
+        raise PreflightError(problems, "%d images" % len(filenames))
+    return checks
@@ -0,0 +1,193 @@
+"""Generators of synthetic DECam-like inputs for the benchmarks.
+
+Every generator writes its files below a given directory and returns
+their names.  The values are random but seeded, so two runs (or two
+commits) benchmark the same bytes.
+"""
+
+import os
+import numpy as np
+from astropy.io import fits
+
+
+# DECam science CCD names: 31 in the south and 31 in the north half.
+CCD_NAMES = ['S%d' % k for k in range(1, 32)] + ['N%d' % k for k in range(1, 32)]
+
+FILTERS = {
+    'g': 'g DECam SDSS c0001 4720.0 1520.0',
+    'r': 'r DECam SDSS c0002 6415.0 1480.0',
+    'i': 'i DECam SDSS c0003 7835.0 1470.0',
+    'z': 'z DECam SDSS c0004 9260.0 1520.0',
+    'Y': 'Y DECam c0005 10095.0 1130.0',
+}
+
+
+def exposure_header(expnum=229000, band='r', seed=0):
+    """Return a Primary header with the keywords of a DECam exposure.
+    """
+    rng = np.random.default_rng(seed + expnum)
+    ra = rng.uniform(0.0, 24.0)
+    dec = rng.uniform(-70.0, 5.0)
+    hdr = fits.Header()
+    hdr['EXPNUM'] = expnum
+    hdr['INSTRUME'] = 'DECam'
+    hdr['TELESCOP'] = 'CTIO 4.0-m telescope'
+    hdr['OBSTYPE'] = 'raw_obj'
+    hdr['FILTER'] = FILTERS[band]
+    hdr['OBJECT'] = 'DES survey hex %+d%+d tiling 1' % (int(ra * 15) % 100, int(dec))
+    hdr['DATE-OBS'] = '2024-02-%02dT%02d:%02d:%06.3f' % (1 + expnum % 28, rng.integers(0, 24),
+                                                         rng.integers(0, 60), rng.uniform(0, 60))
+    hdr['EXPTIME'] = 90.0
+    hdr['RA'] = '%02d:%02d:%06.3f' % (int(ra), int(ra * 60) % 60, (ra * 3600) % 60)
+    hdr['DEC'] = '%+03d:%02d:%05.2f' % (int(dec), int(abs(dec) * 60) % 60, (abs(dec) * 3600) % 60)
+    hdr['TELRA'] = hdr['RA']
+    hdr['TELDEC'] = hdr['DEC']
+    hdr['AIRMASS'] = 1.2
+    # Pad with the kind of bookkeeping a raw DECam header carries
+    for k in range(150):
+        hdr['HIERARCH DTS%03d' % k] = 'value %d' % k
+    return hdr
+
+
+def ccd_header(k):
+    """Return the extension keywords of CCD number k (0-based).
+    """
+    hdr = fits.Header()
+    hdr['EXTNAME'] = CCD_NAMES[k]
+    hdr['CCDNUM'] = k + 1
+    hdr['DETPOS'] = CCD_NAMES[k]
+    hdr['GAINA'] = 4.0
+    hdr['GAINB'] = 4.1
+    hdr['CRPIX1'] = 1024.0
+    hdr['CRPIX2'] = 2048.0
+    return hdr
+
+
+def ccd_data(shape, seed):
+    """Return sky-like int16 data (noise around a background).
+    """
+    rng = np.random.default_rng(seed)
+    return (rng.normal(1000.0, 30.0, shape)).astype(np.int16)
+
+
+def make_decam_mef(dirname, nccd=62, shape=(256, 128), seed=0):
+    """Write an uncompressed MEF with a Primary and nccd CCD image HDUs.
+    """
+    filename = os.path.join(dirname, 'mef_%d_%dx%d.fits' % (nccd, shape[0], shape[1]))
+    hdus = [fits.PrimaryHDU(header=exposure_header(seed=seed))]
+    for k in range(nccd):
+        hdus.append(fits.ImageHDU(ccd_data(shape, seed + k), header=ccd_header(k)))
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+    return [filename]
+
+
+def make_fpacked_mef(dirname, nccd=62, shape=(256, 128), seed=0):
+    """Write a tile-compressed (RICE) MEF like an fpacked raw exposure.
+    """
+    filename = os.path.join(dirname, 'mef_%d_%dx%d.fits.fz' % (nccd, shape[0], shape[1]))
+    hdus = [fits.PrimaryHDU(header=exposure_header(seed=seed))]
+    for k in range(nccd):
+        hdus.append(fits.CompImageHDU(ccd_data(shape, seed + k), header=ccd_header(k),
+                                      compression_type='RICE_1'))
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+    return [filename]
+
+
+def make_ccd_images(dirname, nccd=62, shape=(256, 128), compressed=False, seed=0):
+    """Write one single-CCD image per CCD, as makeMEF inputs.
+
+    The exposure keywords are in the Primary header and the image in the
+    first extension, like DESDM single-CCD products.
+    """
+    filenames = []
+    for k in range(nccd):
+        hdr = exposure_header(seed=seed)
+        hdr.update(ccd_header(k))
+        del hdr['EXTNAME']
+        suffix = '.fits.fz' if compressed else '.fits'
+        filename = os.path.join(dirname, 'ccd%02d_%dx%d%s' % (k + 1, shape[0], shape[1], suffix))
+        if compressed:
+            hdus = [fits.PrimaryHDU(header=hdr),
+                    fits.CompImageHDU(ccd_data(shape, seed + k), compression_type='RICE_1')]
+        else:
+            hdus = [fits.PrimaryHDU(ccd_data(shape, seed + k), header=hdr)]
+        fits.HDUList(hdus).writeto(filename, overwrite=True)
+        filenames.append(filename)
+    return filenames
+
+
+def make_ldac_catalog(dirname, nrows=10000, ncards=1500, index=0, seed=0):
+    """Write a SExtractor-style LDAC catalog.
+
+    The LDAC_IMHEAD table holds a copy of an image header of ncards
+    cards and LDAC_OBJECTS nrows objects with the usual kind of columns
+    (including a VIGNET array column).
+    """
+    rng = np.random.default_rng(seed + index)
+    hdr = exposure_header(seed=seed)
+    hdr.update(ccd_header(index % len(CCD_NAMES)))
+    k = 0
+    while len(hdr) < ncards - 1:
+        hdr['PV%d_%d' % (1 + k // 40, k % 40)] = rng.normal()
+        k += 1
+    text = hdr.tostring()
+    cards = [text[i:i + 80] for i in range(0, len(text), 80) if text[i:i + 80].strip()]
+    col = fits.Column('Field Header Card', format='%dA' % (80 * len(cards)),
+                      dim='(80, %d)' % len(cards), array=[cards])
+    imhead = fits.BinTableHDU.from_columns([col], name='LDAC_IMHEAD')
+    objects = fits.BinTableHDU.from_columns([
+        fits.Column('NUMBER', 'J', array=np.arange(1, nrows + 1)),
+        fits.Column('ALPHAWIN_J2000', 'D', unit='deg', array=rng.uniform(0, 360, nrows)),
+        fits.Column('DELTAWIN_J2000', 'D', unit='deg', array=rng.uniform(-70, 5, nrows)),
+        fits.Column('XWIN_IMAGE', 'D', unit='pixel', array=rng.uniform(0, 2048, nrows)),
+        fits.Column('YWIN_IMAGE', 'D', unit='pixel', array=rng.uniform(0, 4096, nrows)),
+        fits.Column('MAG_AUTO', 'E', unit='mag', array=rng.uniform(14, 25, nrows)),
+        fits.Column('MAGERR_AUTO', 'E', unit='mag', array=rng.uniform(0, 0.3, nrows)),
+        fits.Column('FLUX_RADIUS', 'E', unit='pixel', array=rng.uniform(1, 5, nrows)),
+        fits.Column('FLAGS', 'I', array=rng.integers(0, 4, nrows)),
+        fits.Column('VIGNET', '25E', dim='(5,5)', array=rng.random((nrows, 5, 5)))],
+        name='LDAC_OBJECTS')
+    filename = os.path.join(dirname, 'cat%02d_%d.fits' % (index, nrows))
+    fits.HDUList([fits.PrimaryHDU(), imhead, objects]).writeto(filename, overwrite=True)
+    return [filename]
+
+
+def make_ldac_catalogs(dirname, ncats=62, nrows=10000, ncards=1500, seed=0):
+    """Write ncats LDAC catalogs, as combine_cats inputs.
+    """
+    filenames = []
+    for k in range(ncats):
+        filenames.extend(make_ldac_catalog(dirname, nrows, ncards, index=k, seed=seed))
+    return filenames
+
+
+def make_scamp_head(dirname, nexp=10, nccd=62, seed=0):
+    """Write a SCAMP .head file with nexp exposures of nccd solutions each.
+
+    Returns the name of the .head file followed by the names the per-CCD
+    heads get when it is split.
+    """
+    rng = np.random.default_rng(seed)
+    lines = []
+    for k in range(nexp * nccd):
+        lines.append("HISTORY   Astrometric solution by SCAMP version 2.10.0 (2020-04-05)")
+        lines.append("COMMENT   ")
+        lines.append("EQUINOX =        2000.00000000 / Mean equinox")
+        lines.append("RADESYS = 'ICRS    '           / Astrometric system")
+        lines.append("CTYPE1  = 'RA---TPV'           / WCS projection type for this axis")
+        lines.append("CTYPE2  = 'DEC--TPV'           / WCS projection type for this axis")
+        lines.append("CUNIT1  = 'deg     '           / Axis unit")
+        lines.append("CUNIT2  = 'deg     '           / Axis unit")
+        for key in ('CRVAL1', 'CRVAL2', 'CRPIX1', 'CRPIX2', 'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+            lines.append("%-8s= %20.12E / WCS keyword" % (key, rng.normal()))
+        for axis in (1, 2):
+            for p in range(11):
+                lines.append("PV%d_%-4d= %20.12E / Projection distortion parameter" % (axis, p, rng.normal()))
+        for key in ('FGROUPNO', 'ASTIRMS1', 'ASTIRMS2', 'ASTRRMS1', 'ASTRRMS2', 'FLXSCALE', 'MAGZEROP'):
+            lines.append("%-8s= %20.12E / SCAMP keyword" % (key, rng.normal()))
+        lines.append("END     ")
+    filename = os.path.join(dirname, 'scamp_%dx%d.head' % (nexp, nccd))
+    with open(filename, 'w') as headfh:
+        headfh.write('\n'.join(lines) + '\n')
+    outs = [os.path.join(dirname, 'split_%d_%d.head' % (nexp, k)) for k in range(nexp * nccd)]
+    return [filename] + outs
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""Time the main despyfitsutils functions on synthetic DECam-like data.
+
+Each benchmark is run on the inputs of one or more size presets (see
+SIZES); wall and CPU times of every repeat and the peak memory traced by
+tracemalloc are saved as JSON.  Two JSON files (e.g. from two commits)
+can be compared with --compare:
+
+    run_benchmarks.py --size medium --output new.json
+    run_benchmarks.py --compare old.json new.json
+
+This file is deliberately not named test_*: the benchmarks take minutes
+and are not part of the unit tests.
+"""
+
+import argparse
+import collections
+import datetime
+import fnmatch
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import astropy
+
+import generators
+import despyfitsutils.fitsutils as fitsutils
+import despyfitsutils.fits_special_metadata as fits_special_metadata
+
+
+# Generator arguments for each size preset.
+SIZES = {
+    'small': {
+        'mef': {'nccd': 4, 'shape': (64, 32)},
+        'ccds': {'nccd': 4, 'shape': (64, 32)},
+        'cats': {'ncats': 4, 'nrows': 1000, 'ncards': 300},
+        'head': {'nexp': 2, 'nccd': 62},
+    },
+    'medium': {
+        'mef': {'nccd': 62, 'shape': (256, 128)},
+        'ccds': {'nccd': 62, 'shape': (256, 128)},
+        'cats': {'ncats': 62, 'nrows': 2000, 'ncards': 1500},
+        'head': {'nexp': 10, 'nccd': 62},
+    },
+    'large': {
+        'mef': {'nccd': 62, 'shape': (2048, 1024)},
+        'ccds': {'nccd': 62, 'shape': (2048, 1024)},
+        'cats': {'ncats': 62, 'nrows': 20000, 'ncards': 1500},
+        'head': {'nexp': 100, 'nccd': 62},
+    },
+}
+
+# Which generator (and SIZES entry) makes the inputs of each kind.
+INPUTS = {
+    'mef': ('mef', generators.make_decam_mef, {}),
+    'fpacked': ('mef', generators.make_fpacked_mef, {}),
+    'ccds': ('ccds', generators.make_ccd_images, {}),
+    'fpacked_ccds': ('ccds', generators.make_ccd_images, {'compressed': True}),
+    'cats': ('cats', generators.make_ldac_catalogs, {}),
+    'head': ('head', generators.make_scamp_head, {}),
+}
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'inputs', 'func'])
+
+
+def _bench_get_hdr_value(files, outdir):
+    fitsutils.get_hdr_value(files[0], 'EXPNUM')
+    fitsutils.get_hdr_value(files[0], 'CCDNUM', -1)
+
+
+def _bench_func(key, whichhdu=None):
+    func = getattr(fits_special_metadata, 'func_%s' % key)
+
+    def bench(files, outdir):
+        func(files[0], whichhdu=whichhdu)
+    return bench
+
+
+def _bench_combine_cats(mode, **kwargs):
+    def bench(files, outdir):
+        outcat = os.path.join(outdir, 'combined.fits')
+        if os.path.exists(outcat):
+            os.remove(outcat)
+        fitsutils.combine_cats(','.join(files), outcat, mode=mode, **kwargs)
+    return bench
+
+
+def _bench_make_mef(**kwargs):
+    def bench(files, outdir):
+        fitsutils.makeMEF(filenames=files, outname=os.path.join(outdir, 'mef.fits'), clobber=True, **kwargs)
+    return bench
+
+
+def _bench_split_scamp_head(files, outdir):
+    fitsutils.splitScampHead(files[0], ','.join(files[1:]))
+
+
+def get_benchmarks():
+    """Return the list of all benchmarks.
+    """
+    benchmarks = [
+        Benchmark('get_hdr_value', 'mef', _bench_get_hdr_value),
+        Benchmark('get_hdr_value[fpacked]', 'fpacked', _bench_get_hdr_value),
+    ]
+    for key in sorted(fits_special_metadata.SPECIAL_KEYS):
+        if key == 'objects':
+            benchmarks.append(Benchmark('func_objects', 'cats', _bench_func(key, 'LDAC_OBJECTS')))
+        else:
+            benchmarks.append(Benchmark('func_%s' % key, 'fpacked', _bench_func(key)))
+    benchmarks.extend([
+        Benchmark('combine_cats[stream]', 'cats', _bench_combine_cats('stream')),
+        Benchmark('combine_cats[astropy]', 'cats', _bench_combine_cats('astropy')),
+        Benchmark('combine_cats[merge]', 'cats', _bench_combine_cats('merge')),
+        Benchmark('combine_cats[stream+checksum]', 'cats', _bench_combine_cats('stream', checksum=True)),
+        Benchmark('combine_cats[astropy+checksum]', 'cats', _bench_combine_cats('astropy', checksum=True)),
+        Benchmark('makeMEF[stream]', 'ccds', _bench_make_mef()),
+        Benchmark('makeMEF[nostream]', 'ccds', _bench_make_mef(stream=False)),
+        Benchmark('makeMEF[passthrough]', 'fpacked_ccds', _bench_make_mef(passthrough=True)),
+        Benchmark('makeMEF[rice]', 'ccds', _bench_make_mef(compress='RICE_1')),
+        Benchmark('makeMEF[rice,nproc=4]', 'ccds', _bench_make_mef(compress='RICE_1', nproc=4)),
+        Benchmark('splitScampHead', 'head', _bench_split_scamp_head),
+    ])
+    return benchmarks
+
+
+def make_inputs(kind, size, datadir, cache):
+    """Return the input files of one kind for a size preset, generating them once.
+    """
+    preset, generator, extra = INPUTS[kind]
+    params = dict(SIZES[size][preset], **extra)
+    if (kind, size) not in cache:
+        dirname = os.path.join(datadir, '%s_%s' % (kind, size))
+        os.makedirs(dirname, exist_ok=True)
+        cache[(kind, size)] = generator(dirname, **params)
+    return cache[(kind, size)], params
+
+
+def run_one(bench, files, outdir, repeat):
+    """Time one benchmark; return its wall and CPU times and peak memory.
+    """
+    bench.func(files, outdir)     # warm up (imports, page cache)
+    walls = []
+    cpus = []
+    for _ in range(repeat):
+        gc.collect()
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        bench.func(files, outdir)
+        cpus.append(time.process_time() - cpu0)
+        walls.append(time.perf_counter() - wall0)
+
+    # Memory is measured on a separate run: tracing slows everything down
+    gc.collect()
+    tracemalloc.start()
+    try:
+        bench.func(files, outdir)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'times': walls, 'cpu_times': cpus, 'min': min(walls), 'median': statistics.median(walls),
+            'cpu_median': statistics.median(cpus), 'peak_memory': peak}
+
+
+def metadata():
+    """Return a description of what was benchmarked.
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'host': platform.node(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'astropy': astropy.__version__}
+
+
+def run(sizes, pattern='*', repeat=5, datadir=None, verb=True):
+    """Run the benchmarks matching pattern for each size; return the results dict.
+    """
+    results = {'metadata': metadata(), 'results': {}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        datadir = datadir or os.path.join(tmpdir, 'data')
+        outdir = os.path.join(tmpdir, 'out')
+        os.makedirs(outdir)
+        cache = {}
+        for size in sizes:
+            for bench in get_benchmarks():
+                if not fnmatch.fnmatch(bench.name, pattern):
+                    continue
+                files, params = make_inputs(bench.inputs, size, datadir, cache)
+                key = '%s[%s]' % (bench.name, size)
+                try:
+                    res = run_one(bench, files, outdir, repeat)
+                except Exception as err:
+                    res = {'error': "%s: %s" % (type(err).__name__, err)}
+                res.update({'name': bench.name, 'size': size, 'params': params})
+                results['results'][key] = res
+                if verb:
+                    if 'error' in res:
+                        print("%-40s ERROR %s" % (key, res['error']))
+                    else:
+                        print("%-40s %10.4f s %10.4f s %10.1f MB" % (key, res['min'], res['median'],
+                                                                     res['peak_memory'] / 2.0**20))
+                    sys.stdout.flush()
+    return results
+
+
+def compare(base, new, threshold=1.2):
+    """Print the ratio new/base of the min time and peak memory of each benchmark.
+
+    Returns the names of the benchmarks more than threshold times slower
+    (or bigger) in new.
+    """
+    print("%-40s %10s %10s %7s %9s" % ('benchmark', 'base (s)', 'new (s)', 'ratio', 'mem ratio'))
+    regressions = []
+    for key in sorted(set(base['results']) & set(new['results'])):
+        old, cur = base['results'][key], new['results'][key]
+        if 'error' in old or 'error' in cur:
+            print("%-40s %s" % (key, cur.get('error') or 'no base result'))
+            continue
+        ratio = cur['min'] / old['min'] if old['min'] else float('inf')
+        memratio = cur['peak_memory'] / old['peak_memory'] if old['peak_memory'] else 1.0
+        flag = ''
+        if ratio > threshold or memratio > threshold:
+            flag = '  <-- regression'
+            regressions.append(key)
+        print("%-40s %10.4f %10.4f %7.2f %9.2f%s" % (key, old['min'], cur['min'], ratio, memratio, flag))
+    return regressions
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark despyfitsutils on synthetic DECam-like data')
+    parser.add_argument('--size', action='store', default='small',
+                        help='comma-separated list of size presets (%s)' % ', '.join(SIZES))
+    parser.add_argument('--bench', action='store', default='*', help='fnmatch pattern of benchmarks to run')
+    parser.add_argument('--repeat', action='store', type=int, default=5, help='number of timed runs')
+    parser.add_argument('--datadir', action='store', default=None,
+                        help='keep the generated inputs in this directory')
+    parser.add_argument('--output', action='store', default=None, help='JSON file for the results')
+    parser.add_argument('--compare', action='store', nargs=2, metavar=('BASE', 'NEW'), default=None,
+                        help='compare two JSON result files instead of running')
+    parser.add_argument('--threshold', action='store', type=float, default=1.2,
+                        help='ratio above which a benchmark is reported as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as basefh, open(args.compare[1]) as newfh:
+            regressions = compare(json.load(basefh), json.load(newfh), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    sizes = [s for s in args.size.split(',') if s]
+    for size in sizes:
+        if size not in SIZES:
+            parser.error("Unknown size %s" % size)
+
+    results = run(sizes, args.bench, args.repeat, args.datadir)
+    if args.output:
+        with open(args.output, 'w') as outfh:
+            json.dump(results, outfh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
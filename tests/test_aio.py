@@ -0,0 +1,113 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.aio as aio
+
+
+class AioTest(unittest.TestCase):
+    """Tests for the asyncio header readers.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for k in range(6):
+            fname = os.path.join(self.tmpdir.name, 'img%d.fits' % k)
+            hdu = fits.PrimaryHDU(np.zeros((k + 1, 3), dtype='i2'))
+            hdu.header['EXPNUM'] = 100 + k
+            fits.HDUList([hdu, fits.ImageHDU(np.zeros(2), name='SCI')]).writeto(fname)
+            self.files.append(fname)
+        self.running = 0
+        self.max_running = 0
+        self.started = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def slow(self, filename, delay=0.02, event=None):
+        with self.lock:
+            self.started.append(filename)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if event is not None:
+                event.wait(5)
+            time.sleep(delay)
+            if filename.endswith('bad'):
+                raise OSError("cannot read %s" % filename)
+            return os.path.basename(filename)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def testSingle(self):
+        async def run():
+            values = await aio.aget_hdr_values(self.files[2], ['EXPNUM', 'NAXIS2'])
+            extname = await aio.aget_hdr_value(self.files[2], 'EXTNAME', 'SCI')
+            hdr = await aio.aget_hdr(self.files[1])
+            special = await aio.aget_special_metadata(self.files[3], ['objects'])
+            return values, extname, hdr['NAXIS2'], special
+        values, extname, naxis2, special = asyncio.run(run())
+        self.assertEqual(values, {'EXPNUM': 102, 'NAXIS2': 3})
+        self.assertEqual(extname, 'SCI')
+        self.assertEqual(naxis2, 2)
+        self.assertEqual(special, {'objects': 4})
+
+    def testBatch(self):
+        files = self.files + [os.path.join(self.tmpdir.name, 'missing.fits')]
+        results = asyncio.run(aio.aget_hdr_values_batch(files, ['EXPNUM'], concurrency=2))
+        self.assertEqual([r[0] for r in results[:-1]], [{'EXPNUM': 100 + k} for k in range(6)])
+        self.assertTrue(all([r[1] == '' for r in results[:-1]]))
+        self.assertIsNone(results[-1][0])
+        self.assertIn('FileNotFoundError', results[-1][1])
+        results = asyncio.run(aio.aget_special_metadata_batch(self.files[:2], ['objects']))
+        self.assertEqual(results, [({'objects': 1}, ''), ({'objects': 2}, '')])
+
+    def testCompleted(self):
+        names = ['f%d' % k for k in range(20)] + ['bad']
+
+        async def run():
+            return [item async for item in aio.aiter_completed(self.slow, names, 0.001, concurrency=3)]
+        results = asyncio.run(run())
+        self.assertEqual(sorted([r[0] for r in results]), sorted(names))
+        self.assertLessEqual(self.max_running, 3)
+        errors = dict([(r[0], r[2]) for r in results])
+        self.assertEqual(errors['f7'], '')
+        self.assertEqual(errors['bad'], 'OSError: cannot read bad')
+
+    def testCancel(self):
+        event = threading.Event()
+        names = ['f%d' % k for k in range(50)]
+
+        async def consume():
+            async for item in aio.aiter_completed(self.slow, names, event=event, concurrency=2):
+                pass
+
+        async def run():
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            event.set()
+
+        asyncio.run(run())
+        # the calls not yet submitted never run
+        self.assertLessEqual(len(self.started), 2)
+
+    def testExecutor(self):
+        executor = aio.set_executor(None)
+        try:
+            self.assertIsNotNone(aio.get_executor())
+            aio.shutdown_executor()
+            value = asyncio.run(aio.aget_hdr_value(self.files[0], 'EXPNUM'))
+            self.assertEqual(value, 100)
+        finally:
+            aio.shutdown_executor()
+            aio.set_executor(executor)
@@ -0,0 +1,176 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.backends as backends
+import despyfitsutils.checksums as checksums
+import despyfitsutils.fitsutils as utils
+
+
+def make_test_mef(filename):
+    """Write a MEF with an image, a compressed image and a binary table.
+    """
+    rng = np.random.default_rng(3)
+    primary = fits.PrimaryHDU()
+    primary.header['EXPNUM'] = 229686
+    primary.header['FILTER'] = 'r DECam SDSS c0002 6415.0 1480.0'
+    sci = fits.ImageHDU(rng.integers(0, 1000, (6, 5)).astype(np.int16), name='SCI')
+    sci.header['CCDNUM'] = 12
+    wgt = fits.CompImageHDU(rng.integers(0, 100, (8, 7)).astype(np.int32), name='WGT')
+    table = fits.BinTableHDU.from_columns([
+        fits.Column('NUMBER', 'J', array=np.arange(1, 11)),
+        fits.Column('MAG', 'E', array=rng.random(10)),
+        fits.Column('RA', 'D', array=rng.random(10) * 360),
+        fits.Column('NAME', '8A', array=['obj%d' % k for k in range(10)]),
+        fits.Column('VEC', '3I', array=rng.integers(0, 9, (10, 3)))], name='OBJECTS')
+    fits.HDUList([primary, sci, wgt, table]).writeto(filename, overwrite=True)
+
+
+class BackendSuite(object):
+    """Tests run against every backend; results are checked against astropy
+    read directly, so all backends must agree with each other.
+    """
+
+    backend = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        make_test_mef(self.mef)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testListHdus(self):
+        self.assertEqual(backends.list_hdus(self.mef, backend=self.backend),
+                         [(0, '', 'IMAGE'), (1, 'SCI', 'IMAGE'), (2, 'WGT', 'IMAGE'), (3, 'OBJECTS', 'BINTABLE')])
+
+    def testReadHeader(self):
+        hdr = backends.read_header(self.mef, backend=self.backend)
+        self.assertEqual(hdr['EXPNUM'], 229686)
+        self.assertEqual(hdr['FILTER'], 'r DECam SDSS c0002 6415.0 1480.0')
+        hdr = backends.read_header(self.mef, 'sci', backend=self.backend)
+        self.assertEqual((hdr['NAXIS1'], hdr['NAXIS2'], hdr['CCDNUM']), (5, 6, 12))
+        hdr = backends.read_header(self.mef, 2, backend=self.backend)
+        self.assertEqual((hdr['NAXIS1'], hdr['NAXIS2'], hdr['EXTNAME']), (7, 8, 'WGT'))
+        hdr = backends.read_header(self.mef, -1, backend=self.backend)
+        self.assertEqual(hdr['EXTNAME'], 'OBJECTS')
+        with self.assertRaises(KeyError):
+            backends.read_header(self.mef, 'NOTTHERE', backend=self.backend)
+
+    def testReadImage(self):
+        for ext in ('SCI', 'WGT'):
+            data, hdr = backends.read_image(self.mef, ext, backend=self.backend)
+            self.assertTrue(np.array_equal(data, fits.getdata(self.mef, ext)))
+            self.assertEqual(hdr['EXTNAME'], ext)
+
+    def testReadTable(self):
+        ref = fits.getdata(self.mef, 'OBJECTS')
+        table = backends.read_table(self.mef, 'OBJECTS', backend=self.backend)
+        self.assertEqual(table.dtype.names, ('NUMBER', 'MAG', 'RA', 'NAME', 'VEC'))
+        for name in ('NUMBER', 'MAG', 'RA', 'VEC'):
+            self.assertTrue(np.array_equal(table[name], ref[name]))
+        self.assertEqual(table['NAME'].tolist(), ['obj%d' % k for k in range(10)])
+
+        table = backends.read_table(self.mef, 3, columns=['RA', 'NUMBER'], rows=[1, 4], backend=self.backend)
+        self.assertEqual(table.dtype.names, ('RA', 'NUMBER'))
+        self.assertEqual(table['NUMBER'].tolist(), [2, 5])
+        table = backends.read_table(self.mef, 3, columns=['NUMBER'], rows=slice(2, 5), backend=self.backend)
+        self.assertEqual(table['NUMBER'].tolist(), [3, 4, 5])
+
+    def testWriteMef(self):
+        outname = os.path.join(self.tmpdir.name, 'out.fits')
+        images = [backends.read_image(self.mef, ext, backend=self.backend) for ext in ('SCI', 'WGT')]
+        backends.write_mef(outname, iter(images), backend=self.backend)
+        with fits.open(outname) as hdulist:
+            self.assertEqual(len(hdulist), 2)
+            self.assertTrue(hdulist[0].header['EXTEND'])
+            for hdu, (data, hdr) in zip(hdulist, images):
+                self.assertTrue(np.array_equal(hdu.data, data))
+                self.assertEqual(hdu.header['EXTNAME'], hdr['EXTNAME'])
+        with self.assertRaises(OSError):
+            backends.write_mef(outname, iter(images), backend=self.backend)
+
+    def testMakeMef(self):
+        inputs = []
+        for k in range(3):
+            inputs.append(os.path.join(self.tmpdir.name, 'in%d.fits' % k))
+            fits.PrimaryHDU(np.full((4, 3), k, dtype=np.float32)).writeto(inputs[-1])
+        outname = os.path.join(self.tmpdir.name, 'out.fits')
+        utils.makeMEF(filenames=inputs, outname=outname, extnames=['SCI', 'WGT', 'MSK'],
+                      backend=self.backend)
+        with fits.open(outname) as hdulist:
+            self.assertEqual([h.header['EXTNAME'] for h in hdulist], ['SCI', 'WGT', 'MSK'])
+            self.assertEqual(hdulist[1].header['DES_EXT'], 'WEIGHT')
+            for k, hdu in enumerate(hdulist):
+                self.assertTrue(np.array_equal(hdu.data, np.full((4, 3), k)))
+
+
+class AstropyBackendTest(BackendSuite, unittest.TestCase):
+    """Backend tests for astropy.
+    """
+
+    backend = 'astropy'
+
+
+@unittest.skipUnless('fitsio' in backends.available_backends(), "fitsio is not installed")
+class FitsioBackendTest(BackendSuite, unittest.TestCase):
+    """Backend tests for fitsio.
+    """
+
+    backend = 'fitsio'
+
+
+@unittest.skipUnless('fitsio' in backends.available_backends(), "fitsio is not installed")
+class WriteMefAgreementTest(unittest.TestCase):
+    """The fitsio and astropy backends must write the same MEF content.
+    """
+
+    # cards a writer is free to word or place its own way
+    IGNORED = ('', 'COMMENT', 'HISTORY', 'CHECKSUM', 'DATASUM')
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        make_test_mef(self.mef)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def cards(self, header):
+        return dict([(card.keyword, card.value) for card in header.cards if card.keyword not in self.IGNORED])
+
+    def testWriteMef(self):
+        images = [backends.read_image(self.mef, ext, backend='astropy') for ext in ('SCI', 'WGT')]
+        images.append((np.linspace(0, 1, 12, dtype='f4').reshape(3, 4), None))
+        outnames = {}
+        for backend in ('astropy', 'fitsio'):
+            outnames[backend] = os.path.join(self.tmpdir.name, '%s.fits' % backend)
+            backends.write_mef(outnames[backend], iter(images), backend=backend, checksum=True)
+            self.assertEqual(checksums.check_file(outnames[backend])[1], '')
+        with fits.open(outnames['astropy']) as ref, fits.open(outnames['fitsio']) as hdulist:
+            self.assertEqual(len(hdulist), len(ref))
+            for hdu, ref_hdu in zip(hdulist, ref):
+                self.assertEqual(hdu.data.dtype, ref_hdu.data.dtype)
+                self.assertTrue(np.array_equal(hdu.data, ref_hdu.data))
+                self.assertEqual(self.cards(hdu.header), self.cards(ref_hdu.header))
+
+
+class GetBackendTest(unittest.TestCase):
+    """Tests for get_backend() function.
+    """
+
+    def testSelect(self):
+        self.assertEqual(backends.get_backend('ASTROPY').name, 'astropy')
+        backend = backends.AstropyBackend()
+        self.assertIs(backends.get_backend(backend), backend)
+        with mock.patch.dict(os.environ, {backends.ENV_BACKEND: 'astropy'}):
+            self.assertEqual(backends.get_backend().name, 'astropy')
+        with mock.patch.dict(os.environ, {backends.ENV_BACKEND: ''}):
+            self.assertEqual(backends.get_backend().name, backends.DEFAULT_BACKEND)
+
+    def testUnknown(self):
+        with self.assertRaises(ValueError):
+            backends.get_backend('cfitsio2')
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.checksums as checksums
+
+
+class VerifyChecksumsTest(unittest.TestCase):
+    """Tests for verify_file() and verify_checksums() functions.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.files = []
+        for k in range(3):
+            fname = os.path.join(self.tmpdir.name, 'mef%d.fits' % k)
+            table = fits.BinTableHDU.from_columns([fits.Column('A', 'E', array=rng.random(17))], name='CAT')
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(rng.random((10, 11)), name='SCI'),
+                          table]).writeto(fname, checksum=True)
+            self.files.append(fname)
+        self.nosums = os.path.join(self.tmpdir.name, 'nosums.fits')
+        fits.PrimaryHDU(np.ones(3)).writeto(self.nosums)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def corrupt(self, fname, offset):
+        with open(fname, 'r+b') as fh:
+            fh.seek(offset)
+            byte = fh.read(1)
+            fh.seek(offset)
+            fh.write(bytes([byte[0] ^ 0xff]))
+
+    def testVerify(self):
+        results = checksums.verify_file(self.files[0])
+        self.assertEqual([(r.name, r.datasum, r.checksum) for r in results],
+                         [('PRIMARY', True, True), ('SCI', True, True), ('CAT', True, True)])
+        self.assertEqual(checksums.verify_file(self.nosums)[0][2:], (None, None))
+
+    def testCorrupted(self):
+        with fits.open(self.files[1]) as hdulist:
+            offset = hdulist['SCI'].fileinfo()['datLoc']
+        self.corrupt(self.files[1], offset + 5)
+        results = checksums.verify_file(self.files[1])
+        self.assertEqual((results[1].datasum, results[1].checksum), (False, False))
+        self.assertEqual((results[2].datasum, results[2].checksum), (True, True))
+
+        # a header edit only breaks CHECKSUM
+        with fits.open(self.files[2]) as hdulist:
+            offset = hdulist['CAT'].fileinfo()['hdrLoc']
+        self.corrupt(self.files[2], offset + 79)
+        results = checksums.verify_file(self.files[2])
+        self.assertEqual((results[2].datasum, results[2].checksum), (True, False))
+
+    def testParallel(self):
+        self.corrupt(self.files[1], os.path.getsize(self.files[1]) - 2880)
+        files = self.files + [self.nosums, os.path.join(self.tmpdir.name, 'missing.fits')]
+        results = checksums.verify_checksums(files, nproc=2, chunksize=1)
+        self.assertEqual(results, checksums.verify_checksums(files))
+        errors = [error for hdus, error in results]
+        self.assertEqual(errors[0], '')
+        self.assertEqual(errors[1], 'bad checksum in HDU 2 (CAT)')
+        self.assertEqual(errors[3], '')
+        self.assertTrue(errors[4].startswith('FileNotFoundError'))
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.compress as compress
+import despyfitsutils.checksums as checksums
+import despyfitsutils.fitsutils as utils
+from test_fitsutils import make_ldac_cat
+
+
+class CompressOptionsTest(unittest.TestCase):
+    """Tests for compress_options() function.
+    """
+
+    def testDefaults(self):
+        opts = compress.compress_options()
+        self.assertEqual(opts.compression_type, 'RICE_1')
+        self.assertEqual(opts.quantize_method, 1)
+        opts = compress.compress_options('gzip_2', quantize_method='NO_DITHER', tile_shape=[10, 20])
+        self.assertEqual((opts.compression_type, opts.quantize_method, opts.tile_shape), ('GZIP_2', -1, (10, 20)))
+
+    def testInvalid(self):
+        with self.assertRaises(ValueError):
+            compress.compress_options('LZW')
+        with self.assertRaises(ValueError):
+            compress.compress_options(quantize_method='DITHER')
+
+
+class MefCompressTest(unittest.TestCase):
+    """Tests for makeMEF writing tile-compressed output.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.data = [rng.integers(0, 60000, (40, 30)).astype('i4'),
+                     rng.normal(1000.0, 30.0, (40, 30)).astype('f4'),
+                     rng.integers(0, 100, (40, 30)).astype('i2')]
+        self.inputs = []
+        for k, data in enumerate(self.data):
+            fname = os.path.join(self.tmpdir.name, 'ccd%d.fits' % k)
+            hdu = fits.PrimaryHDU(data)
+            hdu.header['CCDNUM'] = k + 1
+            hdu.writeto(fname)
+            self.inputs.append(fname)
+        self.output = os.path.join(self.tmpdir.name, 'mef.fits.fz')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testRice(self):
+        utils.makeMEF(filenames=self.inputs, outname=self.output, extnames=['SCI', 'WGT', 'MSK'],
+                      compress='RICE_1', quantize_level=16, checksum=True)
+        with fits.open(self.output) as hdulist:
+            self.assertEqual([hdu.name for hdu in hdulist], ['PRIMARY', 'SCI', 'WGT', 'MSK'])
+            self.assertEqual(hdulist['WGT'].header['DES_EXT'], 'WEIGHT')
+            self.assertEqual(hdulist['MSK'].header['CCDNUM'], 3)
+            for k in (0, 2):
+                self.assertIsInstance(hdulist[k + 1], fits.CompImageHDU)
+                np.testing.assert_array_equal(hdulist[k + 1].data, self.data[k])
+            # quantized: the error is a fraction of the noise
+            self.assertLess(np.abs(hdulist['WGT'].data - self.data[1]).max(), 30.0 / 16)
+        with fits.open(self.output, disable_image_compression=True) as hdulist:
+            self.assertEqual(hdulist['WGT'].header['ZQUANTIZ'], 'SUBTRACTIVE_DITHER_1')
+        self.assertEqual(checksums.check_file(self.output)[1], '')
+
+    def testParallel(self):
+        serial = os.path.join(self.tmpdir.name, 'serial.fits.fz')
+        utils.makeMEF(filenames=self.inputs, outname=serial, compress='RICE_1', tile_shape=(10, 30))
+        utils.makeMEF(filenames=self.inputs, outname=self.output, compress='RICE_1', tile_shape=(10, 30), nproc=2)
+        with open(serial, 'rb') as fh1, open(self.output, 'rb') as fh2:
+            self.assertEqual(fh1.read(), fh2.read())
+        with fits.open(self.output, disable_image_compression=True) as hdulist:
+            self.assertEqual(hdulist[1].header['ZTILE2'], 10)
+
+    def testGzip(self):
+        utils.makeMEF(filenames=self.inputs, outname=self.output, compress='GZIP_2', nproc=2)
+        with fits.open(self.output) as hdulist:
+            np.testing.assert_array_equal(hdulist[3].data, self.data[2])
+        with fits.open(self.output, disable_image_compression=True) as hdulist:
+            self.assertEqual(hdulist[1].header['ZCMPTYPE'], 'GZIP_2')
+
+    def testPassthroughConflict(self):
+        with self.assertRaises(SystemExit):
+            utils.makeMEF(filenames=self.inputs, outname=self.output, compress='RICE_1', passthrough=True)
+
+
+class CombineCatsCompressTest(unittest.TestCase):
+    """Tests for combine_cats writing tile-compressed images.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.incats = []
+        for k in range(2):
+            incat = os.path.join(self.tmpdir.name, 'cat%d.fits' % k)
+            objects = fits.BinTableHDU.from_columns([fits.Column('NUMBER', 'J', array=np.arange(5))],
+                                                    name='LDAC_OBJECTS')
+            fits.HDUList([fits.PrimaryHDU(np.arange(12, dtype='i4').reshape(3, 4) + k),
+                          fits.BinTableHDU.from_columns([fits.Column('A', 'J', array=[k])], name='LDAC_IMHEAD'),
+                          objects]).writeto(incat)
+            self.incats.append(incat)
+        self.outcat = os.path.join(self.tmpdir.name, 'cats.fits')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testCompress(self):
+        utils.combine_cats(','.join(self.incats), self.outcat, compress='RICE_1', nproc=2)
+        with fits.open(self.outcat) as hdulist:
+            self.assertEqual(len(hdulist), 6)
+            # the first Primary HDU and the tables are copied as they are
+            self.assertNotIsInstance(hdulist[0], fits.CompImageHDU)
+            self.assertIsInstance(hdulist[3], fits.CompImageHDU)
+            np.testing.assert_array_equal(hdulist[3].data, np.arange(12).reshape(3, 4) + 1)
+            self.assertIsInstance(hdulist[5], fits.BinTableHDU)
+            np.testing.assert_array_equal(hdulist[5].data['NUMBER'], np.arange(5))
+
+    def testLdacCatalogs(self):
+        # LDAC catalogs have no image to compress, so no worker pool is started
+        incats = []
+        for k in range(2):
+            incats.append(os.path.join(self.tmpdir.name, 'ldac%d.fits' % k))
+            make_ldac_cat(incats[-1], seed=k)
+        utils.combine_cats(','.join(incats), os.path.join(self.tmpdir.name, 'plain.fits'))
+        with mock.patch('despyfitsutils.compress.imap_ordered', side_effect=AssertionError('pool started')):
+            utils.combine_cats(','.join(incats), self.outcat, compress='RICE_1', nproc=2)
+        with open(self.outcat, 'rb') as fh1, open(os.path.join(self.tmpdir.name, 'plain.fits'), 'rb') as fh2:
+            self.assertEqual(fh1.read(), fh2.read())
+
+    def testStreamOnly(self):
+        with self.assertRaises(ValueError):
+            utils.combine_cats(','.join(self.incats), self.outcat, mode='astropy', compress='RICE_1')
@@ -0,0 +1,84 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+
+
+TESTDIR = os.path.dirname(__file__)
+SCRIPT = os.path.join(TESTDIR, '..', 'bin', 'edit_header.py')
+
+
+def load_script():
+    """Import bin/edit_header.py as a module.
+    """
+    spec = importlib.util.spec_from_file_location('edit_header', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class EditHeaderTest(unittest.TestCase):
+    """Tests for the edit_header.py script.
+    """
+
+    def setUp(self):
+        self.script = load_script()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.image = os.path.join(self.tmpdir.name, 'image.fits')
+        hdu = fits.PrimaryHDU(np.zeros((4, 5), dtype='f4'))
+        hdu.header['OBJECT'] = 'field'
+        hdu.writeto(self.image)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_script(self, *args):
+        proc = subprocess.run([sys.executable, SCRIPT] + list(args), stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        return proc.returncode, proc.stdout, proc.stderr
+
+    def testParseValue(self):
+        self.assertEqual(self.script.parse_value(' 12 '), 12)
+        self.assertEqual(self.script.parse_value('1.5e3'), 1500.0)
+        self.assertIs(self.script.parse_value('T'), True)
+        self.assertEqual(self.script.parse_value("'nan'"), 'nan')
+        for text in ('nan', 'NaN', 'inf', '-Infinity'):
+            with self.assertRaises(ValueError):
+                self.script.parse_value(text)
+
+    def testParseAssignment(self):
+        parse = self.script.parse_assignment
+        self.assertEqual(parse('EXPTIME=90 / seconds'), ('EXPTIME', 90, 'seconds'))
+        self.assertEqual(parse("OBJECT='a / b'"), ('OBJECT', 'a / b', None))
+        self.assertEqual(parse("OBJECT='a / b' / name / alias"), ('OBJECT', 'a / b', 'name / alias'))
+        self.assertEqual(parse('OBJECT="it\'s / x" / note'), ('OBJECT', "it's / x", 'note'))
+        with self.assertRaises(ValueError):
+            parse('OBJECT')
+
+    def testBuildEdits(self):
+        edits = self.script.build_edits('1', [('delete', 'A'), ('set', 'A=2 / new'), ('update', 'B=x')])
+        self.assertEqual([(e.action, e.keyword, e.value, e.comment) for e in edits],
+                         [('delete', 'A', None, None), ('set', 'A', 2, 'new'), ('update', 'B', 'x', None)])
+
+    def testCommandLineOrder(self):
+        status, _, err = self.run_script(self.image, '--delete', 'OBJECT', '--set', "OBJECT='a / b'",
+                                         '--set', 'EXPTIME=90', '--update', 'EXPTIME=30 / seconds')
+        self.assertEqual(status, 0, err)
+        hdr = fits.getheader(self.image)
+        self.assertEqual(hdr['OBJECT'], 'a / b')
+        self.assertEqual(hdr['EXPTIME'], 30)
+        self.assertEqual(hdr.comments['EXPTIME'], 'seconds')
+
+    def testNotFinite(self):
+        status, _, err = self.run_script(self.image, '--set', 'EXPTIME=nan')
+        self.assertNotEqual(status, 0)
+        self.assertIn('nan', err)
+        self.assertNotIn('EXPTIME', fits.getheader(self.image))
+
+
+if __name__ == '__main__':
+    unittest.main()
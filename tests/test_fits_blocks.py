@@ -0,0 +1,245 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.fits_blocks as blocks
+import despyfitsutils.instrument as instrument
+
+
+TESTDIR = os.path.dirname(__file__)
+
+
+def make_mef(filename):
+    """Write a small MEF with image, tile-compressed and table HDUs.
+    """
+    phdu = fits.PrimaryHDU()
+    phdu.header['FILTER'] = 'g DECam SDSS c0001 4720.0 1520.0'
+    phdu.header['LONGSTR'] = 'x' * 150
+    sci = fits.ImageHDU(np.ones((5, 7), dtype='i2'), name='SCI')
+    wgt = fits.CompImageHDU(np.arange(600, dtype='f4').reshape(20, 30), name='WGT')
+    cat = fits.BinTableHDU.from_columns([fits.Column('A', 'E', array=np.arange(13.))],
+                                        name='LDAC_OBJECTS')
+    fits.HDUList([phdu, sci, wgt, cat]).writeto(filename, overwrite=True)
+
+
+class IterHdusTest(unittest.TestCase):
+    """Tests for iter_hdus() and find_hdu() functions.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        make_mef(self.mef)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testExtents(self):
+        infos = list(blocks.iter_hdus(self.mef))
+        self.assertEqual([i.name for i in infos], ['PRIMARY', 'SCI', 'WGT', 'LDAC_OBJECTS'])
+        self.assertEqual(infos[1].data_size, 5 * 7 * 2)
+        self.assertEqual(blocks.hdu_end(infos[-1]), os.path.getsize(self.mef))
+        with fits.open(self.mef) as hdulist:
+            for info, hdu in zip(infos, hdulist):
+                offsets = hdu.fileinfo()
+                self.assertEqual(info.header_offset, offsets['hdrLoc'])
+                self.assertEqual(info.data_offset, offsets['datLoc'])
+
+    def testFindHdu(self):
+        self.assertEqual(blocks.find_hdu(self.mef).index, 0)
+        self.assertEqual(blocks.find_hdu(self.mef, 'sci').index, 1)
+        self.assertEqual(blocks.find_hdu(self.mef, '2').name, 'WGT')
+        self.assertEqual(blocks.find_hdu(self.mef, -1).name, 'LDAC_OBJECTS')
+        with self.assertRaises(KeyError):
+            blocks.find_hdu(self.mef, 'MSK')
+        with self.assertRaises(IndexError):
+            blocks.find_hdu(self.mef, 9)
+
+    def testNotFits(self):
+        notfits = os.path.join(self.tmpdir.name, 'notfits.txt')
+        with open(notfits, 'w') as fh:
+            fh.write('x' * 3000)
+        with self.assertRaises(ValueError):
+            list(blocks.iter_hdus(notfits))
+
+
+class RawValuesTest(unittest.TestCase):
+    """Tests for get_raw_hdr_values() and get_raw_hdr() functions.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        make_mef(self.mef)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testMatchesAstropy(self):
+        with fits.open(self.mef) as hdulist:
+            for whichhdu in range(len(hdulist)):
+                hdr = hdulist[whichhdu].header
+                keys = [k for k in hdr.keys() if blocks.is_simple_keyword(k)]
+                vals = blocks.get_raw_hdr_values(self.mef, keys, whichhdu)
+                for key in keys:
+                    self.assertEqual(vals[key], hdr[key])
+                raw = blocks.get_raw_hdr(self.mef, whichhdu)
+                self.assertEqual(list(raw.items()), list(hdr.items()))
+
+    def testCompressedHidesTableKeywords(self):
+        vals = blocks.get_raw_hdr_values(self.mef, ['NAXIS1', 'NAXIS2', 'BITPIX'], 'WGT')
+        self.assertEqual(vals, {'NAXIS1': 30, 'NAXIS2': 20, 'BITPIX': -32})
+        for key in ['ZIMAGE', 'TTYPE1', 'TFIELDS']:
+            with self.assertRaises(KeyError):
+                blocks.get_raw_hdr_values(self.mef, [key], 'WGT')
+
+    def testLongString(self):
+        vals = blocks.get_raw_hdr_values(self.mef, ['LONGSTR'])
+        self.assertEqual(vals['LONGSTR'], 'x' * 150)
+
+    def testMissingKey(self):
+        with self.assertRaises(KeyError):
+            blocks.get_raw_hdr_values(self.mef, ['NOTAKEY'])
+
+    def testInputFile(self):
+        vals = blocks.get_raw_hdr_values(os.path.join(TESTDIR, 'data/input.fits.fz'),
+                                         ['NAXIS2', 'FILTER'])
+        self.assertEqual(vals['NAXIS2'], 3)
+        self.assertTrue(vals['FILTER'].startswith('g'))
+
+
+class HeaderEditTest(unittest.TestCase):
+    """Tests for merge_cards(), last_mandatory_keyword() and fit_header() functions.
+    """
+
+    def setUp(self):
+        hdr = fits.Header()
+        hdr['SIMPLE'] = True
+        hdr['BITPIX'] = 8
+        hdr['NAXIS'] = 0
+        hdr['CRVAL1'] = 1.0
+        self.header = hdr.tostring().encode('ascii')
+
+    def testMerge(self):
+        cards = [fits.Card('CRVAL1', 2.0), fits.Card('HISTORY', 'merged'),
+                 fits.Card('NAXIS', 3), fits.Card('NEWKEY', 'x')]
+        hdr = fits.Header.fromstring(blocks.merge_cards(self.header, cards).decode('ascii'))
+        self.assertEqual(list(hdr.keys()), ['SIMPLE', 'BITPIX', 'NAXIS', 'CRVAL1', 'HISTORY', 'NEWKEY'])
+        self.assertEqual(hdr['CRVAL1'], 2.0)
+        self.assertEqual(hdr['NAXIS'], 0)
+
+    def testLastMandatory(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        mef = os.path.join(tmpdir.name, 'mef.fits')
+        make_mef(mef)
+        keywords = [blocks.last_mandatory_keyword(info.header) for info in blocks.iter_hdus(mef)]
+        self.assertEqual(keywords, ['EXTEND', 'GCOUNT', 'ZNAXIS2', 'TFIELDS'])
+        self.assertEqual(blocks.last_mandatory_keyword(self.header), 'NAXIS')
+        image = fits.PrimaryHDU(np.zeros(3, dtype='i2')).header.tostring().encode('ascii')
+        self.assertEqual(blocks.last_mandatory_keyword(blocks.primary_to_extension(image)), 'GCOUNT')
+
+    def testFit(self):
+        self.assertIsNone(blocks.fit_header(self.header, 0))
+        fitted = blocks.fit_header(self.header, 2 * blocks.BLOCK_SIZE)
+        self.assertEqual(len(fitted), 2 * blocks.BLOCK_SIZE)
+        self.assertEqual(fits.Header.fromstring(fitted.decode('ascii'))['CRVAL1'], 1.0)
+
+
+class RewriteHeadersTest(unittest.TestCase):
+    """Tests for rewrite_headers() function.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'mef.fits')
+        make_mef(self.filename)
+        self.infos = list(blocks.iter_hdus(self.filename))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def grow(self, index, ncards):
+        cards = blocks.header_cards(self.infos[index].header)
+        cards += [blocks.make_card('KEY%d' % k, k) for k in range(ncards)]
+        return blocks.build_header(cards)
+
+    def check(self, nsci, ncat):
+        with fits.open(self.filename) as hdulist:
+            self.assertEqual(hdulist['SCI'].header['KEY%d' % (nsci - 1)], nsci - 1)
+            self.assertEqual(hdulist['LDAC_OBJECTS'].header['KEY%d' % (ncat - 1)], ncat - 1)
+            self.assertEqual(hdulist[0].header['LONGSTR'], 'x' * 150)
+            self.assertTrue((hdulist['SCI'].data == 1).all())
+            self.assertTrue((hdulist['WGT'].data == np.arange(600).reshape(20, 30)).all())
+            self.assertTrue((hdulist['LDAC_OBJECTS'].data['A'] == np.arange(13.)).all())
+
+    def testInPlace(self):
+        size = os.path.getsize(self.filename)
+        self.assertTrue(blocks.rewrite_headers(self.filename, {1: self.grow(1, 2), 3: self.grow(3, 2)}))
+        self.assertEqual(os.path.getsize(self.filename), size)
+        self.check(2, 2)
+
+    def testFallback(self):
+        for fallback in ('rewrite', 'shift'):
+            make_mef(self.filename)
+            size = os.path.getsize(self.filename)
+            self.assertFalse(blocks.rewrite_headers(self.filename, {1: self.grow(1, 40), 3: self.grow(3, 80)},
+                                                    fallback))
+            self.assertEqual(os.path.getsize(self.filename), size + 3 * blocks.BLOCK_SIZE)
+            self.check(40, 80)
+        with self.assertRaises(ValueError):
+            blocks.rewrite_headers(self.filename, {1: self.grow(1, 2)}, 'copy')
+
+    def testShiftMovesTail(self):
+        # only the data of the last HDU are moved, and its new header written
+        last = self.infos[-1]
+        header = self.grow(last.index, 80)
+        with instrument.collect() as report:
+            blocks.rewrite_headers(self.filename, {last.index: header}, 'shift')
+        self.assertEqual(report.counters['bytes_written'], blocks.padded_size(last.data_size) + len(header))
+        with fits.open(self.filename) as hdulist:
+            self.assertEqual(hdulist[-1].header['KEY79'], 79)
+            self.assertTrue((hdulist[-1].data['A'] == np.arange(13.)).all())
+
+
+class ChecksumTest(unittest.TestCase):
+    """Tests for the ones' complement sums behind CHECKSUM and DATASUM.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmpdir.name, 'image.fits')
+        rng = np.random.default_rng(0)
+        fits.PrimaryHDU(rng.integers(-2**31, 2**31, 1001).astype('i4')).writeto(self.fname, checksum=True)
+        self.info = blocks.find_hdu(self.fname)
+        with open(self.fname, 'rb') as fh:
+            fh.seek(self.info.data_offset)
+            self.data = fh.read()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testMatchesAstropy(self):
+        datasum = blocks.ones_sum(self.data)
+        vals = blocks.values_from_info(self.info, ['DATASUM', 'CHECKSUM'])
+        self.assertEqual(vals['DATASUM'], str(datasum))
+        header = blocks.checksum_header(self.info.header, datasum)
+        self.assertEqual(len(header), len(self.info.header))
+        self.assertEqual(blocks.get_cards(self.info._replace(header=header), ['CHECKSUM'])['CHECKSUM'].value,
+                         vals['CHECKSUM'])
+
+    def testStreaming(self):
+        datasum = blocks.OnesSum()
+        for i in range(0, len(self.data), 7):
+            datasum.update(self.data[i:i + 7])
+        self.assertEqual(datasum.digest(), blocks.ones_sum(self.data))
+
+    def testRefresh(self):
+        edited = blocks.set_card(self.info.header, 'OBJECT', 'edited')
+        header = blocks.refresh_checksum(edited)
+        total = blocks.ones_sum(header) + blocks.ones_sum(self.data)
+        self.assertEqual(blocks._fold(total), 0xffffffff)
+        # without DATASUM the stale CHECKSUM is dropped
+        header = blocks.refresh_checksum(blocks.delete_card(edited, 'DATASUM'))
+        self.assertNotIn('CHECKSUM', blocks.card_offsets(header))
@@ -1,6 +1,8 @@
 import math
 import os
 import unittest
+import numpy as np
+import despymisc.create_special_metadata as spmeta
 import despyfitsutils.fits_special_metadata as meta
 
 
@@ -190,3 +192,86 @@ class FuncTdecdegTest(unittest.TestCase):
     def testFileMissing(self):
         with self.assertRaises(FileNotFoundError):
             x = meta.func_tdecdeg(self.invalid)
+
+
+class GetSpecialMetadataTest(unittest.TestCase):
+    """Test for get_special_metadata() function.
+    """
+
+    def setUp(self):
+        self.valid = os.path.join(TESTDIR, 'data/input.fits.fz')
+        self.invalid = os.path.join(TESTDIR, 'data/notafile.fits.fz')
+        self.keys = ['band', 'camsym', 'nite', 'objects', 'radeg', 'tradeg', 'decdeg', 'tdecdeg']
+
+    def tearDown(self):
+        pass
+
+    def testMatchesFuncs(self):
+        vals = meta.get_special_metadata(self.valid, self.keys)
+        self.assertEqual(sorted(vals.keys()), sorted(self.keys))
+        for key in self.keys:
+            func = getattr(meta, 'func_%s' % key)
+            self.assertEqual(vals[key], func(self.valid))
+
+    def testIgnoreErrors(self):
+        vals = meta.get_special_metadata(self.valid, ['band', 'field'], errors='ignore')
+        self.assertEqual(vals['band'], 'g')
+        self.assertNotIn('field', vals)
+
+    def testUnknownKey(self):
+        with self.assertRaises(KeyError):
+            meta.get_special_metadata(self.valid, ['notakey'])
+
+    def testFileMissing(self):
+        with self.assertRaises(FileNotFoundError):
+            meta.get_special_metadata(self.invalid, self.keys)
+
+
+class BatchConvertersTest(unittest.TestCase):
+    """Tests for the batch_*() converters.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        nvals = 2000
+        hours, mins, days = rng.integers(0, 24, nvals), rng.integers(0, 60, nvals), rng.integers(1, 29, nvals)
+        secs = rng.integers(0, 60000, nvals) / 1000.0
+        degs = rng.integers(-89, 90, nvals)
+        self.ra = ['%02d:%02d:%06.3f' % v for v in zip(hours, mins, secs)] + ['150.1234567', '00:00:00.0']
+        self.dec = ['%+03d:%02d:%05.2f' % v for v in zip(degs, mins, secs)] + \
+            ['-00:30:00.00', '-12.5', ' 05:00:00.01']
+        self.dates = ['2024-02-%02dT%02d:%02d:%06.3f' % v for v in zip(days, hours, mins, secs)] + \
+            ['2024-03-01T14:00:00', '2024-01-01T13:59:59.9']
+        self.filters = ['r DECam SDSS c0002 6415.0 1480.0', 'g DECam SDSS c0001 4720.0 1520.0',
+                        'Y DECam c0005 10095.0 1130.0'] * 100
+
+    def tearDown(self):
+        pass
+
+    def testRadeg(self):
+        self.assertEqual(meta.batch_radeg(self.ra).tolist(), [spmeta.convert_ra_to_deg(v) for v in self.ra])
+        self.assertEqual(meta.batch_tradeg(np.array(self.ra)).tolist(),
+                         [spmeta.convert_ra_to_deg(v) for v in self.ra])
+
+    def testDecdeg(self):
+        self.assertEqual(meta.batch_decdeg(self.dec).tolist(), [spmeta.convert_dec_to_deg(v) for v in self.dec])
+        self.assertEqual(meta.batch_tdecdeg(np.array([1.5, -2.25])).tolist(), [1.5, -2.25])
+
+    def testNite(self):
+        self.assertEqual(meta.batch_nite(self.dates).tolist(), [spmeta.create_nite(v) for v in self.dates])
+
+    def testBand(self):
+        self.assertEqual(meta.batch_band(self.filters).tolist(), [spmeta.create_band(v) for v in self.filters])
+        with self.assertRaises(KeyError):
+            meta.batch_band(['x DECam'])
+
+    def testInvalid(self):
+        with self.assertRaises(ValueError):
+            meta.batch_radeg(['12:30'])
+        # a value with too many fields cannot make up for a short one
+        with self.assertRaises(ValueError):
+            meta.batch_radeg(['1:2:3:4', '5:6'])
+        with self.assertRaises(ValueError):
+            meta.batch_decdeg(['10:20', '30:40:50:1'])
+        with self.assertRaises(ValueError):
+            meta.batch_radeg(['1::3', '1 2:3:4'])
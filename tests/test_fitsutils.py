@@ -1,11 +1,40 @@
+import json
 import os
+import tempfile
 import unittest
+from unittest import mock
+import numpy as np
+from astropy.io import fits
 import despyfitsutils.fitsutils as utils
+import despyfitsutils.fits_blocks as blocks
+import despyfitsutils.checksums as checksums
+import despyfitsutils.instrument as instrument
+import despyfitsutils.preflight as preflight
 
 
 TESTDIR = os.path.dirname(__file__)
 
 
+def make_ldac_cat(filename, nrows=10, seed=0):
+    """Write a small LDAC-like catalog with Primary, LDAC_IMHEAD and LDAC_OBJECTS HDUs.
+    """
+    rng = np.random.default_rng(seed)
+    hdr = fits.Header()
+    hdr['OBJECT'] = 'hex  -1 +2 tiling 10'
+    text = hdr.tostring()
+    cards = [text[i:i + 80] for i in range(0, len(text), 80) if text[i:i + 80].strip()]
+    col = fits.Column('Field Header Card', format='%dA' % (80 * len(cards)),
+                      dim='(80, %d)' % len(cards), array=[cards])
+    imhead = fits.BinTableHDU.from_columns([col], name='LDAC_IMHEAD')
+    objects = fits.BinTableHDU.from_columns([
+        fits.Column('NUMBER', 'J', array=np.arange(nrows)),
+        fits.Column('MAG_AUTO', 'E', unit='mag', array=rng.random(nrows)),
+        fits.Column('FLAGS', 'I', array=rng.integers(0, 4, nrows)),
+        fits.Column('VIGNET', '4E', dim='(2,2)', array=rng.random((nrows, 2, 2)))],
+        name='LDAC_OBJECTS')
+    fits.HDUList([fits.PrimaryHDU(), imhead, objects]).writeto(filename, overwrite=True)
+
+
 class MefTest(unittest.TestCase):
     """Tests for a MEF object.
     """
@@ -32,3 +61,734 @@ class MefTest(unittest.TestCase):
     def testWrite(self):
         self.mef.write()
         self.assertTrue(os.path.isfile(self.mef.outname))
+
+
+class MefStreamTest(unittest.TestCase):
+    """Tests for the streaming MEF writer.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.inputs = []
+        rng = np.random.default_rng(0)
+        data = [rng.random((20, 30)).astype('f4'),
+                rng.integers(0, 60000, (20, 30)).astype('uint16'),
+                rng.integers(0, 100, (20, 30)).astype('i4')]
+        for k, d in enumerate(data):
+            fname = os.path.join(self.tmpdir.name, 'ccd%d.fits' % k)
+            fits.PrimaryHDU(d).writeto(fname)
+            self.inputs.append(fname)
+        self.extnames = ['SCI', 'MSK', 'WGT']
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testMatchesReadWrite(self):
+        legacy = os.path.join(self.tmpdir.name, 'legacy.fits')
+        streamed = os.path.join(self.tmpdir.name, 'streamed.fits')
+        utils.makeMEF(filenames=self.inputs, outname=legacy, extnames=self.extnames, stream=False)
+        utils.makeMEF(filenames=self.inputs, outname=streamed, extnames=self.extnames,
+                      max_memory=1000)
+        with open(legacy, 'rb') as fh1, open(streamed, 'rb') as fh2:
+            self.assertEqual(fh1.read(), fh2.read())
+        with fits.open(streamed) as hdulist:
+            self.assertEqual(hdulist['MSK'].header['DES_EXT'], 'MASK')
+
+    def testScaledInputs(self):
+        # BSCALE/BZERO/BLANK int16 images (scaled to float when read) and uint16
+        inputs = []
+        for k, (bscale, bzero, blank) in enumerate([(2.0, 10.0, -32768), (0.5, 3.0, -1)]):
+            hdu = fits.PrimaryHDU(np.arange(600, dtype='i2').reshape(20, 30) - 300 * k)
+            hdu.header['BSCALE'] = bscale
+            hdu.header['BZERO'] = bzero
+            hdu.header['BLANK'] = blank
+            inputs.append(os.path.join(self.tmpdir.name, 'scaled%d.fits' % k))
+            hdu.writeto(inputs[-1])
+        inputs.append(self.inputs[1])
+        for extnames in (None, self.extnames):
+            legacy = os.path.join(self.tmpdir.name, 'legacy.fits')
+            streamed = os.path.join(self.tmpdir.name, 'streamed.fits')
+            utils.makeMEF(filenames=inputs, outname=legacy, extnames=extnames, stream=False, clobber=True)
+            utils.makeMEF(filenames=inputs, outname=streamed, extnames=extnames, clobber=True)
+            with open(legacy, 'rb') as fh1, open(streamed, 'rb') as fh2:
+                self.assertEqual(fh1.read(), fh2.read(), extnames)
+
+    def testMissingInput(self):
+        output = os.path.join(self.tmpdir.name, 'out.fits')
+        with self.assertRaises(FileNotFoundError):
+            utils.makeMEF(filenames=self.inputs + ['notafile.fits'], outname=output)
+        self.assertFalse(os.path.exists(output))
+        with self.assertRaises(preflight.PreflightError):
+            utils.makeMEF(filenames=self.inputs + ['notafile.fits'], outname=output, preflight=True)
+        self.assertFalse(os.path.exists(output))
+
+    def testPreflight(self):
+        output = os.path.join(self.tmpdir.name, 'out.fits')
+        fits.PrimaryHDU(np.zeros((20, 31), dtype='f4')).writeto(self.inputs[2], overwrite=True)
+        with open(self.inputs[1], 'r+b') as fh:
+            fh.truncate(4000)
+        with self.assertRaises(preflight.PreflightError) as ctx:
+            utils.makeMEF(filenames=self.inputs + ['notafile.fits', self.inputs[0]], outname=output,
+                          extnames=self.extnames + ['SCI', 'SCI'], preflight=True)
+        # every problem at once, and no output
+        problems = ctx.exception.problems
+        self.assertEqual(len(problems), 4)
+        self.assertIn('extension name SCI used 3 times', problems)
+        self.assertTrue(problems[1].startswith(self.inputs[1] + ': truncated'))
+        self.assertEqual(problems[2], 'notafile.fits: file not found')
+        self.assertIn('(20, 31) differs from (20, 30)', problems[3])
+        self.assertFalse(os.path.exists(output))
+
+    def testChecksum(self):
+        for k, stream in enumerate((True, False)):
+            output = os.path.join(self.tmpdir.name, 'mef%d.fits' % k)
+            utils.makeMEF(filenames=self.inputs, outname=output, stream=stream, checksum=True)
+            self.assertEqual(checksums.check_file(output)[1], '')
+
+    def testExtnamesMismatch(self):
+        output = os.path.join(self.tmpdir.name, 'out.fits')
+        with self.assertRaises(SystemExit):
+            utils.makeMEF(filenames=self.inputs, outname=output, extnames=['SCI'])
+        self.assertFalse(os.path.exists(output))
+
+
+class GetHdrTest(unittest.TestCase):
+    """Tests for get_hdr() and get_hdr_value() given file names.
+    """
+
+    def setUp(self):
+        self.valid = os.path.join(TESTDIR, 'data/input.fits.fz')
+        self.invalid = os.path.join(TESTDIR, 'data/notafile.fits.fz')
+
+    def tearDown(self):
+        pass
+
+    def testMatchesHdulist(self):
+        with fits.open(self.valid) as hdulist:
+            hdr = utils.get_hdr(hdulist, None)
+            self.assertEqual(list(utils.get_hdr(self.valid, None).items()), list(hdr.items()))
+            for key in ['NAXIS2', 'FILTER', 'DATE-OBS']:
+                self.assertEqual(utils.get_hdr_value(self.valid, key),
+                                 utils.get_hdr_value(hdulist, key))
+
+    def testGetHdrValues(self):
+        vals = utils.get_hdr_values(self.valid, ['naxis1', 'naxis2'])
+        self.assertEqual(vals, {'NAXIS1': 3, 'NAXIS2': 3})
+
+    def testMissingKey(self):
+        with self.assertRaises(KeyError):
+            utils.get_hdr_value(self.valid, 'NOTAKEY')
+
+    def testFileMissing(self):
+        with self.assertRaises(FileNotFoundError):
+            utils.get_hdr_value(self.invalid, 'NAXIS2')
+
+
+class HeaderCacheTest(unittest.TestCase):
+    """Tests for the header cache behind get_hdr().
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmpdir.name, 'image.fits')
+        self.write(1)
+        utils.enable_header_cache(max_entries=2)
+
+    def tearDown(self):
+        utils.disable_header_cache()
+        self.tmpdir.cleanup()
+
+    def write(self, value):
+        hdu = fits.PrimaryHDU()
+        hdu.header['VALUE'] = value
+        hdu.writeto(self.fname, overwrite=True)
+
+    def testHits(self):
+        self.assertEqual(utils.get_hdr_value(self.fname, 'VALUE'), 1)
+        self.assertEqual(utils.get_hdr(self.fname, None)['VALUE'], 1)
+        stats = utils.header_cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def testParsedOnce(self):
+        with instrument.collect() as report:
+            for _ in range(3):
+                hdr = utils.get_hdr(self.fname, None)
+                self.assertEqual(hdr['VALUE'], 1)
+                self.assertEqual(utils.get_hdr_value(self.fname, 'VALUE'), 1)
+                # callers get their own copy
+                hdr['VALUE'] = 99
+        # the raw header read on the first miss, then one astropy parse
+        self.assertEqual(report.counters['header_parses'], 2)
+        self.assertEqual(utils.header_cache_stats()['hits'], 5)
+
+    def testModifiedFile(self):
+        self.assertEqual(utils.get_hdr_value(self.fname, 'VALUE'), 1)
+        self.write(22)
+        st = os.stat(self.fname)
+        os.utime(self.fname, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+        self.assertEqual(utils.get_hdr_value(self.fname, 'VALUE'), 22)
+
+    def testEviction(self):
+        for whichhdu in [0, 'Primary', -1]:
+            utils.get_hdr_value(self.fname, 'VALUE', whichhdu)
+        stats = utils.header_cache_stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 1)
+
+    def testInvalidate(self):
+        utils.get_hdr_value(self.fname, 'VALUE')
+        utils.invalidate_header_cache(self.fname)
+        self.assertEqual(utils.header_cache_stats()['entries'], 0)
+        utils.disable_header_cache()
+        self.assertIsNone(utils.header_cache_stats())
+
+
+class LdacImheadTest(unittest.TestCase):
+    """Tests for get_ldac_imhead_as_hdr() function.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmpdir.name, 'cat.fits')
+        hdr = fits.Header()
+        hdr['OBJECT'] = 'hex  -1 +2 tiling 10'
+        hdr['LONGSTR'] = 'y' * 100
+        hdr['HISTORY'] = 'made by a test'
+        text = hdr.tostring()
+        cards = [text[i:i + 80] for i in range(0, len(text), 80) if text[i:i + 80].strip()]
+        col = fits.Column('Field Header Card', format='%dA' % (80 * len(cards)),
+                          dim='(80, %d)' % len(cards), array=[cards])
+        imhead = fits.BinTableHDU.from_columns([col], name='LDAC_IMHEAD')
+        fits.HDUList([fits.PrimaryHDU(), imhead]).writeto(self.fname)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testHeader(self):
+        with fits.open(self.fname) as hdulist:
+            hdr = utils.get_hdr(hdulist, 'LDAC_IMHEAD')
+            self.assertEqual(hdr['OBJECT'], 'hex  -1 +2 tiling 10')
+            self.assertEqual(hdr['LONGSTR'], 'y' * 100)
+            self.assertEqual(len(utils.get_ldac_imhead_as_cardlist(hdulist['LDAC_IMHEAD'])), 3)
+
+    def testMemoized(self):
+        with fits.open(self.fname) as hdulist:
+            with instrument.collect() as report:
+                hdr = utils.get_hdr(hdulist, 'LDAC_IMHEAD')
+                hdr['OBJECT'] = 'changed'
+                del hdr['LONGSTR']
+                self.assertEqual(utils.get_hdr(hdulist, 'ldac_imhead')['OBJECT'], 'hex  -1 +2 tiling 10')
+                cards = utils.get_ldac_imhead_as_cardlist(hdulist['LDAC_IMHEAD'])
+                cards[0].value = 'changed'
+                self.assertEqual(len(utils.get_ldac_imhead_as_cardlist(hdulist['LDAC_IMHEAD'])), 3)
+                self.assertEqual(utils.get_hdr_value(hdulist, 'OBJECT', 'LDAC_IMHEAD'), 'hex  -1 +2 tiling 10')
+            self.assertEqual(report.counters['header_parses'], 1)
+
+    def testFromFile(self):
+        self.assertEqual(utils.get_hdr_value(self.fname, 'OBJECT', 'LDAC_IMHEAD'),
+                         'hex  -1 +2 tiling 10')
+
+
+class CombineCatsTest(unittest.TestCase):
+    """Tests for combine_cats() function.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.incats = []
+        for k in range(3):
+            incat = os.path.join(self.tmpdir.name, 'cat%d.fits' % k)
+            make_ldac_cat(incat, nrows=10 + 50 * k, seed=k)
+            self.incats.append(incat)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testStreamMatchesAstropy(self):
+        stream = os.path.join(self.tmpdir.name, 'stream.fits')
+        astro = os.path.join(self.tmpdir.name, 'astropy.fits')
+        utils.combine_cats(','.join(self.incats), stream)
+        utils.combine_cats(','.join(self.incats), astro, mode='astropy')
+        with open(stream, 'rb') as fh1, open(astro, 'rb') as fh2:
+            self.assertEqual(fh1.read(), fh2.read())
+        with fits.open(stream) as hdulist:
+            self.assertEqual(len(hdulist), 9)
+            self.assertEqual(hdulist[8].header['NAXIS2'], 110)
+
+    def testNoCompressPool(self):
+        outcat = os.path.join(self.tmpdir.name, 'out.fits')
+        with mock.patch('despyfitsutils.compress.imap_ordered', side_effect=AssertionError('pool started')):
+            utils.combine_cats(','.join(self.incats), outcat, nproc=2)
+        with fits.open(outcat) as hdulist:
+            self.assertEqual(len(hdulist), 9)
+
+    def testTooFewHdus(self):
+        short = os.path.join(self.tmpdir.name, 'short.fits')
+        fits.PrimaryHDU().writeto(short)
+        with self.assertRaises(IndexError):
+            utils.combine_cats(short, os.path.join(self.tmpdir.name, 'out.fits'))
+        with self.assertRaises(preflight.PreflightError):
+            utils.combine_cats(short, os.path.join(self.tmpdir.name, 'out.fits'), preflight=True)
+
+    def testPreflight(self):
+        outcat = os.path.join(self.tmpdir.name, 'out.fits')
+        info = blocks.find_hdu(self.incats[0], 2)
+        with open(self.incats[0], 'r+b') as fh:
+            fh.truncate(info.data_offset + 100)
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(name='LDAC_IMHEAD'),
+                      fits.ImageHDU(name='OBJECTS')]).writeto(self.incats[1], overwrite=True)
+        with self.assertRaises(preflight.PreflightError) as ctx:
+            utils.combine_cats(','.join(self.incats + ['missing.fits']), outcat, nproc=2, preflight=True)
+        self.assertEqual(ctx.exception.problems, [
+            "%s: truncated in HDU 2 (%d bytes missing)" % (self.incats[0], info.data_size - 100),
+            "%s: HDU 2 is 'OBJECTS', expected LDAC_OBJECTS" % self.incats[1],
+            "%s: LDAC_OBJECTS is not a binary table" % self.incats[1],
+            "missing.fits: file not found"])
+        self.assertFalse(os.path.exists(outcat))
+
+    def testPreflightSchema(self):
+        outcat = os.path.join(self.tmpdir.name, 'out.fits')
+        # a TFORM which does not add up to NAXIS1
+        info = blocks.find_hdu(self.incats[1], 2)
+        header = blocks.set_card(info.header, 'TFORM3', '2I')
+        with open(self.incats[1], 'r+b') as fh:
+            fh.seek(info.header_offset)
+            fh.write(header)
+        # another column set, and a column of another type
+        objects = fits.BinTableHDU.from_columns([
+            fits.Column('NUMBER', 'K', array=np.arange(5)),
+            fits.Column('MAG_AUTO', 'E', unit='mag', array=np.zeros(5)),
+            fits.Column('FLUX_AUTO', 'E', array=np.zeros(5))], name='LDAC_OBJECTS')
+        with fits.open(self.incats[2]) as hdulist:
+            fits.HDUList([hdulist[0], hdulist[1], objects]).writeto(self.incats[2], overwrite=True)
+
+        with self.assertRaises(preflight.PreflightError) as ctx:
+            utils.combine_cats(','.join(self.incats), outcat, mode='merge', preflight=True)
+        self.assertEqual(ctx.exception.problems, [
+            "%s: LDAC_OBJECTS: Columns take 28 bytes but NAXIS1 = 26" % self.incats[1],
+            "%s: extra column FLUX_AUTO" % self.incats[2],
+            "%s: column NUMBER has TFORM 1K, expected 1J as in %s" % (self.incats[2], self.incats[0]),
+            "%s: missing column FLAGS" % self.incats[2],
+            "%s: missing column VIGNET" % self.incats[2]])
+        # the column set only matters for the columns merged
+        with self.assertRaises(preflight.PreflightError) as ctx:
+            utils.combine_cats(','.join(self.incats), outcat, mode='merge', columns='mag_auto', preflight=True)
+        self.assertEqual(len(ctx.exception.problems), 1)
+        # and not at all when the tables are not merged
+        with self.assertRaises(preflight.PreflightError) as ctx:
+            utils.combine_cats(','.join(self.incats), outcat, preflight=True)
+        self.assertEqual(len(ctx.exception.problems), 1)
+        self.assertFalse(os.path.exists(outcat))
+
+    def testChecksum(self):
+        for mode in ('stream', 'astropy', 'merge'):
+            outcat = os.path.join(self.tmpdir.name, '%s.fits' % mode)
+            utils.combine_cats(','.join(self.incats), outcat, mode=mode, checksum=True)
+            results = checksums.verify_file(outcat)
+            self.assertEqual(len(results), 3 if mode == 'merge' else 9)
+            for res in results:
+                self.assertEqual((res.datasum, res.checksum), (True, True), (mode, res))
+
+
+class CombineCatsMergeTest(unittest.TestCase):
+    """Tests for combine_cats(mode='merge').
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.incats = []
+        for k in range(3):
+            incat = os.path.join(self.tmpdir.name, 'cat%d.fits' % k)
+            make_ldac_cat(incat, nrows=10 + 50 * k, seed=k)
+            self.incats.append(incat)
+        self.outcat = os.path.join(self.tmpdir.name, 'merged.fits')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def expected(self, name):
+        arrays = []
+        for incat in self.incats:
+            with fits.open(incat) as hdulist:
+                arrays.append(hdulist['LDAC_OBJECTS'].data[name])
+        return np.concatenate(arrays)
+
+    def testMerge(self):
+        # a small chunk size so that chunks straddle the inputs
+        utils.combine_cats(','.join(self.incats), self.outcat, mode='merge', chunk_rows=7)
+        with fits.open(self.outcat) as hdulist:
+            self.assertEqual([hdu.name for hdu in hdulist], ['PRIMARY', 'LDAC_OBJECTS', 'CATALOGS'])
+            data = hdulist['LDAC_OBJECTS'].data
+            self.assertEqual(len(data), 180)
+            for name in ('NUMBER', 'MAG_AUTO', 'FLAGS', 'VIGNET'):
+                np.testing.assert_array_equal(data[name], self.expected(name))
+            self.assertEqual(data['VIGNET'].shape, (180, 2, 2))
+            self.assertEqual(hdulist['LDAC_OBJECTS'].columns['MAG_AUTO'].unit, 'mag')
+            np.testing.assert_array_equal(data['CAT_INDEX'], np.repeat([0, 1, 2], [10, 60, 110]))
+            self.assertEqual(list(hdulist['CATALOGS'].data['FILENAME']), self.incats)
+            hdulist.verify('exception')
+
+    def testColumns(self):
+        utils.combine_cats(','.join(self.incats), self.outcat, mode='merge', columns='FLAGS, mag_auto')
+        with fits.open(self.outcat) as hdulist:
+            data = hdulist['LDAC_OBJECTS'].data
+            self.assertEqual(data.names, ['FLAGS', 'MAG_AUTO', 'CAT_INDEX'])
+            np.testing.assert_array_equal(data['MAG_AUTO'], self.expected('MAG_AUTO'))
+            np.testing.assert_array_equal(data['FLAGS'], self.expected('FLAGS'))
+
+    def testSchemaMismatch(self):
+        with fits.open(self.incats[1], mode='update') as hdulist:
+            hdulist['LDAC_OBJECTS'] = fits.BinTableHDU.from_columns([
+                fits.Column('NUMBER', 'J', array=np.arange(3)),
+                fits.Column('MAG_AUTO', 'D', array=np.zeros(3))], name='LDAC_OBJECTS')
+        with self.assertRaises(ValueError) as ctx:
+            utils.combine_cats(','.join(self.incats), self.outcat, mode='merge', columns='MAG_AUTO,FLAGS,NOPE')
+        # every problem is reported and nothing is written
+        message = str(ctx.exception)
+        self.assertIn('MAG_AUTO has TFORM 1D', message)
+        self.assertIn('missing column FLAGS', message)
+        self.assertIn('no column NOPE', message)
+        self.assertFalse(os.path.exists(self.outcat))
+
+        # the selected columns match
+        utils.combine_cats(','.join(self.incats), self.outcat, mode='merge', columns='NUMBER')
+        with fits.open(self.outcat) as hdulist:
+            self.assertEqual(len(hdulist['LDAC_OBJECTS'].data), 123)
+
+    def testTableColumns(self):
+        info = blocks.find_hdu(self.incats[0], 'LDAC_OBJECTS')
+        cols = blocks.table_columns(info)
+        self.assertEqual([(c.name, c.tform, c.offset, c.width) for c in cols],
+                         [('NUMBER', '1J', 0, 4), ('MAG_AUTO', '1E', 4, 4), ('FLAGS', '1I', 8, 2),
+                          ('VIGNET', '4E', 10, 16)])
+        self.assertEqual(cols[3].values['TDIM'], '(2,2)')
+        with self.assertRaises(ValueError):
+            blocks.table_columns(blocks.find_hdu(self.incats[0], 0))
+
+
+class MefPassthroughTest(unittest.TestCase):
+    """Tests for makeMEF pass-through of tile-compressed inputs.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.inputs = []
+        self.data = []
+        for k in range(2):
+            data = rng.integers(0, 1000, (20, 30)).astype('i4')
+            fname = os.path.join(self.tmpdir.name, 'ccd%d.fits.fz' % k)
+            fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(data)]).writeto(fname)
+            self.inputs.append(fname)
+            self.data.append(data)
+        self.output = os.path.join(self.tmpdir.name, 'mef.fits.fz')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testPassthrough(self):
+        utils.makeMEF(filenames=self.inputs, outname=self.output, extnames=['SCI', 'WGT'],
+                      passthrough=True)
+        with fits.open(self.output) as hdulist:
+            self.assertEqual(len(hdulist), 3)
+            self.assertIsInstance(hdulist['SCI'], fits.CompImageHDU)
+            self.assertEqual(hdulist['WGT'].header['DES_EXT'], 'WEIGHT')
+            for k in range(2):
+                self.assertTrue((hdulist[k + 1].data == self.data[k]).all())
+
+    def testUncompressedInputs(self):
+        inputs = []
+        for k, shape in enumerate([(20, 30), (30,), (2, 3, 4)]):
+            inputs.append(os.path.join(self.tmpdir.name, 'plain%d.fits' % k))
+            fits.PrimaryHDU(np.arange(np.prod(shape), dtype='i2').reshape(shape)).writeto(inputs[-1])
+        output = os.path.join(self.tmpdir.name, 'plain.fits')
+        utils.makeMEF(filenames=inputs + self.inputs, outname=output, extnames=['SCI', 'WGT', 'MSK', 'A', 'B'],
+                      passthrough=True, checksum=True)
+        with fits.open(output) as hdulist:
+            hdulist.verify('exception')
+            self.assertEqual([hdu.name for hdu in hdulist[1:]], ['SCI', 'WGT', 'MSK', 'A', 'B'])
+            self.assertEqual(hdulist['WGT'].header['DES_EXT'], 'WEIGHT')
+            self.assertEqual(hdulist['MSK'].data.shape, (2, 3, 4))
+            self.assertTrue((hdulist['B'].data == self.data[1]).all())
+        self.assertEqual(checksums.check_file(output)[1], '')
+
+    def testTilesUntouched(self):
+        utils.makeMEF(filenames=self.inputs, outname=self.output, passthrough=True)
+        out = list(blocks.iter_hdus(self.output))[2]
+        inp = list(blocks.iter_hdus(self.inputs[1]))[1]
+        with open(self.output, 'rb') as fh1, open(self.inputs[1], 'rb') as fh2:
+            fh1.seek(out.data_offset)
+            fh2.seek(inp.data_offset)
+            self.assertEqual(fh1.read(out.data_size), fh2.read(inp.data_size))
+
+    def testChecksum(self):
+        utils.makeMEF(filenames=self.inputs, outname=self.output, extnames=['SCI', 'WGT'],
+                      passthrough=True, checksum=True)
+        results, error = checksums.check_file(self.output)
+        self.assertEqual(error, '')
+        self.assertEqual([res.checksum for res in results], [True, True, True])
+
+    def testKeepsChecksum(self):
+        # a CHECKSUM in the input is recomputed after EXTNAME is set
+        fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(self.data[0])]).writeto(
+            self.inputs[0], overwrite=True, checksum=True)
+        utils.makeMEF(filenames=self.inputs[:1], outname=self.output, extnames=['SCI'], passthrough=True)
+        results = checksums.verify_file(self.output)
+        self.assertEqual((results[1].datasum, results[1].checksum), (True, True))
+
+
+def scamp_solution(k, end=True):
+    """Return the text of one SCAMP solution.
+    """
+    text = ("HISTORY   Astrometric solution by SCAMP version 2.0.4\n"
+            "CRVAL1  =   %d.0 / WCS Reference Coordinate (RA)\n"
+            "FLXSCALE=   1.0 / SCAMP relative flux scale\n" % k)
+    if end:
+        text += "END     \n"
+    return text
+
+
+class SplitScampHeadTest(unittest.TestCase):
+    """Tests for splitScampHead() and get_scamp_head_segments() functions.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.head = os.path.join(self.tmpdir.name, 'scamp.head')
+        self.outs = [os.path.join(self.tmpdir.name, 'ccd%d.head' % k) for k in range(3)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, text):
+        with open(self.head, 'w') as fh:
+            fh.write(text)
+
+    def testSplit(self):
+        self.write(''.join([scamp_solution(k) for k in range(3)]))
+        utils.splitScampHead(self.head, ','.join(self.outs))
+        for k, out in enumerate(self.outs):
+            with open(out) as fh:
+                self.assertEqual(fh.read(), scamp_solution(k))
+
+    def testSegments(self):
+        self.write(''.join([scamp_solution(k) for k in range(3)]))
+        segments = utils.get_scamp_head_segments(self.head)
+        self.assertEqual(segments[1], scamp_solution(1).encode('ascii'))
+        hdrs = utils.get_scamp_head_segments(self.head, as_headers=True)
+        self.assertEqual(hdrs[2]['CRVAL1'], 2.0)
+
+    def testMissingEnd(self):
+        self.write(scamp_solution(0) + scamp_solution(1, end=False) + scamp_solution(2))
+        with self.assertRaisesRegex(ValueError, r"END lines \(1\) does not match number of HISTORY lines \(2\)"):
+            utils.splitScampHead(self.head, ','.join(self.outs))
+
+    def testWrongCount(self):
+        self.write(''.join([scamp_solution(k) for k in range(2)]))
+        with self.assertRaisesRegex(ValueError, "Number of head files made"):
+            utils.splitScampHead(self.head, ','.join(self.outs))
+
+
+class ApplyScampHeadTest(unittest.TestCase):
+    """Tests for apply_scamp_head() function.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        self.head = os.path.join(self.tmpdir.name, 'mef.head')
+        rng = np.random.default_rng(0)
+        self.data = [rng.random((20, 30)).astype('f4') for k in range(2)]
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(self.data[0], name='A'),
+                      fits.ImageHDU(self.data[1], name='B')]).writeto(self.mef)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, ncards):
+        with open(self.head, 'w') as fh:
+            for k in range(2):
+                fh.write(scamp_solution(k, end=False))
+                for j in range(ncards):
+                    fh.write("PV1_%-3d =   %f / Projection distortion parameter\n" % (j, j * 0.1))
+                fh.write("END     \n")
+
+    def check(self):
+        with fits.open(self.mef) as hdulist:
+            for k in range(2):
+                self.assertEqual(hdulist[k + 1].header['CRVAL1'], float(k))
+                self.assertEqual(hdulist[k + 1].header['FLXSCALE'], 1.0)
+                self.assertTrue((hdulist[k + 1].data == self.data[k]).all())
+
+    def testInPlace(self):
+        self.write(3)
+        size = os.path.getsize(self.mef)
+        self.assertTrue(utils.apply_scamp_head(self.head, self.mef))
+        self.assertEqual(os.path.getsize(self.mef), size)
+        self.check()
+
+    def testRewrite(self):
+        self.write(40)
+        self.assertFalse(utils.apply_scamp_head(self.head, self.mef))
+        self.check()
+        with fits.open(self.mef) as hdulist:
+            self.assertEqual(hdulist['B'].header['PV1_39'], 3.9)
+
+    def testChecksum(self):
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(self.data[0], name='A'),
+                      fits.ImageHDU(self.data[1], name='B')]).writeto(self.mef, overwrite=True, checksum=True)
+        for ncards, inplace in ((3, True), (40, False)):
+            self.write(ncards)
+            self.assertEqual(utils.apply_scamp_head(self.head, self.mef), inplace)
+            self.assertEqual(checksums.check_file(self.mef)[1], '')
+
+    def testWrongCount(self):
+        self.write(3)
+        with self.assertRaises(ValueError):
+            utils.apply_scamp_head(self.head, self.mef, hdus=[1])
+
+
+class EditHeaderTest(unittest.TestCase):
+    """Tests for edit_header() and related functions.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        rng = np.random.default_rng(0)
+        self.data = [rng.random((20, 30)).astype('f4') for k in range(2)]
+        phdu = fits.PrimaryHDU()
+        phdu.header['OBSERVER'] = ('someone', 'who observed')
+        fits.HDUList([phdu, fits.ImageHDU(self.data[0], name='A'),
+                      fits.ImageHDU(self.data[1], name='B')]).writeto(self.mef, checksum=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def checkData(self):
+        with fits.open(self.mef) as hdulist:
+            for k in range(2):
+                self.assertTrue((hdulist[k + 1].data == self.data[k]).all())
+        self.assertEqual(checksums.check_file(self.mef)[1], '')
+
+    def testEdit(self):
+        size = os.path.getsize(self.mef)
+        edits = [(None, 'update', 'OBSERVER', 'nobody'),
+                 ('B', 'set', 'GAIN', 4.2, 'e-/ADU'),
+                 (1, 'set', 'HISTORY', 'edited'),
+                 ('b', 'delete', 'EXTNAME')]
+        self.assertTrue(utils.edit_header(self.mef, edits))
+        self.assertEqual(os.path.getsize(self.mef), size)
+        with fits.open(self.mef) as hdulist:
+            self.assertEqual(hdulist[0].header['OBSERVER'], 'nobody')
+            self.assertEqual(hdulist[0].header.comments['OBSERVER'], 'who observed')
+            self.assertEqual(hdulist[2].header['GAIN'], 4.2)
+            self.assertEqual(hdulist[2].header.comments['GAIN'], 'e-/ADU')
+            self.assertNotIn('EXTNAME', hdulist[2].header)
+            self.assertEqual(list(hdulist[1].header['HISTORY']), ['edited'])
+        self.checkData()
+
+    def testGrow(self):
+        for fallback in ('rewrite', 'shift'):
+            values = dict([('KEY%d' % k, (k, 'number %d' % k)) for k in range(50)])
+            self.assertFalse(utils.set_hdr_values(self.mef, values, 'A', fallback=fallback))
+            self.assertEqual(utils.get_hdr_value(self.mef, 'KEY49', 'A'), 49)
+            self.checkData()
+            self.assertTrue(utils.delete_hdr_keys(self.mef, list(values), 'A'))
+            self.assertNotIn('KEY0', utils.get_hdr(self.mef, 'A'))
+            self.checkData()
+
+    def testErrors(self):
+        with self.assertRaises(KeyError):
+            utils.edit_header(self.mef, [('A', 'update', 'NOPE', 1)])
+        with self.assertRaises(KeyError):
+            utils.delete_hdr_keys(self.mef, ['NOPE'], 'A')
+        self.assertTrue(utils.delete_hdr_keys(self.mef, ['NOPE'], 'A', errors='ignore'))
+        with self.assertRaises(KeyError):
+            utils.set_hdr_values(self.mef, {'KEY': 1}, 'C')
+        with self.assertRaises(IndexError):
+            utils.set_hdr_values(self.mef, {'KEY': 1}, 3)
+        for keyword in ('NAXIS1', 'BITPIX', 'CHECKSUM', 'A_VERY_LONG_KEY'):
+            with self.assertRaises(ValueError):
+                utils.set_hdr_values(self.mef, {keyword: 1}, 'A')
+        with self.assertRaises(ValueError):
+            utils.edit_header(self.mef, [('A', 'rename', 'KEY', 1)])
+
+    def testBatch(self):
+        other = os.path.join(self.tmpdir.name, 'other.fits')
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(self.data[0], name='A')]).writeto(other)
+        jobs = [(self.mef, [(0, 'set', 'RUN', 1)]), (other, [('A', 'set', 'RUN', 2)]),
+                (self.mef, [('B', 'set', 'RUN', 3)])]
+        for nproc in (1, 2):
+            results = utils.edit_headers(jobs, nproc=nproc)
+            self.assertEqual(results, {self.mef: True, other: True})
+            self.assertEqual(utils.get_hdr_value(self.mef, 'RUN', 0), 1)
+            self.assertEqual(utils.get_hdr_value(self.mef, 'RUN', 'B'), 3)
+            self.assertEqual(utils.get_hdr_value(other, 'RUN', 'A'), 2)
+
+
+class CombineCatsShardTest(unittest.TestCase):
+    """Tests for the sharded output of combine_cats().
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.incats = []
+        for k in range(7):
+            incat = os.path.join(self.tmpdir.name, 'cat%d.fits' % k)
+            make_ldac_cat(incat, nrows=5 + 100 * k, seed=k)
+            self.incats.append(incat)
+        self.outcat = os.path.join(self.tmpdir.name, 'combined.fits')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check(self, manifest, checksum=False):
+        incats = []
+        for shard in manifest['shards']:
+            self.assertEqual(shard['status'], 'done')
+            self.assertEqual(os.path.getsize(shard['filename']), shard['bytes'])
+            with fits.open(shard['filename']) as hdulist:
+                self.assertEqual(len(hdulist), shard['nhdus'])
+            if checksum:
+                self.assertEqual(checksums.check_file(shard['filename'])[1], '')
+            else:
+                # a shard is what combine_cats writes for its catalogs alone
+                single = os.path.join(self.tmpdir.name, 'single.fits')
+                utils.combine_cats(','.join(shard['incats']), single)
+                with open(single, 'rb') as fh1, open(shard['filename'], 'rb') as fh2:
+                    self.assertEqual(fh1.read(), fh2.read())
+            incats.extend(shard['incats'])
+        self.assertEqual(incats, self.incats)
+        with open(utils.manifest_name(self.outcat)) as fh:
+            self.assertEqual(json.load(fh), manifest)
+
+    def testMaxHdus(self):
+        manifest = utils.combine_cats(','.join(self.incats), self.outcat, max_hdus=7)
+        self.assertEqual([len(s['incats']) for s in manifest['shards']], [2, 2, 2, 1])
+        self.assertEqual(manifest['shards'][1]['filename'], os.path.join(self.tmpdir.name, 'combined_0001.fits'))
+        self.check(manifest)
+        with self.assertRaises(ValueError):
+            utils.combine_cats(','.join(self.incats), self.outcat, max_hdus=2)
+
+    def testMaxBytes(self):
+        for nproc, checksum in ((1, False), (2, True)):
+            manifest = utils.combine_cats(','.join(self.incats), self.outcat, max_bytes=50000, nproc=nproc,
+                                          checksum=checksum)
+            self.assertGreater(len(manifest['shards']), 1)
+            for shard in manifest['shards']:
+                self.assertTrue(shard['bytes'] <= 50000 or len(shard['incats']) == 1)
+            self.check(manifest, checksum)
+
+    def testPlan(self):
+        sizes = [(10, 12), (50, 52), (10, 12), (200, 202), (10, 12)]
+        self.assertEqual(utils.plan_shards(sizes, max_bytes=100), [[0, 1, 2], [3], [4]])
+        self.assertEqual(utils.plan_shards(sizes, max_bytes=100, max_hdus=6), [[0, 1], [2], [3], [4]])
+        self.assertEqual(utils.plan_shards(sizes), [[0, 1, 2, 3, 4]])
+
+    def testModes(self):
+        with self.assertRaises(ValueError):
+            utils.combine_cats(','.join(self.incats), self.outcat, mode='merge', max_hdus=6)
+        with self.assertRaises(ValueError):
+            utils.combine_cats(','.join(self.incats), self.outcat, compress='RICE_1', max_hdus=6)
@@ -0,0 +1,64 @@
+import math
+import os
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.harvest as harvest
+
+
+TESTDIR = os.path.dirname(__file__)
+
+
+class HarvestHeadersTest(unittest.TestCase):
+    """Tests for harvest_headers() and write_table() functions.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for k in range(4):
+            hdu = fits.PrimaryHDU(np.zeros((k + 1, 2), dtype='f4'))
+            hdu.header['EXPNUM'] = 1000 + k
+            if k != 2:
+                hdu.header['FILTER'] = 'r DECam SDSS c0002 6415.0 1480.0'
+            hdu.writeto(os.path.join(self.tmpdir.name, 'im%d.fits' % k))
+        with open(os.path.join(self.tmpdir.name, 'im9.fits'), 'w') as fh:
+            fh.write('not a fits file')
+        self.pattern = os.path.join(self.tmpdir.name, 'im*.fits')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testTable(self):
+        table = harvest.harvest_headers([self.pattern], ['expnum', 'NAXIS2', 'FILTER'])
+        self.assertEqual(table.dtype.names, ('FILENAME', 'EXPNUM', 'NAXIS2', 'FILTER', 'ERROR'))
+        self.assertEqual(len(table), 5)
+        self.assertEqual(list(table['NAXIS2'][:4]), [1, 2, 3, 4])
+        self.assertEqual(table['FILTER'][2], '')
+        self.assertIn('FILTER', table['ERROR'][2])
+        self.assertEqual(table['ERROR'][0], '')
+        self.assertTrue(math.isnan(table['EXPNUM'][4]))
+        self.assertNotEqual(table['ERROR'][4], '')
+
+    def testSpecialOnly(self):
+        filename = os.path.join(self.tmpdir.name, 'im0.fits')
+        self.assertEqual(harvest.harvest_file(filename, None, special=['band']), ({'band': 'r'}, ''))
+        table = harvest.harvest_headers([self.pattern], None, special=['band'])
+        self.assertEqual(table.dtype.names, ('FILENAME', 'band', 'ERROR'))
+        self.assertEqual(table['band'][0], 'r')
+
+    def testParallel(self):
+        serial = harvest.harvest_headers([self.pattern], ['EXPNUM', 'FILTER'])
+        parallel = harvest.harvest_headers([self.pattern], ['EXPNUM', 'FILTER'], nproc=2, chunksize=2)
+        self.assertEqual(serial.tolist()[:4], parallel.tolist()[:4])
+
+    def testWrite(self):
+        table = harvest.harvest_headers([self.pattern], ['EXPNUM', 'FILTER'])
+        fitsname = os.path.join(self.tmpdir.name, 'table.fits')
+        csvname = os.path.join(self.tmpdir.name, 'table.csv')
+        harvest.write_table(table, fitsname)
+        harvest.write_table(table, csvname)
+        self.assertEqual(list(fits.getdata(fitsname)['FILENAME']), list(table['FILENAME']))
+        with open(csvname) as fh:
+            self.assertEqual(fh.readline().strip(), 'FILENAME,EXPNUM,FILTER,ERROR')
+            self.assertEqual(len(fh.readlines()), 5)
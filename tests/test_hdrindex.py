@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.hdrindex as hdrindex
+
+
+class HeaderIndexTest(unittest.TestCase):
+    """Tests for the HeaderIndex class.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'raw')
+        os.makedirs(os.path.join(self.root, 'nite2'))
+        self.dbname = os.path.join(self.tmpdir.name, 'index.db')
+        for k in range(4):
+            self.write(k)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, k, nrows=None):
+        hdu = fits.PrimaryHDU(np.zeros((nrows or k + 1, 2), dtype='f4'))
+        hdu.header['EXPNUM'] = 1000 + k
+        hdu.header['DATE-OBS'] = '2024-01-0%dT03:00:00' % (k + 1)
+        subdir = 'nite2' if k % 2 else ''
+        filename = os.path.join(self.root, subdir, 'im%d.fits' % k)
+        hdu.writeto(filename, overwrite=True)
+        return filename
+
+    def testUpdate(self):
+        with hdrindex.HeaderIndex(self.dbname, keys=['expnum', 'DATE-OBS'], special=['objects']) as index:
+            counts = index.update(self.root)
+            self.assertEqual(counts, {'added': 4, 'updated': 0, 'removed': 0, 'unchanged': 0})
+            self.assertEqual(len(index), 4)
+            rows = index.query('objects > ?', (2,), columns=['EXPNUM', 'objects'], order_by='EXPNUM')
+            self.assertEqual(rows, [{'EXPNUM': 1002, 'objects': 3}, {'EXPNUM': 1003, 'objects': 4}])
+            self.assertEqual(index.find(EXPNUM=1001), [os.path.join(self.root, 'nite2', 'im1.fits')])
+            rows = index.query('"DATE-OBS" < ?', ('2024-01-02',), columns=['error'])
+            self.assertEqual(rows, [{'error': None}])
+
+        # Only the changed, new and removed files are touched on update
+        self.write(0, nrows=10)
+        self.write(5)
+        os.remove(os.path.join(self.root, 'nite2', 'im3.fits'))
+        with hdrindex.HeaderIndex(self.dbname) as index:
+            self.assertEqual(index.keys, ['EXPNUM', 'DATE-OBS'])
+            counts = index.update([self.root])
+            self.assertEqual(counts, {'added': 1, 'updated': 1, 'removed': 1, 'unchanged': 2})
+            self.assertEqual(index.find(EXPNUM=1000, objects=10), [os.path.join(self.root, 'im0.fits')])
+            self.assertEqual(len(index), 4)
+
+    def testNewColumns(self):
+        with hdrindex.HeaderIndex(self.dbname, keys=['EXPNUM'], special=[]) as index:
+            index.update([self.root], nproc=2)
+        with hdrindex.HeaderIndex(self.dbname, keys=['NAXIS1']) as index:
+            self.assertEqual(index.keys, ['EXPNUM', 'NAXIS1'])
+            counts = index.update([self.root])
+            self.assertEqual(counts['updated'], 4)
+            self.assertEqual([r['NAXIS1'] for r in index.query(columns=['NAXIS1'])], [2, 2, 2, 2])
+            with self.assertRaises(ValueError):
+                hdrindex.HeaderIndex(self.dbname, keys=['BAND'], special=['band'])
+            with self.assertRaises(ValueError):
+                hdrindex.HeaderIndex(self.dbname, whichhdu=1)
+
+    def testMissing(self):
+        with hdrindex.HeaderIndex(self.dbname, keys=['EXPNUM', 'NOTTHERE'], special=[]) as index:
+            index.update([self.root])
+            rows = index.query(columns=['NOTTHERE', 'error'])
+            self.assertEqual(rows[0]['NOTTHERE'], None)
+            self.assertIn('NOTTHERE', rows[0]['error'])
@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+import despyfitsutils.fitsutils as utils
+import despyfitsutils.fits_blocks as blocks
+import despyfitsutils.hduindex as hduindex
+import despyfitsutils.instrument as instrument
+from test_fitsutils import make_ldac_cat
+
+
+class HDUIndexTest(unittest.TestCase):
+    """Tests for the HDU offset index and its sidecar file.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        hdus = [fits.PrimaryHDU()]
+        hdus += [fits.ImageHDU(np.full((4, 5), k, dtype='i4'), name='S%d' % k) for k in range(40)]
+        hdus.append(fits.CompImageHDU(np.arange(600, dtype='f4').reshape(20, 30), name='WGT'))
+        fits.HDUList(hdus).writeto(self.mef)
+
+        hduindex.enable_sidecars()
+
+    def tearDown(self):
+        # back to the DESPYFITSUTILS_HDUINDEX setting
+        hduindex._USE_SIDECARS = None
+        self.tmpdir.cleanup()
+
+    def touch(self):
+        # a later mtime, whatever the resolution of the file system
+        stat = os.stat(self.mef)
+        os.utime(self.mef, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def testBuild(self):
+        index = hduindex.build_index(self.mef)
+        infos = list(blocks.iter_hdus(self.mef))
+        self.assertEqual(len(index), len(infos))
+        for entry, info in zip(index.entries, infos):
+            self.assertEqual(tuple(entry), info[:5])
+        self.assertEqual(index.find('s12').index, 13)
+        self.assertEqual(index.find(-1).name, 'WGT')
+        self.assertEqual(index.find().index, 0)
+        with self.assertRaises(KeyError):
+            index.find('S99')
+        with self.assertRaises(IndexError):
+            index.find(42)
+
+    def testSidecar(self):
+        self.assertIsNone(hduindex.load_index(self.mef))
+        hduindex.write_index(self.mef)
+        self.assertTrue(os.path.exists(self.mef + hduindex.INDEX_SUFFIX))
+        index = hduindex.load_index(self.mef)
+        self.assertEqual(index.find('S39').index, 40)
+
+        # only the header of the selected HDU is read
+        info = blocks.find_hdu(self.mef, 'S30')
+        with instrument.collect() as report:
+            self.assertEqual(hduindex.find_hdu(self.mef, 'S30'), info)
+        self.assertEqual(report.counters['bytes_read'], len(info.header))
+
+        self.touch()
+        self.assertIsNone(hduindex.load_index(self.mef))
+        self.assertEqual(hduindex.find_hdu(self.mef, 'S30'), info)
+        self.assertTrue(hduindex.refresh_index(self.mef))
+        self.assertIsNotNone(hduindex.load_index(self.mef))
+
+    def testNoSidecar(self):
+        info = blocks.find_hdu(self.mef, 'S30')
+        self.assertEqual(hduindex.find_hdu(self.mef, 'S30'), info)
+        # the missing sidecar is remembered while the file is unchanged
+        index = hduindex.build_index(self.mef)
+        with open(self.mef + hduindex.INDEX_SUFFIX, 'w') as fh:
+            json.dump(index.to_dict(), fh)
+        self.assertIsNone(hduindex.load_index(self.mef))
+        self.touch()
+        self.assertIsNone(hduindex.load_index(self.mef))
+        hduindex.write_index(self.mef)
+        self.assertIsNotNone(hduindex.load_index(self.mef))
+
+        # disabled, sidecars are never looked at
+        hduindex.disable_sidecars()
+        with instrument.collect() as report:
+            self.assertEqual(hduindex.find_hdu(self.mef, 'S30'), info)
+        self.assertGreater(report.counters['bytes_read'], len(info.header))
+
+    def testReadHelpers(self):
+        hduindex.write_index(self.mef)
+        self.assertEqual(utils.get_hdr_value(self.mef, 'EXTNAME', 'S7'), 'S7')
+        self.assertEqual(utils.get_hdr(self.mef, 'WGT')['NAXIS1'], 30)
+        hdu = utils.read_hdu(self.mef, 'S25')
+        self.assertEqual(hdu.name, 'S25')
+        self.assertTrue((hdu.data == 25).all())
+        hdu = utils.read_hdu(self.mef, 'WGT')
+        self.assertIsInstance(hdu, fits.CompImageHDU)
+        self.assertTrue((hdu.data == np.arange(600).reshape(20, 30)).all())
+        self.assertIsNone(utils.read_hdu(self.mef).data)
+
+    def testEditRefreshesSidecar(self):
+        hduindex.write_index(self.mef)
+        values = dict([('KEY%d' % k, k) for k in range(50)])
+        self.assertFalse(utils.set_hdr_values(self.mef, values, 'S3'))
+        index = hduindex.load_index(self.mef)
+        self.assertIsNotNone(index)
+        self.assertEqual(index.entries, hduindex.build_index(self.mef).entries)
+        self.assertTrue((utils.read_hdu(self.mef, 'S4').data == 4).all())
+
+    def testWriters(self):
+        incats = []
+        for k in range(3):
+            incats.append(os.path.join(self.tmpdir.name, 'cat%d.fits' % k))
+            make_ldac_cat(incats[-1], nrows=10, seed=k)
+        outcat = os.path.join(self.tmpdir.name, 'combined.fits')
+        for mode in ('stream', 'merge'):
+            utils.combine_cats(','.join(incats), outcat, mode=mode, index=True)
+            index = hduindex.load_index(outcat)
+            self.assertEqual(index.entries, hduindex.build_index(outcat).entries)
+
+        inputs = []
+        for k in range(2):
+            inputs.append(os.path.join(self.tmpdir.name, 'ccd%d.fits' % k))
+            fits.PrimaryHDU(np.full((4, 5), k, dtype='i2')).writeto(inputs[-1])
+        output = os.path.join(self.tmpdir.name, 'out.fits')
+        utils.makeMEF(filenames=inputs, outname=output, extnames=['SCI', 'WGT'], index=True)
+        self.assertEqual(hduindex.load_index(output).find('WGT').index, 1)
+        self.assertTrue((utils.read_hdu(output, 'WGT').data == 1).all())
+
@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+import despyfitsutils
+import despyfitsutils.fitsutils as utils
+from despyfitsutils import _lazy
+
+
+# Importing the package (and its light modules) in a fresh interpreter
+# must take less than this fraction of the time astropy.io.fits alone
+# takes, which it cannot if it imports astropy or numpy.
+IMPORT_BUDGET = 0.5
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import despyfitsutils
+import despyfitsutils.fits_special_metadata
+import despyfitsutils.harvest
+import despyfitsutils.hdrindex
+import despyfitsutils.instrument
+import despyfitsutils.hduindex
+import despyfitsutils.aio
+elapsed = time.perf_counter() - start
+heavy = sorted(set([m.split('.')[0] for m in sys.modules]) & set(['astropy', 'numpy', 'despymisc']))
+print(json.dumps({'elapsed': elapsed, 'heavy': heavy}))
+"""
+
+
+ASTROPY_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import astropy.io.fits
+print(json.dumps({'elapsed': time.perf_counter() - start}))
+"""
+
+
+def run_import(script=IMPORT_SCRIPT):
+    """Run an import script in a fresh interpreter; return what it reports.
+    """
+    output = subprocess.check_output([sys.executable, '-c', script], env=dict(os.environ))
+    return json.loads(output.decode())
+
+
+class LazyImportTest(unittest.TestCase):
+    """Tests for the deferred imports of the heavy dependencies.
+    """
+
+    def testNoHeavyImports(self):
+        self.assertEqual(run_import()['heavy'], [])
+
+    def testImportBudget(self):
+        # best of a few runs of each, to not fail on a one-off hiccup of the machine
+        elapsed = min([run_import()['elapsed'] for _ in range(3)])
+        astropy = min([run_import(ASTROPY_SCRIPT)['elapsed'] for _ in range(3)])
+        self.assertLess(elapsed, IMPORT_BUDGET * astropy)
+
+    def testPublicApi(self):
+        namespace = {}
+        exec('from despyfitsutils import *', namespace)
+        for name in ('makeMEF', 'combine_cats', 'splitScampHead', 'get_hdr', 'get_hdr_value'):
+            self.assertIs(namespace[name], getattr(utils, name))
+        # the modules the package always exported are still there
+        for name in ('re', 'os', 'sys', 'astropy', 'fits', 'miscutils', 'fitsutils'):
+            self.assertIn(name, namespace)
+        self.assertIs(namespace['fits'].open, utils.fits.open)
+        for name in utils.__all__:
+            self.assertIs(getattr(despyfitsutils, name), getattr(utils, name))
+
+    def testProxy(self):
+        from astropy.io import fits
+        self.assertIs(utils.fits.open, fits.open)
+        self.assertIs(utils.fits.Header, fits.Header)
+        proxy = _lazy.LazyModule('json')
+        self.assertIn('not loaded', repr(proxy))
+        self.assertEqual(proxy.dumps([1]), '[1]')
+        self.assertIn('dumps', dir(proxy))
@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import despyfitsutils.fitsutils as utils
+import despyfitsutils.fits_blocks as blocks
+import despyfitsutils.instrument as instrument
+from test_fitsutils import make_ldac_cat
+
+
+TESTDIR = os.path.dirname(__file__)
+
+
+class CollectTest(unittest.TestCase):
+    """Tests for the collect() context manager and the hooks.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.valid = os.path.join(TESTDIR, 'data/input.fits.fz')
+        self.cats = [os.path.join(self.tmpdir.name, 'cat%d.fits' % k) for k in range(2)]
+        for k, cat in enumerate(self.cats):
+            make_ldac_cat(cat, nrows=20, seed=k)
+        self.outcat = os.path.join(self.tmpdir.name, 'combined.fits')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testDisabled(self):
+        self.assertFalse(instrument.enabled())
+        utils.get_hdr_value(self.valid, 'NAXIS')
+        with instrument.collect() as report:
+            self.assertTrue(instrument.enabled())
+        self.assertFalse(instrument.enabled())
+        self.assertEqual(report.counters, {})
+        self.assertEqual(report.timings, {})
+
+    def testCounters(self):
+        with instrument.collect() as report:
+            utils.get_hdr_value(self.valid, 'NAXIS')
+            utils.combine_cats(','.join(self.cats), self.outcat)
+        self.assertEqual(report.counters['hdus_copied'], 6)
+        self.assertEqual(report.counters['bytes_written'], os.path.getsize(self.outcat))
+        # headers and unpadded data segments, plus the Primary header of self.valid
+        nread = sum([len(i.header) + i.data_size for c in self.cats for i in blocks.iter_hdus(c)])
+        nread += len(blocks.find_hdu(self.valid).header)
+        self.assertEqual(report.counters['bytes_read'], nread)
+        # the headers read by the preflight check are not read again
+        with instrument.collect() as preflight:
+            utils.get_hdr_value(self.valid, 'NAXIS')
+            utils.combine_cats(','.join(self.cats), self.outcat, preflight=True)
+        self.assertEqual(preflight.counters['bytes_read'], nread)
+        self.assertGreaterEqual(report.counters['file_opens'], 5)
+        self.assertEqual(report.timings['fitsutils.get_hdr_value']['calls'], 1)
+        self.assertEqual(report.timings['fitsutils.combine_cats']['calls'], 1)
+        self.assertIn('fitsutils.combine_cats', report.format())
+
+    def testNested(self):
+        with instrument.collect() as outer:
+            utils.get_hdr_value(self.valid, 'NAXIS')
+            with instrument.collect() as inner:
+                utils.get_hdr_value(self.valid, 'NAXIS')
+        self.assertEqual(outer.timings['fitsutils.get_hdr_value']['calls'], 2)
+        self.assertEqual(inner.timings['fitsutils.get_hdr_value']['calls'], 1)
+
+    def testSink(self):
+        sink = io.StringIO()
+        with instrument.collect(sink=sink):
+            utils.get_hdr_value(self.valid, 'NAXIS')
+        records = [json.loads(line) for line in sink.getvalue().splitlines()]
+        self.assertEqual([r['type'] for r in records][-1], 'report')
+        self.assertIn('fitsutils.get_hdr_value', [r.get('name') for r in records])
+
+        sinkname = os.path.join(self.tmpdir.name, 'sink.jsonl')
+        with instrument.collect(sink=sinkname) as report:
+            utils.get_hdr_value(self.valid, 'NAXIS')
+        with open(sinkname) as sinkfh:
+            last = json.loads(sinkfh.readlines()[-1])
+        self.assertEqual(last['counters'], dict(report.counters))
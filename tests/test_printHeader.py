@@ -0,0 +1,93 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
+
+
+TESTDIR = os.path.dirname(__file__)
+SCRIPT = os.path.join(TESTDIR, '..', 'bin', 'printHeader.py')
+
+
+def load_script():
+    """Import bin/printHeader.py as a module.
+    """
+    spec = importlib.util.spec_from_file_location('printHeader', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@unittest.skipUnless(fitsio, "fitsio is not installed")
+class PrintHeaderTest(unittest.TestCase):
+    """Tests for the printHeader.py script.
+    """
+
+    def setUp(self):
+        self.script = load_script()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mef = os.path.join(self.tmpdir.name, 'mef.fits')
+        hdus = [fits.PrimaryHDU()]
+        for extname in ('SCI', 'MSK', 'WGT'):
+            hdu = fits.ImageHDU(np.zeros((4, 5), dtype='f4'), name=extname)
+            hdu.header['GAINA'] = 4.0
+            hdu.header['GAINB'] = 4.1
+            hdu.header['RDNOISEA'] = 6.0
+            hdus.append(hdu)
+        fits.HDUList(hdus).writeto(self.mef)
+        self.valid = os.path.join(TESTDIR, 'data/input.fits.fz')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_script(self, *args):
+        proc = subprocess.run([sys.executable, SCRIPT] + list(args), stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        return proc.returncode, proc.stdout, proc.stderr
+
+    def testParseExtensions(self):
+        self.assertIsNone(self.script.parse_extensions('ALL'))
+        self.assertEqual(self.script.parse_extensions('0'), [0])
+        self.assertEqual(self.script.parse_extensions(' 1, sci ,w*,-1'), [1, 'SCI', 'W*', -1])
+
+    def testSelectHdus(self):
+        with fitsio.FITS(self.mef) as fh:
+            self.assertEqual(len(self.script.select_hdus(fh, None)), 4)
+            self.assertEqual([k for k, _ in self.script.select_hdus(fh, [-1, 'SCI', 3])], [3, 1])
+            self.assertEqual([k for k, _ in self.script.select_hdus(fh, ['*S*'])], [1, 2])
+            with self.assertRaises(IndexError):
+                self.script.select_hdus(fh, [4])
+            with self.assertRaises(KeyError):
+                self.script.select_hdus(fh, ['VAR*'])
+
+    def testFilterHeader(self):
+        hdr = fitsio.read_header(self.mef, ext=1)
+        self.assertIs(self.script.filter_header(hdr, None), hdr)
+        filtered = self.script.filter_header(hdr, ['GAIN?', 'EXTNAME'])
+        self.assertEqual(sorted(filtered.keys()), ['EXTNAME', 'GAINA', 'GAINB'])
+
+    def testBanner(self):
+        # one header: no banner, whatever the selector
+        for extension in ('0', 'all', '-1'):
+            status, out, err = self.run_script('-x', extension, self.valid)
+            self.assertEqual((status, err), (0, ''))
+            self.assertNotIn('==>', out)
+            self.assertIn('SIMPLE', out)
+        status, out, _ = self.run_script('-x', 'all', '-k', 'EXTNAME', self.mef)
+        self.assertEqual(out.count('==>'), 4)
+        status, out, _ = self.run_script(self.valid, self.valid)
+        self.assertEqual(out.count('==> %s[0]' % self.valid), 2)
+
+    def testBadFile(self):
+        status, out, err = self.run_script(self.valid, os.path.join(TESTDIR, 'data/notafile.fits.fz'))
+        self.assertEqual(status, 1)
+        self.assertIn('SIMPLE', out)
+        self.assertIn('notafile.fits.fz', err)